@@ -0,0 +1,95 @@
+"""Benchmark the neighbours aggregation step: time and peak memory.
+
+Compare the reference dict of lists implementation
+(`_transform_user_starred_repositories` + `_compute_and_order_neighbours`)
+with the interned `CoStarCounter`.
+
+Usage::
+
+    python -m benchmarks.bench_aggregation [--users 2000] [--stars 200]
+"""
+
+import argparse
+import itertools
+import random
+import time
+import tracemalloc
+
+from mergify_algos.github.aggregation import CoStarCounter
+from mergify_algos.github.neighbours import (
+    _compute_and_order_neighbours,
+    _transform_user_starred_repositories,
+)
+
+
+def iter_users(users=2000, stars=200, repos=50_000, seed=42):
+    """Synthetic (user, starred_repos) stream, repositories' popularity is skewed.
+
+    Repositories' names are new strings for each user, as when decoded from
+    GitHub JSON responses.
+    """
+    rng = random.Random(seed)
+    population = range(repos)
+    cum_weights = list(itertools.accumulate(1 / (rank + 1) for rank in population))
+    for u in range(users):
+        ids = dict.fromkeys(rng.choices(population, cum_weights=cum_weights, k=stars))
+        yield f"user{u}", [f"owner{i % 997}/repo{i}" for i in ids]
+
+
+def run_reference(users, threshold):
+    user_repo_map = dict(users)
+    repo_user_map = _transform_user_starred_repositories(
+        user_repo_map, exclude_repos=["owner0/repo0"]
+    )
+    return _compute_and_order_neighbours(repo_user_map, users_threshold=threshold)
+
+
+def run_counter(users, threshold):
+    counter = CoStarCounter(exclude_repos=["owner0/repo0"])
+    for user, starred_repos in users:
+        counter.add_user(user, starred_repos)
+    return counter.compute(users_threshold=threshold)
+
+
+def measure(function, make_users, threshold):
+    """Return (seconds, peak allocated bytes, result).
+
+    Time and memory are measured in two runs: tracemalloc slows allocations.
+    Both include the (same) cost of generating the users' lists.
+    """
+    start = time.perf_counter()
+    result = function(make_users(), threshold)
+    seconds = time.perf_counter() - start
+
+    tracemalloc.start()
+    function(make_users(), threshold)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return seconds, peak, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--stars", type=int, default=200)
+    parser.add_argument("--repos", type=int, default=50_000)
+    parser.add_argument("--threshold", type=int, default=2)
+    args = parser.parse_args()
+
+    print(f"{args.users} users x {args.stars} stars, threshold={args.threshold}")
+
+    def make_users():
+        # Users' lists are generated lazily: their memory is only retained by
+        # the aggregation itself.
+        return iter_users(args.users, args.stars, args.repos)
+
+    results = {}
+    for name, function in (("reference", run_reference), ("counter", run_counter)):
+        seconds, peak, results[name] = measure(function, make_users, args.threshold)
+        print(f"{name:>10}: {seconds:8.3f} sec, peak {peak / 2**20:8.1f} MiB")
+
+    assert results["reference"][1] == results["counter"][1]
+
+
+if __name__ == "__main__":
+    main()
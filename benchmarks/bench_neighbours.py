@@ -0,0 +1,301 @@
+"""Benchmark the neighbour algorithms against the offline fake GitHub API.
+
+Runs `find_neighbour_repos`, `afind_neighbour_repos` and
+`find_graphql_neighbour_repos` on a synthetic star graph served by
+`benchmarks.fake_github`, and measures for each of them:
+
+- "seconds": median wall time over `--repeat` runs.
+- "requests": number of requests served by the fake API.
+- "peak_mib": peak allocated memory (separate run, tracemalloc).
+- "aggregation_cpu_seconds": CPU time spent in `CoStarCounter`.
+
+Results can be saved as a JSON baseline, and compared with a previous one:
+the exit status is 1 when an algorithm regresses by more than `--tolerance`
+(or sends more requests).
+
+Usage::
+
+    python -m benchmarks.bench_neighbours [--stargazers 200] [--latency 0.01]
+        [--save baseline.json] [--compare baseline.json]
+"""
+
+import argparse
+import asyncio
+import contextlib
+import json
+import multiprocessing
+import platform
+import socket
+import statistics
+import sys
+import time
+import tracemalloc
+
+import httpx
+import uvicorn
+
+from benchmarks.fake_github import add_graph_arguments, build_fake_github_app_from_args
+from mergify_algos.github.aggregation import CoStarCounter
+from mergify_algos.github.neighbours import (
+    afind_neighbour_repos,
+    find_graphql_neighbour_repos,
+    find_neighbour_repos,
+)
+
+OWNER, REPO = "bench", "target"
+# Compared metrics: lower is better
+METRICS = ("seconds", "requests", "peak_mib", "aggregation_cpu_seconds")
+
+
+def _memory_budget(args):
+    if args.memory_budget_mib is None:
+        return None
+    return int(args.memory_budget_mib * 2**20)
+
+
+def run_sync(base_url, args):
+    return find_neighbour_repos(
+        OWNER,
+        REPO,
+        None,
+        args.pages,
+        args.threshold,
+        base_url=base_url,
+        memory_budget=_memory_budget(args),
+    )
+
+
+def run_async(base_url, args):
+    return asyncio.run(
+        afind_neighbour_repos(
+            OWNER,
+            REPO,
+            None,
+            args.pages,
+            args.threshold,
+            base_url=base_url,
+            memory_budget=_memory_budget(args),
+        )
+    )
+
+
+def run_graphql(base_url, args):
+    return find_graphql_neighbour_repos(
+        OWNER, REPO, None, args.pages, args.threshold, base_url=base_url
+    )
+
+
+ALGORITHMS = {
+    "find_neighbour_repos": run_sync,
+    "afind_neighbour_repos": run_async,
+    "find_graphql_neighbour_repos": run_graphql,
+}
+
+
+# ---
+# Fake GitHub API server
+
+
+def _serve(args, port):
+    uvicorn.run(
+        build_fake_github_app_from_args(args),
+        host="127.0.0.1",
+        port=port,
+        log_level="warning",
+    )
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@contextlib.contextmanager
+def fake_github_server(args, timeout=30.0):
+    """Serve the fake GitHub API in a subprocess, yield its base url"""
+    port = _free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    process = multiprocessing.Process(target=_serve, args=(args, port), daemon=True)
+    process.start()
+    try:
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                httpx.get(f"{base_url}/_stats").raise_for_status()
+                break
+            except httpx.TransportError:
+                if time.monotonic() > deadline or not process.is_alive():
+                    raise RuntimeError("Fake GitHub API server did not start")
+                time.sleep(0.1)
+        yield base_url
+    finally:
+        process.terminate()
+        process.join()
+
+
+# ---
+# Measures
+
+
+@contextlib.contextmanager
+def aggregation_cpu_time():
+    """Accumulate the CPU time spent in `CoStarCounter` (yield a dict)"""
+    measure = {"seconds": 0.0}
+    originals = {name: getattr(CoStarCounter, name) for name in ("add_user", "compute")}
+
+    def timed(method):
+        def wrapper(*args, **kwargs):
+            start = time.thread_time()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                measure["seconds"] += time.thread_time() - start
+
+        return wrapper
+
+    for name, method in originals.items():
+        setattr(CoStarCounter, name, timed(method))
+    try:
+        yield measure
+    finally:
+        for name, method in originals.items():
+            setattr(CoStarCounter, name, method)
+
+
+def _requests_count(base_url):
+    """Return the number of requests served since the last call"""
+    total = httpx.get(f"{base_url}/_stats").json()["total"]
+    httpx.post(f"{base_url}/_reset")
+    return total
+
+
+def measure(function, base_url, args):
+    """Return the metrics of one algorithm, and its sorted results.
+
+    Wall time is the median of `args.repeat` runs, memory is measured in an
+    extra run: tracemalloc slows allocations.
+    """
+    _requests_count(base_url)
+    durations, cpu_times = [], []
+    for _ in range(args.repeat):
+        with aggregation_cpu_time() as cpu_time:
+            start = time.perf_counter()
+            _, sorted_results = function(base_url, args)
+            durations.append(time.perf_counter() - start)
+        cpu_times.append(cpu_time["seconds"])
+    requests = _requests_count(base_url) / args.repeat
+
+    tracemalloc.start()
+    function(base_url, args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    metrics = {
+        "seconds": statistics.median(durations),
+        "requests": requests,
+        "peak_mib": peak / 2**20,
+        "aggregation_cpu_seconds": statistics.median(cpu_times),
+        "neighbours": len(sorted_results),
+    }
+    return metrics, sorted_results
+
+
+def _normalized(sorted_results):
+    """Hashable results, ignoring stargazers' order (completion order)"""
+    return tuple(
+        (r["repo"], r["stargazers_count"], tuple(sorted(r.get("stargazers", []))))
+        for r in sorted_results
+    )
+
+
+# ---
+# Baselines
+
+
+def compare(results, baseline, tolerance):
+    """Return the regressions of `results` against a `baseline` results dict.
+
+    A metric regresses when it exceeds the baseline by more than `tolerance`
+    (relative), except requests: any increase is a regression.
+    """
+    regressions = []
+    for name, metrics in results.items():
+        reference = baseline.get(name)
+        if reference is None:
+            continue
+
+        for metric in METRICS:
+            limit = reference[metric] * (1 if metric == "requests" else 1 + tolerance)
+            if metrics[metric] > limit:
+                regressions.append(
+                    f"{name}: {metric} {metrics[metric]:.3f} > "
+                    f"{reference[metric]:.3f} (baseline)"
+                )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    add_graph_arguments(parser)
+    parser.add_argument("--pages", type=int, default=2)
+    parser.add_argument("--threshold", type=int, default=2)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument(
+        "--memory-budget-mib",
+        type=float,
+        help="Co-stars edges kept in memory before spilling them to disk",
+    )
+    parser.add_argument(
+        "--algorithms", nargs="+", choices=list(ALGORITHMS), default=list(ALGORITHMS)
+    )
+    parser.add_argument("--save", help="Save the results as a JSON baseline")
+    parser.add_argument("--compare", help="Compare with a JSON baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    print(
+        f"{args.stargazers} stargazers x {args.stars} stars, skew={args.skew}, "
+        f"latency={args.latency}s, pages={args.pages}, "
+        f"memory budget={args.memory_budget_mib} MiB"
+    )
+
+    results, neighbours = {}, {}
+    with fake_github_server(args) as base_url:
+        for name in args.algorithms:
+            results[name], neighbours[name] = measure(ALGORITHMS[name], base_url, args)
+            m = results[name]
+            print(
+                f"{name:>30}: {m['seconds']:8.3f} sec, {m['requests']:6.0f} requests, "
+                f"peak {m['peak_mib']:7.1f} MiB, "
+                f"aggregation {m['aggregation_cpu_seconds']:6.3f} cpu sec"
+            )
+
+    if len({_normalized(n) for n in neighbours.values()}) > 1:
+        print("warning: algorithms returned different neighbours")
+
+    if args.save:
+        config = {k: v for k, v in vars(args).items() if k not in ("save", "compare")}
+        with open(args.save, "w") as f:
+            json.dump(
+                {
+                    "config": config,
+                    "python": platform.python_version(),
+                    "results": results,
+                },
+                f,
+                indent=2,
+            )
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline["results"], args.tolerance)
+        for regression in regressions:
+            print(f"regression: {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
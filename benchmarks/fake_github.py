@@ -0,0 +1,359 @@
+"""Offline fake GitHub API, serving a synthetic star graph.
+
+Serves the endpoints used by the neighbour algorithms, so they can be run and
+measured reproducibly without the network:
+
+- `GET /repos/{owner}/{repo}`: repository's `stargazers_count`.
+- `GET /repos/{owner}/{repo}/stargazers`: paginated with `Link` headers,
+`starred_at` with the `star+json` media type.
+- `GET /users/{user}/starred`: paginated with `Link` headers.
+- `POST /graphql`: the `GitHubGraphQLClient` queries.
+
+Responses carry `X-RateLimit-*` headers (per token and resource). Latency,
+jitter and error rate are configurable. `GET /_stats` returns the number of
+requests served, `POST /_reset` resets them with the rate limit budgets.
+
+Usage::
+
+    python -m benchmarks.fake_github [--port 8765] [--stargazers 200]
+
+then run the App against it with `GITHUB_API_URL=http://127.0.0.1:8765`.
+"""
+
+import argparse
+import asyncio
+import collections
+import datetime
+import itertools
+import random
+import time
+import uvicorn
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+from mergify_algos.github.clients import GITHUB_STAR_MEDIA_TYPE
+
+# Star graph target repository
+TARGET_REPO = "bench/target"
+# GitHub GraphQL node limit
+GRAPHQL_MAX_NODES = 500_000
+
+
+class SyntheticStarGraph:
+    """Synthetic star graph around one target repository.
+
+    - The target repository has `stargazers` stargazers.
+    - Each stargazer stars `stars` repositories on average (uniformly between
+    1 and `2 * stars`), drawn among `repos` repositories whose popularity
+    follows a Zipf law of exponent `skew`.
+    """
+
+    def __init__(
+        self,
+        stargazers: int = 200,
+        stars: int = 150,
+        repos: int = 20_000,
+        skew: float = 1.0,
+        seed: int = 42,
+        target: str = TARGET_REPO,
+    ):
+        rng = random.Random(seed)
+        population = range(repos)
+        cum_weights = list(
+            itertools.accumulate(1 / (rank + 1) ** skew for rank in population)
+        )
+
+        self.target = target
+        self.stargazers = {target: [f"user{u}" for u in range(stargazers)]}
+        self.starred = {}
+        for login in self.stargazers[target]:
+            k = rng.randint(1, 2 * stars - 1)
+            ids = dict.fromkeys(rng.choices(population, cum_weights=cum_weights, k=k))
+            starred_repos = [f"owner{i % 997}/repo{i}" for i in ids]
+            starred_repos.insert(rng.randrange(len(starred_repos) + 1), target)
+            self.starred[login] = starred_repos
+
+    @property
+    def edges_count(self):
+        return sum(len(starred_repos) for starred_repos in self.starred.values())
+
+
+def _starred_at(position):
+    """Stargazers starred the repository one minute apart, in order"""
+    starred_at = datetime.datetime(2020, 1, 1) + datetime.timedelta(minutes=position)
+    return starred_at.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def _link_header(request, page, last_page):
+    links = []
+    if page < last_page:
+        links.append(("next", page + 1))
+        links.append(("last", last_page))
+    if page > 1:
+        links.append(("first", 1))
+        links.append(("prev", page - 1))
+
+    return ", ".join(
+        f'<{request.url.include_query_params(page=p)}>; rel="{rel}"' for rel, p in links
+    )
+
+
+def _paginate(request, items):
+    """Return the requested page of items, with its `Link` header"""
+    per_page = min(int(request.query_params.get("per_page", 30)), 100)
+    page = int(request.query_params.get("page", 1))
+    last_page = max((len(items) + per_page - 1) // per_page, 1)
+    start = (page - 1) * per_page
+
+    headers = {}
+    link_header = _link_header(request, page, last_page)
+    if link_header:
+        headers["link"] = link_header
+    return start, items[start : start + per_page], headers
+
+
+def _connection(items, first, after, build_node):
+    start = int(after) if after else 0
+    end = min(start + first, len(items))
+    return {
+        "nodes": [build_node(item) for item in items[start:end]],
+        "pageInfo": {"endCursor": str(end), "hasNextPage": end < len(items)},
+    }
+
+
+def _graphql_nodes(variables):
+    """Number of nodes requested by a `GitHubGraphQLClient` query"""
+    if "starredFirst" in variables:
+        return variables["first"] * (1 + variables["starredFirst"])
+    if "login0" in variables:
+        users = sum(1 for name in variables if name.startswith("login"))
+        return users * (1 + variables["first"])
+    return variables["first"]
+
+
+class RateLimits:
+    """Rate limit budgets per (token, resource), reset every hour"""
+
+    def __init__(self, limit: int = 5000):
+        self.limit = limit
+        self.reset()
+
+    def reset(self):
+        self._window = int(time.time()) + 3600
+        self._used = collections.Counter()
+
+    def consume(self, token, resource):
+        """Consume one request, return (allowed, rate limit headers)"""
+        if time.time() >= self._window:
+            self.reset()
+
+        key = (token, resource)
+        allowed = self._used[key] < self.limit
+        if allowed:
+            self._used[key] += 1
+
+        return allowed, {
+            "x-ratelimit-limit": str(self.limit),
+            "x-ratelimit-remaining": str(self.limit - self._used[key]),
+            "x-ratelimit-reset": str(self._window),
+            "x-ratelimit-resource": resource,
+        }
+
+
+class FakeGitHub:
+    """Fake GitHub API App serving a `SyntheticStarGraph` (see `app`)"""
+
+    def __init__(
+        self,
+        graph: SyntheticStarGraph,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        error_rate: float = 0.0,
+        rate_limit: int = 1_000_000,
+        seed: int = 0,
+    ):
+        """
+        :param graph: Served `SyntheticStarGraph`.
+        :param latency: Seconds added to each response.
+        :param jitter: Maximum random seconds added to the latency.
+        :param error_rate: Fraction of requests answered with a `502`.
+        :param rate_limit: Requests per hour per token and resource.
+        :param seed: Random seed of the jitter and errors.
+        """
+        self.graph = graph
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limits = RateLimits(rate_limit)
+        self.requests_count = collections.Counter()
+        self._rng = random.Random(seed)
+
+        self.app = FastAPI(title="Fake GitHub API")
+        self.app.middleware("http")(self.github_behaviour)
+        self.app.add_api_route("/_stats", self.stats)
+        self.app.add_api_route("/_reset", self.reset, methods=["POST"])
+        self.app.add_api_route("/repos/{owner}/{repo}", self.repository)
+        self.app.add_api_route("/repos/{owner}/{repo}/stargazers", self.stargazers)
+        self.app.add_api_route("/users/{user}/starred", self.starred)
+        self.app.add_api_route("/graphql", self.graphql, methods=["POST"])
+
+    async def github_behaviour(self, request: Request, call_next):
+        """Latency, errors and rate limits of the GitHub endpoints"""
+        if request.url.path.startswith("/_"):
+            return await call_next(request)
+
+        resource = "graphql" if request.url.path == "/graphql" else "core"
+        self.requests_count[resource] += 1
+        await asyncio.sleep(self.latency + self._rng.uniform(0, self.jitter))
+
+        if self._rng.random() < self.error_rate:
+            return JSONResponse({"message": "Server Error"}, status_code=502)
+
+        token = request.headers.get("authorization")
+        allowed, headers = self.rate_limits.consume(token, resource)
+        if allowed:
+            response = await call_next(request)
+        else:
+            response = JSONResponse(
+                {"message": "API rate limit exceeded"}, status_code=403
+            )
+
+        response.headers.update(headers)
+        return response
+
+    async def stats(self):
+        return {
+            "requests": dict(self.requests_count),
+            "total": sum(self.requests_count.values()),
+        }
+
+    async def reset(self):
+        self.requests_count.clear()
+        self.rate_limits.reset()
+        return await self.stats()
+
+    async def repository(self, owner: str, repo: str):
+        stargazers = self.graph.stargazers.get(f"{owner}/{repo}")
+        if stargazers is None:
+            return JSONResponse({"message": "Not Found"}, status_code=404)
+
+        return {"full_name": f"{owner}/{repo}", "stargazers_count": len(stargazers)}
+
+    async def stargazers(self, owner: str, repo: str, request: Request):
+        logins = self.graph.stargazers.get(f"{owner}/{repo}")
+        if logins is None:
+            return JSONResponse({"message": "Not Found"}, status_code=404)
+
+        start, page, headers = _paginate(request, logins)
+        if request.headers.get("accept") == GITHUB_STAR_MEDIA_TYPE:
+            items = [
+                {"starred_at": _starred_at(start + i), "user": {"login": login}}
+                for i, login in enumerate(page)
+            ]
+        else:
+            items = [{"login": login} for login in page]
+        return JSONResponse(items, headers=headers)
+
+    async def starred(self, user: str, request: Request):
+        _, page, headers = _paginate(request, self.graph.starred.get(user, []))
+        return JSONResponse([{"full_name": name} for name in page], headers=headers)
+
+    async def graphql(self, request: Request):
+        variables = (await request.json())["variables"]
+        if _graphql_nodes(variables) > GRAPHQL_MAX_NODES:
+            error = {"type": "MAX_NODE_LIMIT_EXCEEDED", "message": "Too many nodes"}
+            return {"errors": [error]}
+
+        return _graphql_data(self.graph, variables)
+
+
+def _graphql_data(graph, variables):
+    """Answer the `GitHubGraphQLClient` queries, told apart by their variables"""
+
+    def repo_node(name):
+        return {"nameWithOwner": name}
+
+    def starred_connection(login, first, after):
+        return {
+            "starredRepositories": _connection(
+                graph.starred.get(login, []), first, after, repo_node
+            )
+        }
+
+    first, after = variables["first"], variables.get("after")
+    if "login0" in variables:
+        users, i = {}, 0
+        while f"login{i}" in variables:
+            users[f"u{i}"] = starred_connection(
+                variables[f"login{i}"], first, variables[f"after{i}"]
+            )
+            i += 1
+        return {"data": users}
+
+    if "login" in variables:
+        return {"data": {"user": starred_connection(variables["login"], first, after)}}
+
+    logins = graph.stargazers.get(f"{variables['owner']}/{variables['name']}")
+    if logins is None:
+        error = {"type": "NOT_FOUND", "message": "Could not resolve repository"}
+        return {"data": {"repository": None}, "errors": [error]}
+
+    def user_node(login):
+        return {
+            "login": login,
+            **starred_connection(login, variables["starredFirst"], None),
+        }
+
+    connection = _connection(logins, first, after, user_node)
+    return {"data": {"repository": {"stargazers": connection}}}
+
+
+def add_graph_arguments(parser):
+    """Add the `SyntheticStarGraph` and fake server arguments"""
+    parser.add_argument("--stargazers", type=int, default=200)
+    parser.add_argument("--stars", type=int, default=150)
+    parser.add_argument("--repos", type=int, default=20_000)
+    parser.add_argument("--skew", type=float, default=1.0)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit", type=int, default=1_000_000)
+
+
+def build_fake_github_app_from_args(args):
+    graph = SyntheticStarGraph(
+        stargazers=args.stargazers,
+        stars=args.stars,
+        repos=args.repos,
+        skew=args.skew,
+        seed=args.seed,
+    )
+    return FakeGitHub(
+        graph,
+        latency=args.latency,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        rate_limit=args.rate_limit,
+        seed=args.seed,
+    ).app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    add_graph_arguments(parser)
+    args = parser.parse_args()
+
+    uvicorn.run(
+        build_fake_github_app_from_args(args),
+        host=args.host,
+        port=args.port,
+        log_level="warning",
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,95 @@
+import asyncio
+import contextlib
+
 from fastapi import FastAPI, Response, Request
 
+from mergify_algos import metrics
 from mergify_algos.config import Settings
+from mergify_algos.dependencies import (
+    get_app_aggregation_options,
+    get_app_github_options,
+)
+from mergify_algos.github.aggregation import build_aggregation_executor_from_settings
+from mergify_algos.github.cache import (
+    build_http_response_cache_from_settings,
+    build_neighbours_cache_from_settings,
+    build_starred_repos_cache_from_settings,
+)
+from mergify_algos.github.clients import build_async_http_client_from_settings
+from mergify_algos.github.graph import build_star_graph_store_from_settings
+from mergify_algos.github.scheduler import build_request_scheduler_from_settings
+from mergify_algos.jobs import build_job_manager_from_settings
 from mergify_algos.routers import github
 from mergify_algos.utils import display_secret
 
 
 __version__ = "0.1.0"
-app = FastAPI(version=__version__)
 settings = Settings()
 
 
+@contextlib.asynccontextmanager
+async def lifespan(app: FastAPI):
+    # One pooled GitHub HTTP client per App process, shared by all requests
+    async with build_async_http_client_from_settings(settings) as http_client:
+        app.state.github_http_client = http_client
+        app.state.github_scheduler = build_request_scheduler_from_settings(settings)
+        app.state.github_cache = build_http_response_cache_from_settings(settings)
+        app.state.github_starred_cache = build_starred_repos_cache_from_settings(
+            settings
+        )
+        app.state.github_graph_store = build_star_graph_store_from_settings(settings)
+        app.state.job_manager = build_job_manager_from_settings(settings)
+        app.state.aggregation_executor = build_aggregation_executor_from_settings(
+            settings
+        )
+        app.state.neighbours_cache = build_neighbours_cache_from_settings(settings)
+        warm_up = _start_neighbours_cache_warm_up(app)
+        yield
+        if warm_up is not None:
+            warm_up.cancel()
+            await asyncio.gather(warm_up, return_exceptions=True)
+        await app.state.job_manager.close()
+        if app.state.neighbours_cache is not None:
+            await app.state.neighbours_cache.close()
+
+    if app.state.github_cache is not None:
+        app.state.github_cache.close()
+    if app.state.github_graph_store is not None:
+        app.state.github_graph_store.close()
+    if app.state.aggregation_executor is not None:
+        app.state.aggregation_executor.shutdown()
+
+
+def _start_neighbours_cache_warm_up(app: FastAPI):
+    """Compute the `neighbours_cache_warmup` repositories in the background"""
+    if app.state.neighbours_cache is None or not settings.neighbours_cache_warmup:
+        return None
+
+    return asyncio.ensure_future(
+        github.warm_up_neighbours_cache(
+            app.state.neighbours_cache,
+            settings.neighbours_cache_warmup,
+            get_app_github_options(app),
+            get_app_aggregation_options(app),
+            interval=settings.neighbours_cache_warmup_interval,
+        )
+    )
+
+
+app = FastAPI(version=__version__, lifespan=lifespan)
+
+
+@app.middleware("http")
+async def server_timing(request: Request, call_next):
+    """Echo the request's neighbours phases and GitHub requests timings in a
+    `Server-Timing` header (see `metrics.RequestTimings`).
+    """
+    with metrics.request_timings() as timings:
+        response = await call_next(request)
+    response.headers["Server-Timing"] = timings.server_timing()
+    return response
+
+
 @app.get("/")
 async def root(request: Request):
     ip = request.client.host
@@ -19,6 +99,7 @@ async def root(request: Request):
         "app_settings": {
             "app_name": settings.app_name,
             "github_token": display_secret(settings.github_token),
+            "github_tokens": [display_secret(t) for t in settings.github_tokens],
         },
     }
 
@@ -29,6 +110,14 @@ async def healthz(response: Response):
     return {"message": "It's alive!"}
 
 
+@app.get("/metrics")
+async def prometheus_metrics():
+    """App metrics, in the Prometheus text exposition format"""
+    return Response(
+        metrics.REGISTRY.render(), media_type=metrics.PROMETHEUS_CONTENT_TYPE
+    )
+
+
 @app.get("/error")
 async def error():
     raise ValueError("this always fails, don't worry")
@@ -1,10 +1,83 @@
 from pydantic_settings import BaseSettings, SettingsConfigDict
-from typing import Optional
+from typing import List, Optional
 
 
 class Settings(BaseSettings, cli_parse_none_str="void"):
     app_name: str = "Mergify Algo API"
     github_token: Optional[str] = None
+    # Pool of GitHub tokens sharing the requests (see `scheduler.TokenPool`),
+    # as a JSON list. Used instead of `github_token` when set.
+    github_tokens: List[str] = []
+
+    # GitHub API url (e.g. GitHub Enterprise, or `benchmarks.fake_github`)
+    github_api_url: str = "https://api.github.com"
+
+    # Shared GitHub HTTP connection pool (see `clients.build_async_http_client`)
+    github_max_connections: int = 100
+    github_max_keepalive_connections: int = 20
+    github_keepalive_expiry: float = 30.0
+    github_http2: bool = False
+    github_timeout: float = 30.0
+    github_connect_timeout: float = 10.0
+    # Adaptive concurrency of GitHub requests (see `scheduler.AIMDLimiter`)
+    github_initial_concurrency: int = 10
+    github_max_concurrency: int = 50
+    # Retries & rate limit handling (see `scheduler.RequestScheduler`)
+    github_max_retries: int = 3
+    github_backoff_base: float = 0.5
+    github_backoff_cap: float = 30.0
+    github_rate_limit_reserve: int = 10
+    github_rate_limit_max_wait: float = 60.0
+    # Persistent GitHub responses cache (see `cache.HTTPResponseCache`).
+    # Disabled when no path is set.
+    github_cache_path: Optional[str] = None
+    github_cache_max_entries: int = 100_000
+    github_cache_ttl_stargazers: float = 3600.0
+    github_cache_ttl_starred: float = 24 * 3600.0
+    github_cache_ttl_repository: float = 3600.0
+    github_cache_ttl_default: float = 3600.0
+    # In-process users' starred repositories cache (see
+    # `cache.SingleFlightTTLCache`). Disabled when size is 0.
+    github_starred_cache_size: int = 10_000
+    github_starred_cache_ttl: float = 3600.0
+    # Persistent local star graph (see `graph.StarGraphStore`). Disabled when
+    # no path is set.
+    github_graph_path: Optional[str] = None
+    github_graph_ttl: float = 24 * 3600.0
+
+    # Co-stars aggregation (see `aggregation.CoStarCounter`): edges are
+    # spilled to `aggregation_spill_dir` (default: temporary directory) above
+    # `aggregation_memory_budget_mib`. No limit when not set.
+    aggregation_memory_budget_mib: Optional[float] = None
+    aggregation_spill_dir: Optional[str] = None
+    # Large graphs are counted by shards of repositories in a pool of
+    # `aggregation_workers` processes (see `CoStarCounter.compute_sharded`).
+    # Disabled when 0: neighbours are counted in a thread.
+    aggregation_workers: int = 0
+    aggregation_shards: Optional[int] = None
+
+    # Neighbours results cache (see `cache.StaleWhileRevalidateCache`):
+    # expired results are served for `neighbours_cache_stale_ttl` more seconds
+    # while being recomputed in the background. Disabled when size is 0.
+    neighbours_cache_size: int = 1000
+    neighbours_cache_ttl: float = 3600.0
+    neighbours_cache_stale_ttl: float = 24 * 3600.0
+    # Repositories ("owner/repo") computed into the neighbours cache at
+    # startup, as a JSON list, then every `neighbours_cache_warmup_interval`
+    # seconds when set.
+    neighbours_cache_warmup: List[str] = []
+    neighbours_cache_warmup_interval: Optional[float] = None
+
+    # Background jobs (see `jobs.JobManager`). In memory when no path is set.
+    jobs_db_path: Optional[str] = None
+    jobs_ttl: float = 24 * 3600.0
+
+    # Per-request profiling (`profile=true`, see `profiling.RequestProfiler`):
+    # allowed to all requests when enabled, else to requests with an admin
+    # token (`X-Admin-Token` header). Reports are dumped to `profiling_dir`.
+    profiling_enabled: bool = False
+    admin_tokens: List[str] = []
+    profiling_dir: Optional[str] = None
 
     model_config = SettingsConfigDict(env_file=".env")
 
@@ -0,0 +1,133 @@
+from fastapi import Header, HTTPException, Query, Request
+from typing import Literal
+
+from mergify_algos.config import settings
+from mergify_algos.github.aggregation import Ranking
+from mergify_algos.profiling import RequestProfiler
+
+
+def get_github_http_client(request: Request):
+    """Return the App shared GitHub `httpx.AsyncClient` (see App lifespan).
+
+    Returns None when the App lifespan didn't run (e.g. router used alone),
+    the algorithms then open their own client.
+    """
+    return getattr(request.app.state, "github_http_client", None)
+
+
+def get_github_scheduler(request: Request):
+    """Return the App shared GitHub `RequestScheduler` (see App lifespan)"""
+    return getattr(request.app.state, "github_scheduler", None)
+
+
+def get_github_cache(request: Request):
+    """Return the App shared GitHub `HTTPResponseCache` (None when disabled)"""
+    return getattr(request.app.state, "github_cache", None)
+
+
+def get_github_starred_cache(request: Request):
+    """Return the App shared users' starred repositories cache"""
+    return getattr(request.app.state, "github_starred_cache", None)
+
+
+def get_github_graph_store(request: Request):
+    """Return the App `StarGraphStore` (None when disabled)"""
+    return getattr(request.app.state, "github_graph_store", None)
+
+
+def get_github_options(request: Request):
+    """Return the App shared GitHub resources, as keyword arguments of the
+    async neighbour algorithms (see `afind_neighbour_repos`).
+    """
+    return get_app_github_options(request.app)
+
+
+def get_app_github_options(app):
+    """`get_github_options` out of a request (e.g. App background tasks)"""
+    return {
+        "http_client": getattr(app.state, "github_http_client", None),
+        "scheduler": getattr(app.state, "github_scheduler", None),
+        "cache": getattr(app.state, "github_cache", None),
+        "starred_cache": getattr(app.state, "github_starred_cache", None),
+        "graph_store": getattr(app.state, "github_graph_store", None),
+        "base_url": settings.github_api_url,
+        "max_concurrency": settings.github_max_concurrency,
+    }
+
+
+def get_aggregation_executor(request: Request):
+    """Return the App sharded aggregation process pool (None when disabled)"""
+    return getattr(request.app.state, "aggregation_executor", None)
+
+
+def get_aggregation_options(request: Request):
+    """Return the co-stars aggregation settings and process pool, as keyword
+    arguments of the full neighbour algorithms (see `afind_neighbour_repos`).
+    """
+    return get_app_aggregation_options(request.app)
+
+
+def get_app_aggregation_options(app):
+    """`get_aggregation_options` out of a request (e.g. App background tasks)"""
+    memory_budget = settings.aggregation_memory_budget_mib
+    return {
+        "memory_budget": (
+            int(memory_budget * 2**20) if memory_budget is not None else None
+        ),
+        "spill_dir": settings.aggregation_spill_dir,
+        "aggregation_executor": getattr(app.state, "aggregation_executor", None),
+        "aggregation_shards": (
+            settings.aggregation_shards or settings.aggregation_workers
+        ),
+    }
+
+
+def get_neighbours_cache(request: Request):
+    """Return the App neighbours results cache (None when disabled)"""
+    return getattr(request.app.state, "neighbours_cache", None)
+
+
+def get_job_manager(request: Request):
+    """Return the App `JobManager` (see App lifespan)"""
+    return request.app.state.job_manager
+
+
+def get_ranking(
+    top_k: int = Query(None, ge=1),
+    offset: int = Query(0, ge=0),
+    limit: int = Query(None, ge=1),
+    include_stargazers: Literal["all", "sample", "none"] = "all",
+    stargazers_sample: int = Query(10, ge=0),
+):
+    """Return the neighbours `Ranking` options from the query parameters.
+
+    :param top_k: Only rank the `top_k` first neighbours.
+    :param offset: Skip the `offset` first neighbours of the ranking.
+    :param limit: Return at most `limit` neighbours.
+    :param include_stargazers: "all" stargazers, a "sample" of
+    `stargazers_sample` stargazers, or "none" (`stargazers_count` only).
+    :param stargazers_sample: Number of stargazers in the samples.
+    """
+    return Ranking(
+        top_k=top_k,
+        offset=offset,
+        limit=limit,
+        include_stargazers=include_stargazers,
+        stargazers_sample=stargazers_sample,
+    )
+
+
+def get_profiler(profile: bool = False, x_admin_token: str = Header(None)):
+    """Return the request's `RequestProfiler` (disabled unless `profile`).
+
+    Profiling is restricted to admin tokens (`X-Admin-Token` header), unless
+    enabled for all requests (`profiling_enabled` setting).
+
+    :param profile: Profile the computation, and return the report.
+    """
+    if profile and not (
+        settings.profiling_enabled or x_admin_token in settings.admin_tokens
+    ):
+        raise HTTPException(status_code=403, detail="Profiling isn't allowed")
+
+    return RequestProfiler(enabled=profile, output_dir=settings.profiling_dir)
@@ -1,5 +1,10 @@
 from mergify_algos.github.neighbours import (
+    afind_approximate_neighbour_repos,
+    afind_batch_neighbour_repos,
+    afind_graphql_neighbour_repos,
     afind_neighbour_repos,
+    aiter_neighbour_repos,
+    arefresh_neighbour_repos,
     find_graphql_neighbour_repos,
     find_neighbour_repos,
 )
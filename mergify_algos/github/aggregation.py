@@ -0,0 +1,541 @@
+import concurrent.futures
+import functools
+import heapq
+import numpy as np
+import os
+import sys
+import tempfile
+
+from mergify_algos import metrics
+
+
+INCLUDE_STARGAZERS = ("all", "sample", "none")
+# Spilled postings are (repository id, user id) int32 pairs
+_POSTING_BYTES = 8
+
+
+class Ranking:
+    """Neighbours ranking options.
+
+    - `top_k`: only rank the `top_k` first neighbours.
+    - `offset` / `limit`: return a page of the ranking.
+    - `include_stargazers`: "all" stargazers lists, a "sample" of
+    `stargazers_sample` stargazers, or "none" (only `stargazers_count`).
+
+    When `top_k` or `limit` is set, neighbours are selected with a heap: the
+    long tail is neither sorted nor serialized.
+    """
+
+    def __init__(
+        self,
+        top_k: int = None,
+        offset: int = 0,
+        limit: int = None,
+        include_stargazers: str = "all",
+        stargazers_sample: int = 10,
+    ):
+        if include_stargazers not in INCLUDE_STARGAZERS:
+            raise ValueError(
+                f"include_stargazers must be one of {INCLUDE_STARGAZERS}, "
+                f"not {include_stargazers!r}"
+            )
+
+        self.top_k = top_k
+        self.offset = offset
+        self.limit = limit
+        self.include_stargazers = include_stargazers
+        self.stargazers_sample = stargazers_sample
+
+    def to_dict(self):
+        return {
+            "top_k": self.top_k,
+            "offset": self.offset,
+            "limit": self.limit,
+            "include_stargazers": self.include_stargazers,
+            "stargazers_sample": self.stargazers_sample,
+        }
+
+    @property
+    def size(self):
+        """Number of neighbours to select, None for all of them"""
+        sizes = [self.top_k] if self.top_k is not None else []
+        if self.limit is not None:
+            sizes.append(self.offset + self.limit)
+        return min(sizes) if sizes else None
+
+
+class CoStarCounter:
+    """Compact co-stars aggregation of users' starred repositories.
+
+    Replaces the {"repo": ["users"]} map built by
+    `neighbours._transform_user_starred_repositories`:
+    - Repositories and users are interned to integer ids.
+    - Edges (user -> starred repository) are stored as one growing int32 NumPy
+    array, users' edges being contiguous (CSR like layout).
+    - Co-stars counts are computed with `np.bincount`.
+    - Stargazers' names lists are only materialized for the repositories
+    actually returned.
+
+    With a `memory_budget`, edges are spilled to disk once their buffer
+    exceeds it: partial co-stars counts are kept in memory, and (repository,
+    user) postings are appended to `partitions` files, by repository id.
+    Stargazers lists are then read back by chunks, from the partitions of the
+    returned repositories only. Only the interned names and the counts stay
+    in memory whatever the number of users folded in.
+
+    Usage::
+
+        with CoStarCounter(exclude_repos=["owner/repo"]) as counter:
+            for user, starred_repos in ...:
+                counter.add_user(user, starred_repos)
+            results, sorted_results = counter.compute(users_threshold=2)
+    """
+
+    def __init__(
+        self,
+        exclude_repos=None,
+        memory_budget: int = None,
+        spill_dir: str = None,
+        partitions: int = 16,
+    ):
+        """
+        :param exclude_repos: Repositories not counted (e.g. the target one).
+        :param memory_budget: [optional] Maximum size of the in-memory edges
+        buffer, in bytes, before it is spilled to disk. Default: no limit.
+        :param spill_dir: [optional] Directory of the spill files. Default: the
+        system temporary directory.
+        :param partitions: Number of spill files.
+        """
+        self.exclude_repos = set(exclude_repos or [])
+        self.memory_budget = memory_budget
+        self.spill_dir = spill_dir
+        self.partitions = partitions
+
+        self._repo_ids = {}
+        self._repos = []
+        self._users = []
+        # In-memory users' edges, users being numbered from `_spilled_users`:
+        # self._edges[self._offsets[i] : self._offsets[i + 1]]
+        self._edges = np.empty(1024, dtype=np.int32)
+        self._n_edges = 0
+        self._offsets = [0]
+        # Spilled edges: counts per repository id, and postings files
+        self._spill = None
+        self._spilled_counts = np.zeros(0, dtype=np.int64)
+        self._spilled_users = 0
+        self.spilled_edges = 0
+        # {"user": user id}, built by `subset`
+        self._user_index = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def close(self):
+        """Remove the spill files"""
+        if self._spill is not None:
+            self._spill.cleanup()
+            self._spill = None
+
+    @classmethod
+    def from_user_repo_map(cls, user_repo_map, exclude_repos=None):
+        """Build a counter from a {"user": ["repos"]} dict"""
+        counter = cls(exclude_repos=exclude_repos)
+        for user, starred_repos in user_repo_map.items():
+            counter.add_user(user, starred_repos)
+        return counter
+
+    @property
+    def users_count(self):
+        return len(self._users)
+
+    @property
+    def repos_count(self):
+        return len(self._repos)
+
+    @property
+    def edges_count(self):
+        return self.spilled_edges + self._n_edges
+
+    def _intern(self, repo):
+        repo_id = self._repo_ids[repo] = len(self._repos)
+        self._repos.append(sys.intern(repo))
+        return repo_id
+
+    def add_user(self, user, starred_repos):
+        """Fold one user's starred repositories into the counter"""
+        # Hot loop: only repositories seen for the first time are checked
+        # against `exclude_repos` and interned.
+        get_repo_id = self._repo_ids.get
+        repo_ids = []
+        for repo in starred_repos:
+            repo_id = get_repo_id(repo)
+            if repo_id is None:
+                if repo in self.exclude_repos:
+                    continue
+                repo_id = self._intern(repo)
+            repo_ids.append(repo_id)
+
+        n_edges = self._n_edges + len(repo_ids)
+        if n_edges > len(self._edges):
+            self._edges = np.resize(self._edges, max(n_edges, 2 * len(self._edges)))
+        self._edges[self._n_edges : n_edges] = repo_ids
+
+        self._n_edges = n_edges
+        self._offsets.append(n_edges)
+        self._users.append(user)
+
+        if self.memory_budget is not None and self._edges.nbytes > self.memory_budget:
+            self._spill_edges()
+
+    def subset(self, users, exclude_repos=None):
+        """Return a counter of some of the users already folded in.
+
+        The users' edges are copied (without `exclude_repos`), repositories
+        are shared with this counter: the returned counter is read only.
+        Users unknown to this counter are skipped.
+
+        :param users: Users' names, a subset of this counter's ones.
+        :param exclude_repos: Repositories not counted (e.g. the target one).
+        """
+        if self._spill is not None:
+            raise ValueError("A counter spilled to disk can't be subset")
+        if self._user_index is None or len(self._user_index) != len(self._users):
+            self._user_index = {user: i for i, user in enumerate(self._users)}
+
+        user_index = self._user_index
+        user_ids = np.array(
+            [user_index[user] for user in users if user in user_index],
+            dtype=np.int64,
+        )
+        offsets = np.asarray(self._offsets, dtype=np.int64)
+        starts, lengths = offsets[user_ids], np.diff(offsets)[user_ids]
+
+        # Gather the users' edges, then drop the excluded repositories
+        shifts = np.repeat(starts - (np.cumsum(lengths) - lengths), lengths)
+        edges = self._edges[np.arange(lengths.sum(), dtype=np.int64) + shifts]
+        excluded = [
+            self._repo_ids[r] for r in exclude_repos or [] if r in self._repo_ids
+        ]
+        keep = ~np.isin(edges, excluded)
+        edge_users = np.repeat(np.arange(len(user_ids)), lengths)
+        kept_lengths = np.bincount(edge_users[keep], minlength=len(user_ids))
+
+        counter = CoStarCounter(exclude_repos=exclude_repos)
+        counter._repo_ids = self._repo_ids
+        counter._repos = self._repos
+        counter._users = [self._users[i] for i in user_ids.tolist()]
+        counter._edges = edges[keep]
+        counter._n_edges = len(counter._edges)
+        counter._offsets = [0] + np.cumsum(kept_lengths).tolist()
+        return counter
+
+    # ---
+    # Spill to disk
+    def _partition_path(self, partition):
+        return os.path.join(self._spill.name, f"{partition}.postings")
+
+    def _memory_postings(self):
+        """Return the (repository ids, user ids) of the in-memory edges"""
+        users = np.arange(self._spilled_users, len(self._users), dtype=np.int32)
+        return self._edges[: self._n_edges], np.repeat(users, np.diff(self._offsets))
+
+    def _spill_edges(self):
+        """Append the in-memory edges to the partitions, and free them"""
+        if self._spill is None:
+            self._spill = tempfile.TemporaryDirectory(
+                prefix="costars-", dir=self.spill_dir
+            )
+
+        edges, users = self._memory_postings()
+        self._spilled_counts = self.counts()
+
+        # Group postings by partition, keeping users' insertion order
+        partition_ids = edges % self.partitions
+        order = np.argsort(partition_ids, kind="stable")
+        postings = np.column_stack((edges, users))[order]
+        bounds = np.searchsorted(
+            partition_ids[order], np.arange(self.partitions + 1), side="left"
+        )
+        for partition, (start, end) in enumerate(zip(bounds[:-1], bounds[1:])):
+            if start < end:
+                with open(self._partition_path(partition), "ab") as f:
+                    postings[start:end].tofile(f)
+
+        metrics.AGGREGATION_SPILLED_BYTES.inc(postings.nbytes)
+        self.spilled_edges += self._n_edges
+        self._spilled_users = len(self._users)
+        self._edges = np.empty(1024, dtype=np.int32)
+        self._n_edges = 0
+        self._offsets = [0]
+
+    def _iter_postings(self, repo_ids):
+        """Yield (repository ids, user ids) chunks of all edges, spilled ones
+        first (partitions of `repo_ids` only), in users' insertion order.
+        """
+        if self._spill is not None:
+            chunk = max((self.memory_budget or 0) // _POSTING_BYTES, 1024) * 2
+            for partition in np.unique(repo_ids % self.partitions).tolist():
+                path = self._partition_path(partition)
+                if not os.path.exists(path):
+                    continue
+                with open(path, "rb") as f:
+                    while (postings := np.fromfile(f, np.int32, chunk)).size:
+                        postings = postings.reshape(-1, 2)
+                        yield postings[:, 0], postings[:, 1]
+
+        yield self._memory_postings()
+
+    # ---
+    # Neighbours
+    def counts(self):
+        """Return the co-stars count of each repository id"""
+        counts = np.bincount(self._edges[: self._n_edges], minlength=len(self._repos))
+        counts[: len(self._spilled_counts)] += self._spilled_counts
+        return counts
+
+    def _selected_repo_ids(self, users_threshold):
+        counts = self.counts()
+        return counts, np.flatnonzero(counts >= max(users_threshold, 1))
+
+    def stargazers(self, repo_ids):
+        """Return {repo_id: ["users"]} for the given repository ids only"""
+        selected = np.zeros(len(self._repos), dtype=bool)
+        selected[repo_ids] = True
+        kept_repos, kept_users = [], []
+        for edges, users in self._iter_postings(repo_ids):
+            keep = selected[edges]
+            kept_repos.append(edges[keep])
+            kept_users.append(users[keep])
+
+        # Group the kept edges by repository, keeping users' insertion order
+        edge_repos, edge_users = np.concatenate(kept_repos), np.concatenate(kept_users)
+        order = np.argsort(edge_repos, kind="stable")
+        edge_repos, edge_users = edge_repos[order], edge_users[order]
+        bounds = np.searchsorted(edge_repos, repo_ids, side="left")
+        ends = np.searchsorted(edge_repos, repo_ids, side="right")
+
+        # Resolve all names at once, then slice the flat list per repository
+        names = np.array(self._users, dtype=object)[edge_users].tolist()
+        return {
+            repo_id: names[start:end]
+            for repo_id, start, end in zip(
+                repo_ids.tolist(), bounds.tolist(), ends.tolist()
+            )
+        }
+
+    def _top_repo_ids(self, counts, repo_ids, size):
+        """Return the `size` first repository ids, ordered by count then name.
+
+        Candidates are pre-filtered with `np.partition` on counts, then ties
+        are broken by name with a heap of `size` elements.
+        """
+        if size <= 0:
+            return []
+        if size < len(repo_ids):
+            repo_counts = counts[repo_ids]
+            kth = len(repo_counts) - size
+            repo_ids = repo_ids[repo_counts >= np.partition(repo_counts, kth)[kth]]
+
+        repos = self._repos
+        top = heapq.nsmallest(
+            size, ((-int(counts[i]), repos[i], i) for i in repo_ids.tolist())
+        )
+        return [repo_id for _, _, repo_id in top]
+
+    def _build_results(self, counts, repo_ids, ranking, stargazers=None):
+        if ranking.include_stargazers == "none":
+            return [
+                {"repo": self._repos[i], "stargazers_count": int(counts[i])}
+                for i in repo_ids
+            ]
+
+        stargazers = (stargazers or self.stargazers)(
+            np.asarray(repo_ids, dtype=np.int64)
+        )
+        if ranking.include_stargazers == "sample":
+            sample = ranking.stargazers_sample
+            stargazers = {i: users[:sample] for i, users in stargazers.items()}
+
+        return [
+            {
+                "repo": self._repos[i],
+                "stargazers_count": int(counts[i]),
+                "stargazers": stargazers[i],
+            }
+            for i in repo_ids
+        ]
+
+    def snapshot(self, size=20, users_threshold=2):
+        """Return the current top `size` neighbours, without stargazers lists"""
+        counts, repo_ids = self._selected_repo_ids(users_threshold)
+        top_ids = self._top_repo_ids(counts, repo_ids, size)
+        return self._build_results(counts, top_ids, Ranking(include_stargazers="none"))
+
+    def compute(self, users_threshold=2, ranking: Ranking = None):
+        """Return neighbours with at least `users_threshold` in-common users.
+
+        Same output as `neighbours._compute_and_order_neighbours` by default.
+        With `ranking` options selecting a top-K or a page, both returned lists
+        are that ordered selection.
+
+        :param users_threshold: Minimum number of in-common users.
+        :param ranking: [optional] `Ranking` options.
+        :returns: (results, sorted_results)
+        """
+        ranking = ranking if ranking is not None else Ranking()
+        counts, repo_ids = self._selected_repo_ids(users_threshold)
+        return self._rank(counts, repo_ids, ranking)
+
+    def _rank(self, counts, repo_ids, ranking, stargazers=None):
+        """Order the selected `repo_ids` and build the `ranking` results"""
+        if ranking.size is None:
+            results = self._build_results(
+                counts, repo_ids.tolist(), ranking, stargazers
+            )
+            sorted_results = sorted(
+                results, key=lambda x: (-x["stargazers_count"], x["repo"])
+            )
+            return results, sorted_results[ranking.offset :]
+
+        top_ids = self._top_repo_ids(counts, repo_ids, ranking.size)
+        sorted_results = self._build_results(
+            counts, top_ids[ranking.offset :], ranking, stargazers
+        )
+        return sorted_results, sorted_results
+
+    # ---
+    # Sharded neighbours
+    def _shard_postings(self, shards):
+        """Return the (repository ids, user ids) postings of each shard.
+
+        Edges are sharded by repository id: a shard holds all the edges of
+        its repositories, in users' insertion order.
+        """
+        postings = [([], []) for _ in range(shards)]
+        for edges, users in self._iter_postings(np.arange(self.partitions)):
+            # Small integer keys: numpy's stable sort is a radix sort
+            shard_ids = (edges % shards).astype(np.uint16)
+            order = np.argsort(shard_ids, kind="stable")
+            edges, users = edges[order], users[order]
+            bounds = np.searchsorted(shard_ids[order], np.arange(shards + 1))
+            for (shard_edges, shard_users), start, end in zip(
+                postings, bounds[:-1], bounds[1:]
+            ):
+                shard_edges.append(edges[start:end])
+                shard_users.append(users[start:end])
+
+        return [
+            (np.concatenate(shard_edges), np.concatenate(shard_users))
+            for shard_edges, shard_users in postings
+        ]
+
+    def _merged_stargazers(self, groups, repo_ids):
+        """Resolve the stargazers grouped by the shards, see `compute_sharded`"""
+        names = np.array(self._users, dtype=object)
+        stargazers = {}
+        for repo_id in repo_ids.tolist():
+            users, start, end = groups[repo_id]
+            stargazers[repo_id] = names[users[start:end]].tolist()
+        return stargazers
+
+    def compute_sharded(
+        self,
+        executor,
+        shards: int,
+        users_threshold: int = 2,
+        ranking: Ranking = None,
+    ):
+        """Same as `compute`, counting shards of repositories in an `executor`.
+
+        Each shard (see `_shard_postings`) counts its repositories' co-stars,
+        keeps the ones above `users_threshold` (and only its candidates to a
+        top-K or a page) and groups their stargazers. The shards' candidates
+        are then merged and ranked here.
+
+        :param executor: `concurrent.futures.Executor` counting the shards,
+        e.g. a `ProcessPoolExecutor` (see `build_aggregation_executor_from_settings`).
+        :param shards: Number of shards.
+        :param users_threshold: Minimum number of in-common users.
+        :param ranking: [optional] `Ranking` options.
+        :returns: (results, sorted_results)
+        """
+        ranking = ranking if ranking is not None else Ranking()
+        with_stargazers = ranking.include_stargazers != "none"
+        jobs = [
+            executor.submit(
+                _count_shard,
+                edges,
+                users,
+                users_threshold,
+                ranking.size,
+                with_stargazers,
+            )
+            for edges, users in self._shard_postings(max(shards, 1))
+        ]
+
+        counts = np.zeros(len(self._repos), dtype=np.int64)
+        candidates, groups = [], {}
+        for job in jobs:
+            repo_ids, repo_counts, users, bounds = job.result()
+            counts[repo_ids] = repo_counts
+            candidates.append(repo_ids)
+            if with_stargazers:
+                for repo_id, start, end in zip(
+                    repo_ids.tolist(), bounds[:-1].tolist(), bounds[1:].tolist()
+                ):
+                    groups[repo_id] = (users, start, end)
+
+        return self._rank(
+            counts,
+            np.sort(np.concatenate(candidates)),
+            ranking,
+            functools.partial(self._merged_stargazers, groups),
+        )
+
+
+def _count_shard(edges, users, users_threshold, size, with_stargazers):
+    """Count the co-stars of one shard of repositories (in a worker process).
+
+    :param edges: Repository id of each edge, all the shard's ones.
+    :param users: User id of each edge.
+    :param users_threshold: Minimum number of in-common users.
+    :param size: [optional] Number of neighbours ranked, only the shard's
+    candidates are kept: counts reaching its `size`-th count, ties included.
+    :param with_stargazers: Whether to group the kept repositories' users.
+    :returns: (repo_ids, counts, users, bounds), the kept repositories' users
+    being `users[bounds[i] : bounds[i + 1]]`, in insertion order.
+    """
+    # Counted by repository id: other shards' repositories count 0
+    counts = np.bincount(edges)
+    kept = counts >= max(users_threshold, 1)
+    if size is not None and size < np.count_nonzero(kept):
+        kept_counts = counts[kept]
+        kth = len(kept_counts) - size
+        kept &= counts >= np.partition(kept_counts, kth)[kth]
+
+    repo_ids = np.flatnonzero(kept)
+    if not with_stargazers:
+        return repo_ids, counts[repo_ids], None, None
+
+    # Group the kept edges by repository, keeping users' insertion order
+    keep = kept[edges]
+    order = np.argsort(edges[keep], kind="stable")
+    bounds = np.concatenate(([0], np.cumsum(counts[repo_ids])))
+    return repo_ids, counts[repo_ids], users[keep][order], bounds
+
+
+def build_aggregation_executor_from_settings(settings):
+    """Build the sharded aggregation `ProcessPoolExecutor` from the App
+    `Settings` (see `CoStarCounter.compute_sharded`).
+
+    Returns None when disabled (`aggregation_workers` is 0).
+    """
+    if settings.aggregation_workers <= 0:
+        return None
+
+    return concurrent.futures.ProcessPoolExecutor(
+        max_workers=settings.aggregation_workers
+    )
@@ -0,0 +1,661 @@
+import asyncio
+import httpx
+import json
+import re
+import sqlite3
+import threading
+import time
+
+from collections import OrderedDict
+
+from mergify_algos import metrics
+from mergify_algos.github.scheduler import BudgetExhausted
+
+# Endpoint types, used to pick the cache entry's time to live
+GITHUB_ENDPOINT_PATTERNS = (
+    ("stargazers", re.compile(r"/repos/[^/]+/[^/]+/stargazers")),
+    ("starred", re.compile(r"/users/[^/]+/starred")),
+    ("repository", re.compile(r"/repos/[^/]+/[^/?]+(\?|$)")),
+)
+# Only these headers are cached. Rate limit headers must not be replayed.
+CACHED_HEADERS = ("link", "etag", "last-modified", "content-type")
+
+
+def get_endpoint_type(url: str):
+    """Return the GitHub endpoint type of the url ("starred", "stargazers"...)"""
+    for endpoint_type, pattern in GITHUB_ENDPOINT_PATTERNS:
+        if pattern.search(url):
+            return endpoint_type
+    return "default"
+
+
+class CacheEntry:
+    """A cached GitHub response"""
+
+    def __init__(self, key, headers, body, stored_at):
+        self.key = key
+        self.headers = headers
+        self.body = body
+        self.stored_at = stored_at
+
+    def is_fresh(self, ttl: float, now: float = None):
+        return (now if now is not None else time.time()) - self.stored_at < ttl
+
+    def conditional_headers(self):
+        """Headers used to revalidate the entry (`If-None-Match`...)"""
+        headers = {}
+        if "etag" in self.headers:
+            headers["If-None-Match"] = self.headers["etag"]
+        if "last-modified" in self.headers:
+            headers["If-Modified-Since"] = self.headers["last-modified"]
+        return headers
+
+    def to_response(self):
+        """Build a 200 `httpx.Response` from the cached entry"""
+        return httpx.Response(200, headers=self.headers, content=self.body)
+
+
+class HTTPResponseCache:
+    """Disk-backed (SQLite) GitHub responses cache.
+
+    - Fresh entries (younger than their endpoint type TTL) are served directly.
+    - Stale entries are revalidated with `If-None-Match` / `If-Modified-Since`.
+    GitHub answers 304 without charging the rate limit.
+    - Least recently used entries are evicted above `max_entries`.
+
+    Lookups only read the database: entries' access times are kept in memory
+    and written along with the next stored response, and the entries count is
+    kept in memory. The database is in WAL mode, so commits don't wait for a
+    disk sync. Async callers use `alookup` / `astore`, run out of the event
+    loop.
+
+    Thread-safe: the sync client fetches pages from a thread pool.
+    """
+
+    DEFAULT_TTLS = {
+        "stargazers": 3600.0,
+        "starred": 24 * 3600.0,
+        "repository": 3600.0,
+        "default": 3600.0,
+    }
+
+    def __init__(self, path: str = ":memory:", ttls: dict = None, max_entries=100_000):
+        """
+        :param path: SQLite database file path (Default: in memory)
+        :param ttls: Time to live by endpoint type, in seconds. See DEFAULT_TTLS.
+        :param max_entries: Maximum number of cached responses.
+        """
+        self.ttls = dict(self.DEFAULT_TTLS, **(ttls or {}))
+        self.max_entries = max_entries
+
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+        self.evictions = 0
+
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY,"
+            " headers TEXT NOT NULL,"
+            " body BLOB NOT NULL,"
+            " stored_at REAL NOT NULL,"
+            " accessed_at REAL NOT NULL)"
+        )
+        self._connection.execute(
+            "CREATE INDEX IF NOT EXISTS responses_accessed_at"
+            " ON responses (accessed_at)"
+        )
+        self._connection.commit()
+        (self._entries,) = self._connection.execute(
+            "SELECT COUNT(*) FROM responses"
+        ).fetchone()
+        # key: access time, not written yet (see `_write_accesses`)
+        self._accesses = {}
+
+    def ttl(self, key: str):
+        return self.ttls[get_endpoint_type(key)]
+
+    def get(self, key: str):
+        """Return the `CacheEntry` of the key, or None"""
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT headers, body, stored_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+
+            self._accesses[key] = time.time()
+
+        return CacheEntry(key, json.loads(row[0]), row[1], row[2])
+
+    def put(self, key: str, response):
+        """Store a 200 response"""
+        headers = {
+            header: response.headers[header]
+            for header in CACHED_HEADERS
+            if header in response.headers
+        }
+        now = time.time()
+        with self._lock:
+            self._accesses.pop(key, None)
+            cursor = self._connection.execute(
+                "UPDATE responses SET headers = ?, body = ?, stored_at = ?,"
+                " accessed_at = ? WHERE key = ?",
+                (json.dumps(headers), response.content, now, now, key),
+            )
+            if cursor.rowcount == 0:
+                self._connection.execute(
+                    "INSERT INTO responses VALUES (?, ?, ?, ?, ?)",
+                    (key, json.dumps(headers), response.content, now, now),
+                )
+                self._entries += 1
+            self._write_accesses()
+            self._evict()
+            self._connection.commit()
+
+    def touch(self, key: str):
+        """Mark the key's entry as fresh again (after a 304 revalidation)"""
+        with self._lock:
+            self._connection.execute(
+                "UPDATE responses SET stored_at = ? WHERE key = ?", (time.time(), key)
+            )
+            self._write_accesses()
+            self._connection.commit()
+
+    def _write_accesses(self):
+        """Write the pending access times, in the current transaction"""
+        if not self._accesses:
+            return
+
+        self._connection.executemany(
+            "UPDATE responses SET accessed_at = ? WHERE key = ?",
+            [(accessed_at, key) for key, accessed_at in self._accesses.items()],
+        )
+        self._accesses.clear()
+
+    def _evict(self):
+        overflow = self._entries - self.max_entries
+        if overflow <= 0:
+            return
+
+        self._connection.execute(
+            "DELETE FROM responses WHERE key IN ("
+            " SELECT key FROM responses ORDER BY accessed_at LIMIT ?)",
+            (overflow,),
+        )
+        self._entries -= overflow
+        self.evictions += overflow
+
+    def lookup(self, key: str):
+        """Return (fresh response or None, entry to revalidate or None)"""
+        entry = self.get(key)
+        if entry is not None and entry.is_fresh(self.ttl(key)):
+            self.hits += 1
+            metrics.CACHE_LOOKUPS.inc(cache="http_responses", result="hit")
+            return entry.to_response(), None
+
+        self.misses += 1
+        metrics.CACHE_LOOKUPS.inc(cache="http_responses", result="miss")
+        return None, entry
+
+    def store(self, key: str, response, entry: CacheEntry = None):
+        """Store the response, or serve `entry` when the response is a 304"""
+        if response.status_code == 304 and entry is not None:
+            self.revalidations += 1
+            metrics.CACHE_LOOKUPS.inc(cache="http_responses", result="revalidated")
+            self.touch(key)
+            return entry.to_response()
+
+        if response.status_code == 200:
+            self.put(key, response)
+
+        return response
+
+    async def alookup(self, key: str):
+        """`lookup`, out of the event loop"""
+        return await asyncio.to_thread(self.lookup, key)
+
+    async def astore(self, key: str, response, entry: CacheEntry = None):
+        """`store`, out of the event loop"""
+        return await asyncio.to_thread(self.store, key, response, entry)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": self._entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "revalidations": self.revalidations,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+    def close(self):
+        with self._lock:
+            self._write_accesses()
+            self._connection.commit()
+            self._connection.close()
+
+
+_MISSING = object()
+
+
+class _Flight:
+    """A sync in-flight fetch shared by `SingleFlightTTLCache` callers"""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+    def wait(self):
+        self.event.wait()
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+def _retrieve_exception(task):
+    # Callers may all be gone. Avoid "exception never retrieved".
+    if not task.cancelled():
+        task.exception()
+
+
+class _AsyncFlights:
+    """Async in-flight computations, shared by the callers of the same key.
+
+    Each computation runs in its own task, not in its first caller's one: a
+    cancelled caller (even the first one, e.g. at its deadline) doesn't
+    cancel it for the others. The first caller's `BudgetExhausted` is its own
+    `ComputationBudget`'s: the other callers compute the value again.
+    """
+
+    def __init__(self):
+        self._tasks = {}
+
+    def __contains__(self, key):
+        return key in self._tasks
+
+    def tasks(self):
+        """Return the in-flight computations' tasks"""
+        return list(self._tasks.values())
+
+    async def _compute(self, key, acompute, store):
+        try:
+            value = await acompute()
+            store(key, value)
+            return value
+        finally:
+            del self._tasks[key]
+
+    async def run(self, key, acompute, store):
+        """Return (value, whether it was computed for this caller), calling
+        `await acompute()` then `store(key, value)` unless already in flight.
+        """
+        while True:
+            task = self._tasks.get(key)
+            leader = task is None
+            if leader:
+                task = asyncio.ensure_future(self._compute(key, acompute, store))
+                task.add_done_callback(_retrieve_exception)
+                self._tasks[key] = task
+
+            try:
+                # Shielded: a cancelled caller mustn't cancel the shared task
+                return await asyncio.shield(task), leader
+            except BudgetExhausted:
+                if leader:
+                    raise
+
+
+class SingleFlightTTLCache:
+    """In-process, size-bounded LRU cache with entries' time to live.
+
+    `get_or_fetch` / `aget_or_fetch` coalesce concurrent misses of the same
+    key ("single-flight"): only one fetch is performed, other callers wait for
+    its result. Errors aren't cached, they are raised to all waiting callers,
+    except the first caller's `BudgetExhausted`: the others fetch again.
+    Async fetches run in their own task (see `_AsyncFlights`).
+    """
+
+    def __init__(
+        self, max_entries: int = 10_000, ttl: float = 3600.0, name: str = "default"
+    ):
+        """
+        :param max_entries: Maximum number of cached values.
+        :param ttl: Values' time to live, in seconds.
+        :param name: Cache name, labelling its metrics.
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.name = name
+
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.expirations = 0
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # In-flight fetches: threading.Event for sync, asyncio tasks for async
+        self._inflight = {}
+        self._aflights = _AsyncFlights()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default=None):
+        """Return the key's value if cached and not expired"""
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                return default
+
+            value, expires_at = item
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                self.expirations += 1
+                return default
+
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def _lookup(self, key):
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            self.misses += 1
+            metrics.CACHE_LOOKUPS.inc(cache=self.name, result="miss")
+        else:
+            self.hits += 1
+            metrics.CACHE_LOOKUPS.inc(cache=self.name, result="hit")
+        return value
+
+    def get_or_fetch(self, key, fetch):
+        """Return the key's value, calling `fetch()` once on a miss"""
+        value = self._lookup(key)
+        if value is not _MISSING:
+            return value
+
+        while True:
+            with self._lock:
+                flight = self._inflight.get(key)
+                leader = flight is None
+                if leader:
+                    flight = self._inflight[key] = _Flight()
+            if leader:
+                return self._fetch(key, fetch, flight)
+
+            self.coalesced += 1
+            metrics.CACHE_LOOKUPS.inc(cache=self.name, result="coalesced")
+            try:
+                return flight.wait()
+            except BudgetExhausted:
+                # The leader's budget, not this caller's one: fetch again
+                continue
+
+    def _fetch(self, key, fetch, flight):
+        try:
+            flight.result = fetch()
+            self.set(key, flight.result)
+        except Exception as exc:
+            flight.error = exc
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[key]
+            flight.event.set()
+
+        return flight.result
+
+    async def aget_or_fetch(self, key, afetch):
+        """Async `get_or_fetch`, calling `await afetch()` once on a miss"""
+        value = self._lookup(key)
+        if value is not _MISSING:
+            return value
+
+        value, leader = await self._aflights.run(key, afetch, self.set)
+        if not leader:
+            self.coalesced += 1
+            metrics.CACHE_LOOKUPS.inc(cache=self.name, result="coalesced")
+        return value
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+class StaleWhileRevalidateCache:
+    """In-process, size-bounded LRU cache of computed values (e.g. neighbours
+    results), served stale while being recomputed.
+
+    - Fresh values (younger than `ttl`) are served directly.
+    - Stale values (expired for less than `stale_ttl`) are served directly
+    too, and recomputed in the background.
+    - Concurrent misses of the same key are coalesced: only one computation
+    is performed, in its own task (see `_AsyncFlights`), other callers wait
+    for its result. Errors aren't cached, nor values rejected by the callers'
+    `cacheable` predicate (e.g. partial results).
+
+    Async only: values are computed in the event loop (see `aget_or_compute`).
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 1000,
+        ttl: float = 3600.0,
+        stale_ttl: float = 24 * 3600.0,
+        name: str = "default",
+    ):
+        """
+        :param max_entries: Maximum number of cached values.
+        :param ttl: Values' time to live, in seconds.
+        :param stale_ttl: Seconds expired values are still served while
+        being recomputed.
+        :param name: Cache name, labelling its metrics.
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.name = name
+
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.refreshes = 0
+        self.refresh_errors = 0
+
+        # key: (value, stored_at)
+        self._entries = OrderedDict()
+        # In-flight computations, background refreshes tasks
+        self._flights = _AsyncFlights()
+        self._refreshes = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _get(self, key):
+        """Return the key's (value, age), (_MISSING, None) when unknown or too
+        stale to be served.
+        """
+        item = self._entries.get(key)
+        if item is None:
+            return _MISSING, None
+
+        value, stored_at = item
+        age = time.monotonic() - stored_at
+        if age >= self.ttl + self.stale_ttl:
+            del self._entries[key]
+            return _MISSING, None
+
+        self._entries.move_to_end(key)
+        return value, age
+
+    def set(self, key, value):
+        self._entries[key] = (value, time.monotonic())
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def _count(self, result):
+        metrics.CACHE_LOOKUPS.inc(cache=self.name, result=result)
+
+    async def _compute(self, key, acompute, cacheable):
+        """Compute and store the key's value, return (value, "miss"), or wait
+        for the in-flight computation of the key: (value, "coalesced").
+        """
+
+        def store(key, value):
+            if cacheable is None or cacheable(value):
+                self.set(key, value)
+
+        value, leader = await self._flights.run(key, acompute, store)
+        if leader:
+            return value, "miss"
+
+        self.coalesced += 1
+        self._count("coalesced")
+        return value, "coalesced"
+
+    async def aget_or_compute(self, key, acompute, cacheable=None):
+        """Return the key's (value, cache status), computing it with
+        `await acompute()` on a miss.
+
+        Cache status: "hit", "stale" (served, and being recomputed), "miss" or
+        "coalesced" (waited for another caller's computation).
+
+        :param cacheable: [optional] `cacheable(value)` predicate: computed
+        values it rejects are returned but not stored.
+        """
+        value, age = self._get(key)
+        if value is _MISSING:
+            self.misses += 1
+            self._count("miss")
+            return await self._compute(key, acompute, cacheable)
+
+        if age < self.ttl:
+            self.hits += 1
+            self._count("hit")
+            return value, "hit"
+
+        self.stale_hits += 1
+        self._count("stale")
+        self._refresh_in_background(key, acompute, cacheable)
+        return value, "stale"
+
+    def _refresh_in_background(self, key, acompute, cacheable):
+        if key in self._refreshes or key in self._flights:
+            return
+
+        task = asyncio.ensure_future(self._refresh(key, acompute, cacheable))
+        self._refreshes[key] = task
+        task.add_done_callback(lambda _: self._refreshes.pop(key, None))
+
+    async def _refresh(self, key, acompute, cacheable):
+        try:
+            await self._compute(key, acompute, cacheable)
+        except Exception:
+            # The stale value is kept, the next lookup retries
+            self.refresh_errors += 1
+        else:
+            self.refreshes += 1
+
+    async def arefresh(self, key, acompute, cacheable=None):
+        """Compute and store the key's value now (e.g. cache warm-up). See
+        `aget_or_compute`.
+        """
+        value, _ = await self._compute(key, acompute, cacheable)
+        return value
+
+    async def close(self):
+        """Cancel the background refreshes and in-flight computations"""
+        tasks = [*self._refreshes.values(), *self._flights.tasks()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stats(self):
+        lookups = self.hits + self.stale_hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "evictions": self.evictions,
+            "refreshes": self.refreshes,
+            "refresh_errors": self.refresh_errors,
+            "hit_rate": (self.hits + self.stale_hits) / lookups if lookups else 0.0,
+        }
+
+
+def build_http_response_cache_from_settings(settings):
+    """Build the GitHub `HTTPResponseCache` from the App `Settings`.
+
+    Returns None when the cache is disabled (`github_cache_path` not set).
+    """
+    if not settings.github_cache_path:
+        return None
+
+    return HTTPResponseCache(
+        path=settings.github_cache_path,
+        ttls={
+            "stargazers": settings.github_cache_ttl_stargazers,
+            "starred": settings.github_cache_ttl_starred,
+            "repository": settings.github_cache_ttl_repository,
+            "default": settings.github_cache_ttl_default,
+        },
+        max_entries=settings.github_cache_max_entries,
+    )
+
+
+def build_starred_repos_cache_from_settings(settings):
+    """Build the users' starred repositories `SingleFlightTTLCache` from the
+    App `Settings`. Returns None when disabled (`github_starred_cache_size=0`).
+    """
+    if not settings.github_starred_cache_size:
+        return None
+
+    return SingleFlightTTLCache(
+        max_entries=settings.github_starred_cache_size,
+        ttl=settings.github_starred_cache_ttl,
+        name="starred_repos",
+    )
+
+
+def build_neighbours_cache_from_settings(settings):
+    """Build the neighbours results `StaleWhileRevalidateCache` from the App
+    `Settings`. Returns None when disabled (`neighbours_cache_size=0`).
+    """
+    if not settings.neighbours_cache_size:
+        return None
+
+    return StaleWhileRevalidateCache(
+        max_entries=settings.neighbours_cache_size,
+        ttl=settings.neighbours_cache_ttl,
+        stale_ttl=settings.neighbours_cache_stale_ttl,
+        name="neighbours",
+    )
@@ -1,11 +1,36 @@
+import asyncio
+import contextlib
+import contextvars
+import functools
 import httpx
+import orjson
 import re
 import requests
+import time
 import urllib.parse
 
+from concurrent.futures import ThreadPoolExecutor
 from fastapi import HTTPException
 
-# REQUESTS_TIMEOUT = (3.10, 20.0)
+from mergify_algos import metrics
+from mergify_algos.github.cache import (
+    HTTPResponseCache,
+    SingleFlightTTLCache,
+    get_endpoint_type,
+)
+from mergify_algos.github.scheduler import (
+    RETRY_STATUS_CODES,
+    RateLimitExceeded,
+    RequestScheduler,
+    computation_timeout,
+)
+from mergify_algos.utils import token_fingerprint
+
+# Read/Write and connection timeouts (seconds) of the GitHub requests
+GITHUB_TIMEOUT = 30.0
+GITHUB_CONNECT_TIMEOUT = 10.0
+# Sync requests' (connect, read) timeout, the async client's default ones
+REQUESTS_TIMEOUT = (GITHUB_CONNECT_TIMEOUT, GITHUB_TIMEOUT)
 # HTTPX_TIMEOUT is causing issue when performing many concurrent HTTP requests.
 # Because Requests are all process at once (no batch) and many will reach timeout.
 # HTTPX_TIMEOUT = httpx.Timeout(10)
@@ -13,26 +38,289 @@ from fastapi import HTTPException
 
 GITHUB_API_URL = "https://api.github.com"
 GITHUB_NEXT_PATTERN = re.compile(r"(?<=<)([\S]*)(?=>; rel=\"Next\")", re.IGNORECASE)
+GITHUB_LAST_PATTERN = re.compile(r"(?<=<)([\S]*)(?=>; rel=\"Last\")", re.IGNORECASE)
+
+GITHUB_GRAPHQL_URL = f"{GITHUB_API_URL}/graphql"
+
+GITHUB_MEDIA_TYPE = "application/vnd.github.v3+json"
+# Stargazers are listed with their `starred_at` timestamp
+GITHUB_STAR_MEDIA_TYPE = "application/vnd.github.star+json"
+
+
+def build_async_http_client(
+    max_connections: int = 100,
+    max_keepalive_connections: int = 20,
+    keepalive_expiry: float = 30.0,
+    http2: bool = False,
+    timeout: float = GITHUB_TIMEOUT,
+    connect_timeout: float = GITHUB_CONNECT_TIMEOUT,
+):
+    """Build a pooled `httpx.AsyncClient` meant to be shared by all GitHub calls.
+
+    Connections are kept alive and reused, so concurrent requests don't pay a
+    new TLS handshake each time. Requests waiting for a free connection are
+    never timed out (`pool=None`): `max_connections` acts as a concurrency limit.
+
+    :param max_connections: Maximum number of opened connections.
+    :param max_keepalive_connections: Maximum number of idle connections kept.
+    :param keepalive_expiry: Seconds an idle connection is kept alive.
+    :param http2: Enable HTTP/2 multiplexing (requires `httpx[http2]`).
+    :param timeout: Read/Write timeout in seconds.
+    :param connect_timeout: Connection timeout in seconds.
+    :returns: httpx.AsyncClient
+    """
+    return httpx.AsyncClient(
+        http2=http2,
+        limits=httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+        ),
+        timeout=httpx.Timeout(timeout, connect=connect_timeout, pool=None),
+    )
+
+
+def build_async_http_client_from_settings(settings):
+    """Build the shared `httpx.AsyncClient` from the App `Settings`"""
+    return build_async_http_client(
+        max_connections=settings.github_max_connections,
+        max_keepalive_connections=settings.github_max_keepalive_connections,
+        keepalive_expiry=settings.github_keepalive_expiry,
+        http2=settings.github_http2,
+        timeout=settings.github_timeout,
+        connect_timeout=settings.github_connect_timeout,
+    )
+
+
+def _requests_timeout():
+    """Sync requests' (connect, read) timeout: `REQUESTS_TIMEOUT`, bounded by
+    the computation's deadline (see `ComputationBudget`).
+    """
+    return tuple(computation_timeout(timeout) for timeout in REQUESTS_TIMEOUT)
+
+
+def _set_url_page(url, page):
+    """Return the given url with its `page` query parameter set to `page`"""
+    parsed_url = urllib.parse.urlparse(url)
+    query = urllib.parse.parse_qs(parsed_url.query)
+    query["page"] = [page]
+    return parsed_url._replace(query=urllib.parse.urlencode(query, doseq=True)).geturl()
+
+
+def _stargazer_login(item):
+    """Return the login of a stargazers' list item (`star+json` items wrap
+    the user with its `starred_at`)
+    """
+    return item["user"]["login"] if "user" in item else item["login"]
+
+
+# -----------------------------------------------------------------------------
+# Pages decoding: each page is decoded (orjson) and reduced to the fields used
+# as soon as it is received, so only one page's objects tree is alive at once.
+def _decode_page(response):
+    """Return the response's decoded JSON body"""
+    return orjson.loads(response.content)
+
+
+def _extract_logins(response):
+    """Return the logins of a stargazers' page"""
+    return [_stargazer_login(item) for item in _decode_page(response)]
+
+
+def _extract_stargazers_starred_at(response):
+    """Return the (login, starred_at) of a stargazers' page (`star+json`)"""
+    return [
+        (_stargazer_login(item), item.get("starred_at"))
+        for item in _decode_page(response)
+    ]
+
+
+def _extract_full_names(response):
+    """Return the repositories' names ("{owner}/{repo}") of a starred page"""
+    return [_repo["full_name"] for _repo in _decode_page(response)]
+
+
+def _with_token(headers, token):
+    """Return the request's headers, authenticated with `token` if any"""
+    if token is None:
+        return headers
+
+    return {**headers, "Authorization": f"Bearer {token}"}
+
+
+def _observed(send, endpoint):
+    """Wrap a scheduler's sync `send`, recording each attempt's latency"""
+
+    def observed_send(token):
+        start, status = time.perf_counter(), "error"
+        try:
+            response = send(token)
+            status = response.status_code
+            return response
+        finally:
+            metrics.observe_github_request(
+                endpoint, status, time.perf_counter() - start
+            )
+
+    return observed_send
+
+
+def _aobserved(send, endpoint):
+    """Async `_observed`"""
+
+    async def observed_send(token):
+        start, status = time.perf_counter(), "error"
+        try:
+            response = await send(token)
+            status = response.status_code
+            return response
+        finally:
+            metrics.observe_github_request(
+                endpoint, status, time.perf_counter() - start
+            )
+
+    return observed_send
 
-GITHUB_GRAPHQL_URL = "https://api.github.com/graphql"
+
+def _raise_for_status(response):
+    """Turn a GitHub error response into an `HTTPException`"""
+    if response.status_code != 200:
+        raise HTTPException(status_code=response.status_code, detail=response.json())
 
 
 class GitHubRestClient:
 
-    def __init__(self, token: str = None):
+    def __init__(
+        self,
+        token: str = None,
+        http_client: httpx.AsyncClient = None,
+        scheduler: RequestScheduler = None,
+        max_page_workers: int = 8,
+        cache: HTTPResponseCache = None,
+        starred_cache: SingleFlightTTLCache = None,
+        base_url: str = GITHUB_API_URL,
+    ):
+        """GitHub Rest API client.
+
+        :param token: GitHub access token. When None, requests are spread over
+        the scheduler's `TokenPool`, if any.
+        :param http_client: [optional] Shared `httpx.AsyncClient` used by the
+        async methods. When not provided, each async call opens its own client.
+        :param scheduler: [optional] Shared `RequestScheduler` handling
+        concurrency, rate limits and retries. Default to a client's own one.
+        :param max_page_workers: Number of threads fetching pages concurrently
+        in the sync implementation.
+        :param cache: [optional] Shared `HTTPResponseCache`, responses are
+        served from it or revalidated with conditional requests.
+        :param starred_cache: [optional] Shared in-process cache of users'
+        starred repositories, used by both the sync and async implementations.
+        Concurrent fetches of the same user are coalesced.
+        :param base_url: GitHub API url (e.g. a GitHub Enterprise or a local
+        fake GitHub one).
+        """
         self._token = token
+        self._base_url = base_url.rstrip("/")
+        self._http_client = http_client
+        self._scheduler = scheduler if scheduler is not None else RequestScheduler()
+        self._max_page_workers = max_page_workers
+        self._cache = cache
+        self._starred_cache = starred_cache
+
+    def _cache_key(self, headers, url):
+        """Key of the url's response in the HTTP responses cache"""
+        return f"{token_fingerprint(self._token)} {headers['Accept']} {url}"
+
+    def _get(self, url):
+        """Sync GET request, sent through the cache and the scheduler"""
+        endpoint = get_endpoint_type(url)
+        metrics.GITHUB_PAGES.inc(endpoint=endpoint)
+        headers = self._build_headers(self._media_type_headers(url))
+        cache_key = self._cache_key(headers, url)
+        entry = None
+        if self._cache is not None:
+            response, entry = self._cache.lookup(cache_key)
+            if response is not None:
+                return response
+            if entry is not None:
+                headers.update(entry.conditional_headers())
+
+        response = self._scheduler.send(
+            _observed(
+                lambda token: requests.get(
+                    url,
+                    headers=_with_token(headers, token),
+                    timeout=_requests_timeout(),
+                ),
+                endpoint,
+            ),
+            token=self._token,
+        )
+        if self._cache is not None:
+            response = self._cache.store(cache_key, response, entry)
+
+        return response
+
+    async def _aget(self, client, url):
+        """Async GET request, sent through the cache and the scheduler"""
+        endpoint = get_endpoint_type(url)
+        metrics.GITHUB_PAGES.inc(endpoint=endpoint)
+        headers = self._build_headers(self._media_type_headers(url))
+        cache_key = self._cache_key(headers, url)
+        entry = None
+        if self._cache is not None:
+            response, entry = await self._cache.alookup(cache_key)
+            if response is not None:
+                return response
+            if entry is not None:
+                headers.update(entry.conditional_headers())
+
+        response = await self._scheduler.asend(
+            _aobserved(
+                lambda token: client.get(url, headers=_with_token(headers, token)),
+                endpoint,
+            ),
+            token=self._token,
+        )
+        if self._cache is not None:
+            response = await self._cache.astore(cache_key, response, entry)
+
+        return response
+
+    @contextlib.asynccontextmanager
+    async def _aclient(self):
+        """Yield the shared async HTTP client, or a short-lived one"""
+        if self._http_client is not None:
+            yield self._http_client
+            return
+
+        async with httpx.AsyncClient() as client:
+            yield client
+
+    def _media_type_headers(self, url):
+        """Request stargazers with their `starred_at` timestamp"""
+        if get_endpoint_type(url) == "stargazers":
+            return {"Accept": GITHUB_STAR_MEDIA_TYPE}
+        return None
 
     def _build_headers(self, extra_headers: dict = None):
         """Private function to build GitHub headers"""
-        headers = {"Accept": "application/vnd.github.v3+json"}
-        if self._token is not None:
-            headers["Authorization"] = f"Bearer {self._token}"
-
+        headers = {"Accept": GITHUB_MEDIA_TYPE}
         if extra_headers:
             headers.update(extra_headers)
 
         return headers
 
+    def _starred_cache_key(self, user, params=None, limit_pages=2):
+        """Key of the user's starred repositories in the starred cache, per
+        token (see `token_fingerprint`)
+        """
+        return (
+            token_fingerprint(self._token),
+            user,
+            tuple(sorted((params or {}).items())),
+            limit_pages,
+        )
+
     def _build_params(self, extra_params: dict = None):
         """Private function to build GitHub params.
         It encodes a dict into a URL query string
@@ -58,40 +346,99 @@ class GitHubRestClient:
         if not link_header:
             return None
 
+        # Last page's link header doesn't provide any "next" url
         _results = re.findall(GITHUB_NEXT_PATTERN, link_header)
-        return _results[0]
+        return _results[0] if _results else None
 
-    def _get_paginated_data(self, url, limit_pages=2):
-        """Fetch Data from a paginated API.
+    def _get_last_page(self, response):
+        """Return the last page number (`rel="last"` url) of the response's
+        link header, 1 when the response is the only page.
+        """
+        link_header = response.headers.get("link", False)
+        _results = re.findall(GITHUB_LAST_PATTERN, link_header) if link_header else []
+        if not _results:
+            return 1
 
-        :param url: Request url to fetch data from
+        query = urllib.parse.parse_qs(urllib.parse.urlparse(_results[0]).query)
+        return int(query["page"][0])
+
+    def _get_page_urls(self, response, limit_pages=2):
+        """Return the urls of the pages following the response's page.
+
+        Computed from the `rel="last"` url of the first page's link header, up
+        to `limit_pages` pages, so they can be fetched concurrently.
+
+        :param response: First page's response
         :param limit_pages: Limit the number of page used to fetch data.
-        :returns: data
+        :returns: List of urls, or None when the link header has no last url.
         """
-        _data, page, next_url = [], 1, url
+        link_header = response.headers.get("link", False)
+        if not link_header:
+            return []
 
-        while next_url:
-            # Fetching one page
-            response = requests.get(next_url, headers=self._build_headers())
+        _results = re.findall(GITHUB_LAST_PATTERN, link_header)
+        if not _results:
+            # Either already the last page or a cursor based pagination
+            return None if self._get_next_url(response) else []
 
-            # blong: Here we should handle retries with expo waiting time...
-            if response.status_code != 200:
-                raise HTTPException(
-                    status_code=response.status_code, detail=response.json()
-                )
+        last_url = _results[0]
+        query = urllib.parse.parse_qs(urllib.parse.urlparse(last_url).query)
+        last_page = min(int(query["page"][0]), limit_pages)
 
-            # parsed_data = _parse_data(response.json())
-            _data += response.json()
+        return [_set_url_page(last_url, page) for page in range(2, last_page + 1)]
 
-            # Check if we reach limit_pages and if response has a next_url
-            # blong: TODO: can be improve to avoid if/else?
-            if page < limit_pages:
-                next_url = self._get_next_url(response)
-                page += 1
-            else:
-                next_url = None
+    def _get_page_data(self, url, extract=_decode_page):
+        """Fetch one page's data. Retries are handled by the scheduler"""
+        response = self._get(url)
+        _raise_for_status(response)
+        return extract(response)
 
-        return _data
+    def _iter_next_paginated_data(self, response, limit_pages=2, extract=_decode_page):
+        """Iterate over pages following the response's one, one after the
+        other, following its `rel="next"` url.
+        """
+        page, next_url = 2, self._get_next_url(response)
+
+        while next_url and page <= limit_pages:
+            response = self._get(next_url)
+            _raise_for_status(response)
+            yield extract(response)
+
+            next_url = self._get_next_url(response)
+            page += 1
+
+    def _iter_paginated_data(self, url, limit_pages=2, extract=_decode_page):
+        """Iterate over a paginated API, page by page.
+
+        The first page gives the last page url (`rel="last"`), then the
+        following pages allowed by `limit_pages` are fetched concurrently and
+        yielded in order.
+
+        :param url: Request url to fetch data from
+        :param limit_pages: Limit the number of page used to fetch data.
+        :param extract: Page's response decoding function (see `_decode_page`).
+        :returns: Generator of pages' extracted data
+        """
+        response = self._get(url)
+        _raise_for_status(response)
+        yield extract(response)
+
+        if limit_pages <= 1:
+            return
+
+        page_urls = self._get_page_urls(response, limit_pages)
+        if page_urls is None:
+            yield from self._iter_next_paginated_data(response, limit_pages, extract)
+            return
+
+        get_page_data = functools.partial(self._get_page_data, extract=extract)
+        # Page threads share the caller's context (timings, computation budget)
+        context = contextvars.copy_context()
+        with ThreadPoolExecutor(max_workers=self._max_page_workers) as executor:
+            # `map` keeps the pages order
+            yield from executor.map(
+                lambda url: context.copy().run(get_page_data, url), page_urls
+            )
 
     def fetch_stargazers(self, owner, repo, params=None, limit_pages=2):
         """Fetch stargazers from GitHub paginated API.
@@ -102,10 +449,14 @@ class GitHubRestClient:
         :param limit_pages: Limit the number of page used to fetch data.
         :returns: List of GitHub users' name (login)
         """
-        url = f"{GITHUB_API_URL}/repos/{owner}/{repo}/stargazers?{self._build_params(params)}"
-        data = self._get_paginated_data(url, limit_pages=limit_pages)
+        url = f"{self._base_url}/repos/{owner}/{repo}/stargazers?{self._build_params(params)}"
+        stargazers = []
+        for page_stargazers in self._iter_paginated_data(
+            url, limit_pages=limit_pages, extract=_extract_logins
+        ):
+            stargazers += page_stargazers
 
-        return [user["login"] for user in data]
+        return stargazers
 
     def fetch_user_starred_repos(self, user, params=None, limit_pages=2):
         """Fetch given user's starred repositories from GitHub paginated API
@@ -116,79 +467,280 @@ class GitHubRestClient:
 
         :returns: List of GitHub repository's name
         """
-        url = f"{GITHUB_API_URL}/users/{user}/starred?{self._build_params(params)}"
-        data = self._get_paginated_data(url, limit_pages=limit_pages)
+        if self._starred_cache is not None:
+            return self._starred_cache.get_or_fetch(
+                self._starred_cache_key(user, params, limit_pages),
+                lambda: self._fetch_user_starred_repos(user, params, limit_pages),
+            )
 
+        return self._fetch_user_starred_repos(user, params, limit_pages)
+
+    def _fetch_user_starred_repos(self, user, params=None, limit_pages=2):
+        """See `fetch_user_starred_repos`, without the starred cache"""
+        url = f"{self._base_url}/users/{user}/starred?{self._build_params(params)}"
         # blong: here full-name returns "{owner}/{repo}"
         # name returns "{repo}"
-        return [_repo["full_name"] for _repo in data]
+        repos = []
+        for page_repos in self._iter_paginated_data(
+            url, limit_pages=limit_pages, extract=_extract_full_names
+        ):
+            repos += page_repos
+
+        return repos
 
     # -------------------------------------------------------------------------
     # Asynchronize implementation
-    async def _aget_paginated_data(self, url, limit_pages=2):
-        """Async Get Paginated Data
-        TODO: Doc
+    async def _aget_page_data(self, client, url, extract=_decode_page):
+        """Async fetch one page's data. Retries are handled by the scheduler"""
+        response = await self._aget(client, url)
+        _raise_for_status(response)
+        return extract(response)
+
+    async def _aiter_next_paginated_data(
+        self, client, response, limit_pages=2, extract=_decode_page
+    ):
+        """Async iterate over pages following the response's one, one after the
+        other, following its `rel="next"` url.
         """
-        _data, page, next_url = [], 1, url
+        page, next_url = 2, self._get_next_url(response)
 
-        async with httpx.AsyncClient() as client:
-            while next_url:
-                response = await client.get(next_url, headers=self._build_headers())
-                if response.status_code != 200:
-                    raise HTTPException(
-                        status_code=response.status_code, detail=response.json()
+        while next_url and page <= limit_pages:
+            response = await self._aget(client, next_url)
+            _raise_for_status(response)
+            yield extract(response)
+
+            next_url = self._get_next_url(response)
+            page += 1
+
+    async def _aiter_paginated_data(self, url, limit_pages=2, extract=_decode_page):
+        """Async iterate over a paginated API, page by page.
+
+        The first page gives the last page url (`rel="last"`), then the
+        following pages allowed by `limit_pages` are fetched concurrently.
+        Pages are yielded in order, each as soon as it (and the previous ones)
+        is received, so callers can start processing it early.
+
+        :param url: Request url to fetch data from
+        :param limit_pages: Limit the number of page used to fetch data.
+        :param extract: Page's response decoding function (see `_decode_page`).
+        :returns: Async generator of pages' extracted data
+        """
+        async with self._aclient() as client:
+            response = await self._aget(client, url)
+            _raise_for_status(response)
+            yield extract(response)
+
+            if limit_pages <= 1:
+                return
+
+            page_urls = self._get_page_urls(response, limit_pages)
+            if page_urls is None:
+                async for page_data in self._aiter_next_paginated_data(
+                    client, response, limit_pages, extract
+                ):
+                    yield page_data
+                return
+
+            tasks = [
+                asyncio.ensure_future(self._aget_page_data(client, page_url, extract))
+                for page_url in page_urls
+            ]
+            try:
+                for task in tasks:
+                    yield await task
+            finally:
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _aget_paginated_data(self, url, limit_pages=2, extract=_decode_page):
+        """Async Fetch Data from a paginated API.
+
+        :param url: Request url to fetch data from
+        :param limit_pages: Limit the number of page used to fetch data.
+        :param extract: Page's response decoding function (see `_decode_page`).
+        :returns: Pages' extracted data, concatenated
+        """
+        _data = []
+        async for page_data in self._aiter_paginated_data(url, limit_pages, extract):
+            _data += page_data
+
+        return _data
+
+    async def aiter_stargazers(self, owner, repo, params=None, limit_pages=2):
+        """Async iterate over stargazers from GitHub paginated API, page by page.
+
+        :param owner: Github repository's owner name
+        :param repo: GitHub repository's name
+        :param params: [optional] Extra params added to the urls (Default: None)
+        :param limit_pages: Limit the number of page used to fetch data.
+        :returns: Async generator of lists of GitHub users' name (login)
+        """
+        url = f"{self._base_url}/repos/{owner}/{repo}/stargazers?{self._build_params(params)}"
+        async for page_stargazers in self._aiter_paginated_data(
+            url, limit_pages, extract=_extract_logins
+        ):
+            yield page_stargazers
+
+    async def aiter_stargazers_pages(self, owner, repo, pages, params=None):
+        """Async iterate over the given stargazers' pages, fetched concurrently.
+
+        :param owner: Github repository's owner name
+        :param repo: GitHub repository's name
+        :param pages: Page numbers to fetch (e.g. a random sample of pages)
+        :param params: [optional] Extra params added to the urls (Default: None)
+        :returns: Async generator of lists of GitHub users' name (login), in
+        completion order
+        """
+        url = f"{self._base_url}/repos/{owner}/{repo}/stargazers?{self._build_params(params)}"
+        async with self._aclient() as client:
+            tasks = [
+                asyncio.ensure_future(
+                    self._aget_page_data(
+                        client, _set_url_page(url, page), _extract_logins
                     )
+                )
+                for page in pages
+            ]
+            try:
+                for task in asyncio.as_completed(tasks):
+                    yield await task
+            finally:
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
 
-                # parsed_data = _parse_data(response.json())
-                _data += response.json()
+    async def afetch_new_stargazers(self, owner, repo, since=None, max_pages=10):
+        """Async fetch the repository's stargazers starred after `since`.
+
+        Stargazers are listed by starring date: pages are walked backward from
+        the last one (`rel="last"`), until a page reaches stargazers starred at
+        or before `since`. Only the first page is fetched to find the last one,
+        and it is usually answered `304` by the responses cache.
+
+        :param owner: Github repository's owner name
+        :param repo: GitHub repository's name
+        :param since: [optional] `starred_at` of the newest known stargazer
+        (ISO 8601). All stargazers when not provided.
+        :param max_pages: Maximum number of pages walked.
+        :returns: (stargazers, reached) where stargazers is a list of
+        (login, starred_at) in starring order, and reached is True when no
+        stargazer is missing between `since` (or the first one) and the last.
+        """
+        url = f"{self._base_url}/repos/{owner}/{repo}/stargazers?{self._build_params()}"
+        stargazers = []
+        async with self._aclient() as client:
+            response = await self._aget(client, url)
+            _raise_for_status(response)
+            last_page = self._get_last_page(response)
 
-                # Check if, we reach limit_pages and if response has a next_url
-                # blong: TODO: can be improve to avoid if/else?
-                if page < limit_pages:
-                    next_url = self._get_next_url(response)
-                    page += 1
+            for page in range(last_page, max(last_page - max_pages, 0), -1):
+                if page == 1:
+                    page_stargazers = _extract_stargazers_starred_at(response)
                 else:
-                    next_url = None
+                    page_stargazers = await self._aget_page_data(
+                        client,
+                        _set_url_page(url, page),
+                        _extract_stargazers_starred_at,
+                    )
 
-        return _data
+                new_stargazers = [
+                    (login, starred_at)
+                    for login, starred_at in page_stargazers
+                    if since is None or starred_at is None or starred_at > since
+                ]
+                stargazers = new_stargazers + stargazers
+                if len(new_stargazers) < len(page_stargazers) or page == 1:
+                    return stargazers, True
 
-    async def afetch_user_starred_repos(self, user, params=None, limit_pages=2):
-        """Async Fetch user starred repositories
-        TODO: Doc
+        return stargazers, False
+
+    async def afetch_stargazers_last_page(self, owner, repo):
+        """Async fetch the number of listable stargazers' pages (of 100).
+
+        GitHub only lists the first stargazers' pages (about 400) and answers
+        422 past them: the first page's `rel="last"` url gives the pages
+        actually listable, unlike the repository's `stargazers_count`.
         """
-        url = f"{GITHUB_API_URL}/users/{user}/starred?{self._build_params(params)}"
-        data = await self._aget_paginated_data(url, limit_pages=limit_pages)
+        url = f"{self._base_url}/repos/{owner}/{repo}/stargazers?{self._build_params()}"
+        async with self._aclient() as client:
+            response = await self._aget(client, url)
+            _raise_for_status(response)
 
-        return [_repo["full_name"] for _repo in data]
+        return self._get_last_page(response)
+
+    async def afetch_repository(self, owner, repo):
+        """Async fetch the repository's information (`stargazers_count`...)"""
+        async with self._aclient() as client:
+            return await self._aget_page_data(
+                client, f"{self._base_url}/repos/{owner}/{repo}"
+            )
+
+    async def afetch_stargazers(self, owner, repo, params=None, limit_pages=2):
+        """Async implementation of `fetch_stargazers`"""
+        stargazers = []
+        async for page_stargazers in self.aiter_stargazers(
+            owner, repo, params=params, limit_pages=limit_pages
+        ):
+            stargazers += page_stargazers
+
+        return stargazers
+
+    async def afetch_user_starred_repos(self, user, params=None, limit_pages=2):
+        """Async implementation of `fetch_user_starred_repos`"""
+        if self._starred_cache is not None:
+            return await self._starred_cache.aget_or_fetch(
+                self._starred_cache_key(user, params, limit_pages),
+                lambda: self._afetch_user_starred_repos(user, params, limit_pages),
+            )
+
+        return await self._afetch_user_starred_repos(user, params, limit_pages)
+
+    async def _afetch_user_starred_repos(self, user, params=None, limit_pages=2):
+        """See `afetch_user_starred_repos`, without the starred cache"""
+        url = f"{self._base_url}/users/{user}/starred?{self._build_params(params)}"
+        return await self._aget_paginated_data(
+            url, limit_pages=limit_pages, extract=_extract_full_names
+        )
 
 
 # -----------------------------------------------------------------------------
-# Exploring GraphQL...
+# GitHub GraphQL API
 # See: https://docs.github.com/en/graphql/overview/explorer
-# When it work, it's fast, however, GraphQL often return error when testing
-# on large repository with many stargazers.
-# GraphQL limit: https://docs.github.com/en/graphql/overview/rate-limits-and-node-limits-for-the-graphql-api
-# - Clients must supply a first or last argument on any connection
-# - max 500,000 total nodes.
-repo_stargazer_with_starred_repositories_query = """
-query($owner: String!, $name: String!, $after: String) {
+# GraphQL limits: https://docs.github.com/en/graphql/overview/rate-limits-and-node-limits-for-the-graphql-api
+# - Clients must supply a first or last argument on any connection (max 100).
+# - max 500,000 total nodes. Large queries on large repositories time out well
+# before that (502 or "timeout" errors): hence the node budget and the page
+# sizes adapted by `GraphQLPageSizer`.
+GRAPHQL_MAX_FIRST = 100
+GRAPHQL_NODE_BUDGET = 10_000
+# Maximum number of users queried at once (aliased `user` blocks)
+GRAPHQL_MAX_USERS_BATCH = 50
+# GraphQL error types that smaller pages won't solve, and their status code
+GRAPHQL_FATAL_ERRORS = {
+    "NOT_FOUND": 404,
+    "FORBIDDEN": 403,
+    "INSUFFICIENT_SCOPES": 403,
+    "UNAUTHORIZED": 401,
+}
+
+STARGAZERS_WITH_STARRED_REPOS_QUERY = """
+query($owner: String!, $name: String!, $first: Int!, $after: String, $starredFirst: Int!) {
   repository(owner: $owner, name: $name) {
-    name
-    nameWithOwner
-    stargazers(first: 50, after: $after) {
-      edges {
-        node {
-          login
-          starredRepositories(first: 50, orderBy: {field: STARRED_AT, direction: DESC}) {
-            totalCount
-            nodes {
-              nameWithOwner
-            }
-            pageInfo {
-              endCursor
-              startCursor
-              hasNextPage
-            }
+    stargazers(first: $first, after: $after) {
+      pageInfo {
+        endCursor
+        hasNextPage
+      }
+      nodes {
+        login
+        starredRepositories(first: $starredFirst, orderBy: {field: STARRED_AT, direction: DESC}) {
+          nodes {
+            nameWithOwner
+          }
+          pageInfo {
+            endCursor
+            hasNextPage
           }
         }
       }
@@ -197,46 +749,585 @@ query($owner: String!, $name: String!, $after: String) {
 }
 """
 
+USER_STARRED_REPOS_QUERY = """
+query($login: String!, $first: Int!, $after: String) {
+  user(login: $login) {
+    starredRepositories(first: $first, after: $after, orderBy: {field: STARRED_AT, direction: DESC}) {
+      nodes {
+        nameWithOwner
+      }
+      pageInfo {
+        endCursor
+        hasNextPage
+      }
+    }
+  }
+}
+"""
+
+# One aliased block per user, see `_build_users_starred_repos_query`
+USERS_STARRED_REPOS_BLOCK = """
+  u{i}: user(login: $login{i}) {{
+    starredRepositories(first: $first, after: $after{i}, orderBy: {{field: STARRED_AT, direction: DESC}}) {{
+      nodes {{
+        nameWithOwner
+      }}
+      pageInfo {{
+        endCursor
+        hasNextPage
+      }}
+    }}
+  }}
+"""
+
+
+def _build_users_starred_repos_query(users, first):
+    """Build the query fetching several users' starred repositories at once.
+
+    :param users: List of (login, starred repositories cursor or None)
+    :param first: Number of starred repositories fetched per user.
+    :returns: (query, variables)
+    """
+    declarations, blocks, variables = ["$first: Int!"], [], {"first": first}
+    for i, (login, after) in enumerate(users):
+        declarations.append(f"$login{i}: String!, $after{i}: String")
+        blocks.append(USERS_STARRED_REPOS_BLOCK.format(i=i))
+        variables[f"login{i}"] = login
+        variables[f"after{i}"] = after
+
+    query = f"query({', '.join(declarations)}) {{{''.join(blocks)}}}\n"
+    return query, variables
+
+
+class GraphQLPageSizer:
+    """Adaptive `first:` arguments of a GraphQL query with nested connections.
+
+    Fetching `first` nodes with `nested_first` nested nodes each costs about
+    `first * (1 + nested_first)` nodes, kept under `node_budget`.
+    - On errors or timeouts, `first` is halved, then `nested_first` once
+    `first` reached 1.
+    - Each success grows `first` back by a tenth of its maximum.
+    """
+
+    def __init__(
+        self,
+        max_first: int = GRAPHQL_MAX_FIRST,
+        max_nested_first: int = 0,
+        node_budget: int = GRAPHQL_NODE_BUDGET,
+    ):
+        self.max_first = max_first
+        self.first = max_first
+        self.nested_first = max_nested_first
+        self.node_budget = node_budget
+        self.shrinks = 0
+
+    def sizes(self):
+        """Return the (first, nested_first) arguments of the next query"""
+        budget_first = self.node_budget // (1 + self.nested_first)
+        return max(1, min(self.first, budget_first)), self.nested_first
+
+    def on_success(self):
+        self.first = min(self.max_first, self.first + max(1, self.max_first // 10))
+
+    def shrink(self):
+        """Shrink the sizes after a failed query. False when already minimal"""
+        first, nested_first = self.sizes()
+        if first > 1:
+            self.first = first // 2
+        elif nested_first > 1:
+            self.nested_first = nested_first // 2
+        else:
+            return False
+
+        self.shrinks += 1
+        return True
+
+
+def _parse_graphql_response(response, missing_ok=False):
+    """Return (data, None), or (None, error) when smaller pages may help.
+
+    :param response: GraphQL response, None when the request timed out.
+    :param missing_ok: Ignore NOT_FOUND errors, the missing nodes being `null`
+    in the data (e.g. deleted users of a batch query).
+    :raises HTTPException: On errors smaller pages won't solve.
+    """
+    if response is None:
+        return None, HTTPException(status_code=504, detail="GitHub GraphQL timeout")
+
+    if response.status_code in RETRY_STATUS_CODES:
+        return None, HTTPException(
+            status_code=response.status_code, detail=response.text
+        )
+
+    _raise_for_status(response)
+    body = _decode_page(response)
+    errors = body.get("errors")
+    if errors and missing_ok and body.get("data") is not None:
+        errors = [error for error in errors if error.get("type") != "NOT_FOUND"]
+    if not errors:
+        return body["data"], None
+
+    for error in errors:
+        if error.get("type") == "RATE_LIMITED":
+            reset = response.headers.get("x-ratelimit-reset")
+            raise RateLimitExceeded(reset=int(reset) if reset else None)
+        if error.get("type") in GRAPHQL_FATAL_ERRORS:
+            raise HTTPException(
+                status_code=GRAPHQL_FATAL_ERRORS[error["type"]], detail=errors
+            )
+
+    return None, HTTPException(status_code=500, detail=errors)
+
+
+def _parse_starred_repos(connection, max_starred):
+    """Return (repositories, next page cursor or None) of a user's
+    `starredRepositories` connection, up to `max_starred` repositories.
+    """
+    repos = [_repo["nameWithOwner"] for _repo in connection["nodes"]][:max_starred]
+    page_info = connection["pageInfo"]
+    has_next_page = page_info["hasNextPage"] and len(repos) < max_starred
+    return repos, page_info["endCursor"] if has_next_page else None
+
 
 class GitHubGraphQLClient:
-    def __init__(self, token: str = None):
+    def __init__(
+        self,
+        token: str = None,
+        http_client: httpx.AsyncClient = None,
+        scheduler: RequestScheduler = None,
+        node_budget: int = GRAPHQL_NODE_BUDGET,
+        base_url: str = GITHUB_API_URL,
+    ):
+        """GitHub GraphQL API client.
+
+        Connections are crawled following their `pageInfo.endCursor`, with
+        page sizes adapted to the node budget and to errors / timeouts (see
+        `GraphQLPageSizer`).
+
+        :param token: GitHub access token. When None, requests are spread over
+        the scheduler's `TokenPool`, if any.
+        :param http_client: [optional] Shared `httpx.AsyncClient` used by the
+        async methods. When not provided, each async call opens its own client.
+        :param scheduler: [optional] Shared `RequestScheduler` handling
+        concurrency, rate limits and retries. Default to a client's own one.
+        :param node_budget: Maximum number of nodes requested by a query.
+        :param base_url: GitHub API url, the GraphQL endpoint being
+        `{base_url}/graphql`.
+        """
         self._token = token
+        self._graphql_url = f"{base_url.rstrip('/')}/graphql"
+        self._http_client = http_client
+        self._scheduler = scheduler if scheduler is not None else RequestScheduler()
+        self._stargazers_sizer = GraphQLPageSizer(
+            max_nested_first=GRAPHQL_MAX_FIRST, node_budget=node_budget
+        )
+        self._starred_sizer = GraphQLPageSizer(node_budget=node_budget)
+        self._users_sizer = GraphQLPageSizer(
+            max_first=GRAPHQL_MAX_USERS_BATCH,
+            max_nested_first=GRAPHQL_MAX_FIRST,
+            node_budget=node_budget,
+        )
 
-    def _build_headers(self, extra_headers: dict = None):
-        headers = {}
-        if self._token is not None:
-            headers["Authorization"] = f"Bearer {self._token}"
+    @contextlib.asynccontextmanager
+    async def _aclient(self):
+        """Yield the shared async HTTP client, or a short-lived one"""
+        if self._http_client is not None:
+            yield self._http_client
+            return
 
-        return headers
+        async with httpx.AsyncClient() as client:
+            yield client
 
-    def _parse_data(self, data):
-        results = {}
-        if "errors" in data:
-            raise HTTPException(status_code=500, detail=data["errors"])
+    def _post(self, query, variables):
+        """Sync GraphQL request sent through the scheduler, None on timeout"""
+        metrics.GITHUB_PAGES.inc(endpoint="graphql")
+        try:
+            return self._scheduler.send(
+                _observed(
+                    lambda token: requests.post(
+                        self._graphql_url,
+                        headers=_with_token({}, token),
+                        json={"query": query, "variables": variables},
+                        timeout=_requests_timeout(),
+                    ),
+                    "graphql",
+                ),
+                token=self._token,
+                resource="graphql",
+            )
+        except requests.Timeout:
+            return None
 
-        stargazers_data = data["data"]["repository"]["stargazers"]
-        for edge in stargazers_data["edges"]:
-            starred_repos = edge["node"]["starredRepositories"]["nodes"]
-            results[edge["node"]["login"]] = [x["nameWithOwner"] for x in starred_repos]
+    async def _apost(self, client, query, variables):
+        """Async GraphQL request sent through the scheduler, None on timeout"""
+        metrics.GITHUB_PAGES.inc(endpoint="graphql")
+        try:
+            return await self._scheduler.asend(
+                _aobserved(
+                    lambda token: client.post(
+                        self._graphql_url,
+                        headers=_with_token({}, token),
+                        json={"query": query, "variables": variables},
+                    ),
+                    "graphql",
+                ),
+                token=self._token,
+                resource="graphql",
+            )
+        except httpx.TimeoutException:
+            return None
 
-        return results
+    def _query(self, build_query, sizer, missing_ok=False):
+        """Send a query, shrinking the `sizer` page sizes on errors.
 
-    def fetch_stargazers_with_starred_repos(self, owner, repo, limit_pages=2):
-        response = requests.post(
-            GITHUB_GRAPHQL_URL,
-            headers=self._build_headers(),
-            json={
-                "query": repo_stargazer_with_starred_repositories_query,
-                "variables": {
-                    "owner": owner,
-                    "name": repo,
-                },
+        :param build_query: Callable building the (query, variables) from the
+        (first, nested_first) page sizes.
+        :param sizer: `GraphQLPageSizer` of the query.
+        :param missing_ok: See `_parse_graphql_response`.
+        :returns: Response's data
+        """
+        while True:
+            data, error = _parse_graphql_response(
+                self._post(*build_query(*sizer.sizes())), missing_ok
+            )
+            if error is None:
+                sizer.on_success()
+                return data
+            if not sizer.shrink():
+                raise error
+
+    async def _aquery(self, client, build_query, sizer, missing_ok=False):
+        """Async implementation of `_query`"""
+        while True:
+            data, error = _parse_graphql_response(
+                await self._apost(client, *build_query(*sizer.sizes())), missing_ok
+            )
+            if error is None:
+                sizer.on_success()
+                return data
+            if not sizer.shrink():
+                raise error
+
+    def _stargazers_query(self, owner, repo, after, remaining, max_starred):
+        """Return the `build_query` callable of a stargazers page query"""
+        return lambda first, nested_first: (
+            STARGAZERS_WITH_STARRED_REPOS_QUERY,
+            {
+                "owner": owner,
+                "name": repo,
+                "after": after,
+                "first": min(first, remaining),
+                "starredFirst": min(nested_first, max_starred),
             },
         )
 
-        if response.status_code != 200:
-            raise HTTPException(
-                status_code=response.status_code, detail=response.json()
+    def _starred_query(self, login, after, remaining):
+        """Return the `build_query` callable of a starred repos page query"""
+        return lambda first, nested_first: (
+            USER_STARRED_REPOS_QUERY,
+            {"login": login, "after": after, "first": min(first, remaining)},
+        )
+
+    def _users_starred_query(self, users, max_starred):
+        """Return the `build_query` callable of a users' batch query.
+        `first` users of the batch are queried (see `_parse_users_batch`).
+        """
+        return lambda first, nested_first: _build_users_starred_repos_query(
+            [(login, after) for login, _, after in users[:first]],
+            min(nested_first, max_starred),
+        )
+
+    def _parse_users_batch(self, data, users, max_starred):
+        """Parse a users' batch query response.
+
+        :param data: Response's data
+        :param users: Batch's [(login, starred repos so far, cursor or None)]
+        :param max_starred: Maximum number of starred repositories per user.
+        :returns: (queried users with their updated repos and cursor, users
+        left out of the query because its page size was shrunk)
+        """
+        fetched = []
+        for i, (login, repos, _) in enumerate(users[: len(data)]):
+            if data[f"u{i}"] is None:
+                # Deleted or renamed user: nothing more to fetch
+                fetched.append((login, repos, None))
+                continue
+            page_repos, after = _parse_starred_repos(
+                data[f"u{i}"]["starredRepositories"], max_starred - len(repos)
+            )
+            fetched.append((login, repos + page_repos, after))
+
+        return fetched, users[len(data) :]
+
+    def _parse_stargazers_page(self, data, max_starred):
+        """Return the page's [(login, starred repos, starred cursor or None)]
+        and the stargazers' next page cursor (None on the last page).
+        """
+        stargazers = data["repository"]["stargazers"]
+        page = [
+            (
+                node["login"],
+                *_parse_starred_repos(node["starredRepositories"], max_starred),
             )
+            for node in stargazers["nodes"]
+        ]
+        page_info = stargazers["pageInfo"]
+        return page, page_info["endCursor"] if page_info["hasNextPage"] else None
 
-        return self._parse_data(response.json())
+    def _iter_stargazers_pages(self, owner, repo, max_stargazers, max_starred):
+        """Iterate over the repository's stargazers pages, following the cursor.
+        See `_parse_stargazers_page` for the pages' format.
+        """
+        after, count = None, 0
+        while count < max_stargazers:
+            data = self._query(
+                self._stargazers_query(
+                    owner, repo, after, max_stargazers - count, max_starred
+                ),
+                self._stargazers_sizer,
+            )
+            page, after = self._parse_stargazers_page(data, max_starred)
+            count += len(page)
+            yield page
+
+            if after is None:
+                return
+
+    def _fetch_starred_repos_continuation(self, login, repos, after, max_starred):
+        """Follow the user's starred repositories cursor, up to `max_starred`"""
+        while after is not None:
+            remaining = max_starred - len(repos)
+            data = self._query(
+                self._starred_query(login, after, remaining),
+                self._starred_sizer,
+            )
+            page_repos, after = _parse_starred_repos(
+                data["user"]["starredRepositories"], remaining
+            )
+            repos = repos + page_repos
+
+        return login, repos
+
+    def fetch_stargazers_with_starred_repos(self, owner, repo, limit_pages=2):
+        """Fetch the repository's stargazers and their starred repositories.
+
+        Stargazers and users' starred repositories are crawled following their
+        cursors, up to `limit_pages` pages of 100 (same amount of data as the
+        Rest API algorithm).
+
+        :param owner: Github repository's owner name
+        :param repo: GitHub repository's name
+        :param limit_pages: Limit the number of page used to fetch data.
+        :returns: dict {"user": ["repos"]}
+        """
+        max_items = limit_pages * GRAPHQL_MAX_FIRST
+        results = {}
+        for page in self._iter_stargazers_pages(owner, repo, max_items, max_items):
+            for login, repos, after in page:
+                _, results[login] = self._fetch_starred_repos_continuation(
+                    login, repos, after, max_items
+                )
+
+        return results
+
+    def fetch_users_starred_repos(self, logins, limit_pages=2):
+        """Fetch several users' starred repositories, batching users in each
+        query (one aliased `user` block per user).
+
+        The number of users per query is adapted to the node budget (see
+        `GraphQLPageSizer`). Users starring more repositories than a page are
+        queued again with their cursor, up to `limit_pages` pages of 100.
+
+        :param logins: GitHub users' logins
+        :param limit_pages: Limit the number of page used to fetch data.
+        :returns: dict {"user": ["repos"]}
+        """
+        max_items = limit_pages * GRAPHQL_MAX_FIRST
+        pending = [(login, [], None) for login in logins]
+        results = {}
+        while pending:
+            data = self._query(
+                self._users_starred_query(pending, max_items),
+                self._users_sizer,
+                missing_ok=True,
+            )
+            fetched, pending = self._parse_users_batch(data, pending, max_items)
+            for login, repos, after in fetched:
+                if after is None:
+                    results[login] = repos
+                else:
+                    pending.append((login, repos, after))
+
+        return results
+
+    # -------------------------------------------------------------------------
+    # Asynchronize implementation
+    async def _aiter_stargazers_pages(
+        self, client, owner, repo, max_stargazers, max_starred
+    ):
+        """Async implementation of `_iter_stargazers_pages`"""
+        after, count = None, 0
+        while count < max_stargazers:
+            data = await self._aquery(
+                client,
+                self._stargazers_query(
+                    owner, repo, after, max_stargazers - count, max_starred
+                ),
+                self._stargazers_sizer,
+            )
+            page, after = self._parse_stargazers_page(data, max_starred)
+            count += len(page)
+            yield page
+
+            if after is None:
+                return
+
+    async def _afetch_starred_repos_continuation(
+        self, client, login, repos, after, max_starred
+    ):
+        """Async implementation of `_fetch_starred_repos_continuation`"""
+        while after is not None:
+            remaining = max_starred - len(repos)
+            data = await self._aquery(
+                client,
+                self._starred_query(login, after, remaining),
+                self._starred_sizer,
+            )
+            page_repos, after = _parse_starred_repos(
+                data["user"]["starredRepositories"], remaining
+            )
+            repos = repos + page_repos
+
+        return login, repos
+
+    async def aiter_stargazers_with_starred_repos(
+        self, owner, repo, limit_pages=2, max_concurrency=8
+    ):
+        """Async iterate over the repository's stargazers and their starred
+        repositories, as soon as each user's ones are complete.
+
+        The stargazers cursor is followed page after page, while the cursors
+        of users starring more repositories than the first page are followed
+        concurrently, by up to `max_concurrency` tasks.
+
+        :param owner: Github repository's owner name
+        :param repo: GitHub repository's name
+        :param limit_pages: Limit the number of page used to fetch data.
+        :param max_concurrency: Maximum number of cursors followed concurrently.
+        :returns: Async generator of (login, ["repos"])
+        """
+        max_items = limit_pages * GRAPHQL_MAX_FIRST
+        semaphore = asyncio.Semaphore(max_concurrency)
+
+        async with self._aclient() as client:
+
+            async def continuation(login, repos, after):
+                async with semaphore:
+                    return await self._afetch_starred_repos_continuation(
+                        client, login, repos, after, max_items
+                    )
+
+            tasks = set()
+            try:
+                async for page in self._aiter_stargazers_pages(
+                    client, owner, repo, max_items, max_items
+                ):
+                    for login, repos, after in page:
+                        if after is None:
+                            yield login, repos
+                        else:
+                            tasks.add(
+                                asyncio.ensure_future(continuation(login, repos, after))
+                            )
+
+                    # Yield the continuations completed meanwhile
+                    for task in [task for task in tasks if task.done()]:
+                        tasks.discard(task)
+                        yield task.result()
+
+                for task in asyncio.as_completed(tasks):
+                    yield await task
+            finally:
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def afetch_stargazers_with_starred_repos(
+        self, owner, repo, limit_pages=2, max_concurrency=8
+    ):
+        """Async implementation of `fetch_stargazers_with_starred_repos`"""
+        results = {}
+        async for login, repos in self.aiter_stargazers_with_starred_repos(
+            owner, repo, limit_pages=limit_pages, max_concurrency=max_concurrency
+        ):
+            results[login] = repos
+
+        return results
+
+    async def _afetch_users_batch(self, client, users, max_starred, semaphore):
+        """Async fetch a batch of users' starred repositories page.
+        See `_parse_users_batch`.
+        """
+        async with semaphore:
+            data = await self._aquery(
+                client,
+                self._users_starred_query(users, max_starred),
+                self._users_sizer,
+                missing_ok=True,
+            )
+
+        return self._parse_users_batch(data, users, max_starred)
+
+    async def aiter_users_starred_repos(self, logins, limit_pages=2, max_concurrency=4):
+        """Async iterate over several users' starred repositories, fetched by
+        batches of users (see `fetch_users_starred_repos`).
+
+        Batches are fetched concurrently, by rounds: users with more starred
+        repositories are batched again in the next round, with their cursor.
+
+        :param logins: GitHub users' logins
+        :param limit_pages: Limit the number of page used to fetch data.
+        :param max_concurrency: Maximum number of concurrent batch queries.
+        :returns: Async generator of (login, ["repos"]), in completion order
+        """
+        max_items = limit_pages * GRAPHQL_MAX_FIRST
+        semaphore = asyncio.Semaphore(max_concurrency)
+        pending = [(login, [], None) for login in logins]
+
+        async with self._aclient() as client:
+            while pending:
+                batch_size, _ = self._users_sizer.sizes()
+                tasks = [
+                    asyncio.ensure_future(
+                        self._afetch_users_batch(
+                            client, pending[i : i + batch_size], max_items, semaphore
+                        )
+                    )
+                    for i in range(0, len(pending), batch_size)
+                ]
+                pending = []
+                try:
+                    for task in asyncio.as_completed(tasks):
+                        fetched, left_out = await task
+                        pending += left_out
+                        for login, repos, after in fetched:
+                            if after is None:
+                                yield login, repos
+                            else:
+                                pending.append((login, repos, after))
+                finally:
+                    for task in tasks:
+                        task.cancel()
+                    await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def afetch_users_starred_repos(
+        self, logins, limit_pages=2, max_concurrency=4
+    ):
+        """Async implementation of `fetch_users_starred_repos`"""
+        results = {}
+        async for login, repos in self.aiter_users_starred_repos(
+            logins, limit_pages=limit_pages, max_concurrency=max_concurrency
+        ):
+            results[login] = repos
+
+        return results
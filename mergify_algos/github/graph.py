@@ -0,0 +1,406 @@
+import math
+import sqlite3
+import threading
+import time
+
+from mergify_algos.github.aggregation import Ranking
+
+# Number of items per fetched page: stored lists are truncated to the
+# requested number of pages.
+PAGE_SIZE = 100
+
+
+class StarGraphStore:
+    """Local, persistent (SQLite) bipartite graph of users and repositories.
+
+    Records, with their fetch time:
+    - users' starred repositories (user -> repository edges),
+    - repositories' stargazers lists, in GitHub order (starring order), with
+    their `starred_at` when known.
+
+    Neighbour algorithms read users from the store first and only fetch the
+    missing or stale ones. Once a repository's stargazers and all of them are
+    fresh, its neighbours are computed with an indexed join (`neighbours`).
+
+    Thread-safe: the sync algorithm runs in a thread pool.
+    """
+
+    def __init__(self, path: str = ":memory:", ttl: float = 24 * 3600.0):
+        """
+        :param path: SQLite database file path (Default: in memory)
+        :param ttl: Seconds a fetched list is considered fresh.
+        """
+        self.ttl = ttl
+
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.executescript(
+            "CREATE TABLE IF NOT EXISTS users ("
+            " id INTEGER PRIMARY KEY,"
+            " login TEXT NOT NULL UNIQUE,"
+            " starred_pages INTEGER,"
+            " starred_fetched_at REAL);"
+            "CREATE TABLE IF NOT EXISTS repos ("
+            " id INTEGER PRIMARY KEY,"
+            " name TEXT NOT NULL UNIQUE,"
+            " stargazers_pages INTEGER,"
+            " stargazers_fetched_at REAL);"
+            # user -> starred repository, `position` in the user's list
+            "CREATE TABLE IF NOT EXISTS stars ("
+            " user_id INTEGER NOT NULL,"
+            " repo_id INTEGER NOT NULL,"
+            " position INTEGER NOT NULL,"
+            " PRIMARY KEY (user_id, repo_id)) WITHOUT ROWID;"
+            # repository -> stargazer, `position` in the repository's list
+            "CREATE TABLE IF NOT EXISTS stargazers ("
+            " repo_id INTEGER NOT NULL,"
+            " user_id INTEGER NOT NULL,"
+            " position INTEGER NOT NULL,"
+            " starred_at TEXT,"
+            " PRIMARY KEY (repo_id, user_id)) WITHOUT ROWID;"
+        )
+        self._connection.commit()
+
+    def _fresh_after(self, ttl=None):
+        return time.time() - (ttl if ttl is not None else self.ttl)
+
+    def _user_id(self, login):
+        self._connection.execute(
+            "INSERT OR IGNORE INTO users (login) VALUES (?)", (login,)
+        )
+        return self._connection.execute(
+            "SELECT id FROM users WHERE login = ?", (login,)
+        ).fetchone()[0]
+
+    def _repo_id(self, name):
+        self._connection.execute(
+            "INSERT OR IGNORE INTO repos (name) VALUES (?)", (name,)
+        )
+        return self._connection.execute(
+            "SELECT id FROM repos WHERE name = ?", (name,)
+        ).fetchone()[0]
+
+    # -------------------------------------------------------------------------
+    # Users' starred repositories
+    def get_starred_repos(self, login: str, pages: int = 2):
+        """Return the user's starred repositories if fetched (with at least
+        `pages` pages) and fresh, None otherwise.
+        """
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT id FROM users WHERE login = ?"
+                " AND starred_pages >= ? AND starred_fetched_at > ?",
+                (login, pages, self._fresh_after()),
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            rows = self._connection.execute(
+                "SELECT repos.name FROM stars JOIN repos ON repos.id = stars.repo_id"
+                " WHERE stars.user_id = ? AND stars.position < ?"
+                " ORDER BY stars.position",
+                (row[0], pages * PAGE_SIZE),
+            ).fetchall()
+
+        return [name for (name,) in rows]
+
+    def put_starred_repos(self, login: str, repos: list, pages: int = 2):
+        """Record the user's starred repositories, fetched with `pages` pages"""
+        self.put_many_starred_repos([(login, repos)], pages)
+
+    def put_many_starred_repos(self, users: list, pages: int = 2):
+        """Record several users' starred repositories in one transaction.
+
+        :param users: [(login, starred repositories)], fetched with `pages`
+        pages.
+        """
+        now = time.time()
+        with self._lock:
+            for login, repos in users:
+                user_id = self._user_id(login)
+                self._connection.executemany(
+                    "INSERT OR IGNORE INTO repos (name) VALUES (?)",
+                    [(name,) for name in repos],
+                )
+                self._connection.execute(
+                    "DELETE FROM stars WHERE user_id = ?", (user_id,)
+                )
+                self._connection.executemany(
+                    "INSERT OR IGNORE INTO stars"
+                    " SELECT ?, id, ? FROM repos WHERE name = ?",
+                    [(user_id, position, name) for position, name in enumerate(repos)],
+                )
+                self._connection.execute(
+                    "UPDATE users SET starred_pages = ?, starred_fetched_at = ?"
+                    " WHERE id = ?",
+                    (pages, now, user_id),
+                )
+            self._connection.commit()
+
+    # -------------------------------------------------------------------------
+    # Repositories' stargazers
+    def put_stargazers(
+        self, repo: str, logins: list, pages: int = 2, starred_at: list = None
+    ):
+        """Record the repository's stargazers, fetched with `pages` pages.
+
+        :param repo: Repository's full name ("owner/repo")
+        :param logins: Stargazers' logins, in GitHub order.
+        :param pages: Number of first pages fetched. None when the stargazers
+        aren't the first ones (e.g. the newest ones only).
+        :param starred_at: [optional] Stargazers' `starred_at`, same order.
+        """
+        with self._lock:
+            repo_id = self._repo_id(repo)
+            self._connection.execute(
+                "DELETE FROM stargazers WHERE repo_id = ?", (repo_id,)
+            )
+            self._insert_stargazers(repo_id, 0, logins, starred_at)
+            self._connection.execute(
+                "UPDATE repos SET stargazers_pages = ?, stargazers_fetched_at = ?"
+                " WHERE id = ?",
+                (pages, time.time(), repo_id),
+            )
+            self._connection.commit()
+
+    def add_stargazers(self, repo: str, logins: list, starred_at: list = None):
+        """Append new stargazers to the repository's recorded ones.
+
+        When the recorded stargazers are the first pages, the number of pages
+        grows with them.
+        """
+        with self._lock:
+            repo_id = self._repo_id(repo)
+            (count,) = self._connection.execute(
+                "SELECT COUNT(*) FROM stargazers WHERE repo_id = ?", (repo_id,)
+            ).fetchone()
+            (start,) = self._connection.execute(
+                "SELECT COALESCE(MAX(position) + 1, 0) FROM stargazers"
+                " WHERE repo_id = ?",
+                (repo_id,),
+            ).fetchone()
+            count += self._insert_stargazers(repo_id, start, logins, starred_at)
+            self._connection.execute(
+                "UPDATE repos SET stargazers_fetched_at = ?,"
+                " stargazers_pages = MAX(stargazers_pages, ?) WHERE id = ?",
+                (time.time(), math.ceil(count / PAGE_SIZE), repo_id),
+            )
+            self._connection.commit()
+
+    def _insert_stargazers(self, repo_id, start, logins, starred_at=None):
+        """Insert stargazers from `start` position, return the number inserted"""
+        starred_at = starred_at if starred_at is not None else [None] * len(logins)
+        self._connection.executemany(
+            "INSERT OR IGNORE INTO users (login) VALUES (?)",
+            [(login,) for login in logins],
+        )
+        cursor = self._connection.executemany(
+            "INSERT OR IGNORE INTO stargazers"
+            " SELECT ?, id, ?, ? FROM users WHERE login = ?",
+            [
+                (repo_id, start + i, _starred_at, login)
+                for i, (login, _starred_at) in enumerate(zip(logins, starred_at))
+            ],
+        )
+        return cursor.rowcount
+
+    def latest_starred_at(self, repo: str):
+        """Return the newest recorded stargazer's `starred_at`, None if unknown"""
+        with self._lock:
+            (starred_at,) = self._connection.execute(
+                "SELECT MAX(stargazers.starred_at) FROM stargazers"
+                " JOIN repos ON repos.id = stargazers.repo_id WHERE repos.name = ?",
+                (repo,),
+            ).fetchone()
+
+        return starred_at
+
+    def stargazers_info(self, repo: str):
+        """Return (count, pages) of the repository's recorded stargazers, pages
+        being None when they aren't the first ones.
+        """
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT COUNT(stargazers.user_id), repos.stargazers_pages FROM repos"
+                " LEFT JOIN stargazers ON stargazers.repo_id = repos.id"
+                " WHERE repos.name = ? GROUP BY repos.id",
+                (repo,),
+            ).fetchone()
+
+        return row if row is not None else (0, None)
+
+    def missing_starred_repos(self, repo: str, starred_pages: int = 2):
+        """Return the recorded stargazers whose starred repositories were never
+        recorded (with at least `starred_pages` pages), whatever their age.
+        """
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT users.login FROM stargazers"
+                " JOIN repos ON repos.id = stargazers.repo_id"
+                " JOIN users ON users.id = stargazers.user_id"
+                " WHERE repos.name = ? AND (users.starred_fetched_at IS NULL"
+                " OR users.starred_pages < ?) ORDER BY stargazers.position",
+                (repo, starred_pages),
+            ).fetchall()
+
+        return [login for (login,) in rows]
+
+    def _fresh_repo_id(self, repo, pages, starred_pages, ttl=None):
+        """Return the repository id when its stargazers and all of their
+        starred repositories are fresh, None otherwise.
+        """
+        fresh_after = self._fresh_after(ttl)
+        row = self._connection.execute(
+            "SELECT id FROM repos WHERE name = ?"
+            " AND (? IS NULL OR stargazers_pages >= ?) AND stargazers_fetched_at > ?",
+            (repo, pages, pages, fresh_after),
+        ).fetchone()
+        if row is None:
+            return None
+
+        (stale,) = self._connection.execute(
+            "SELECT COUNT(*) FROM stargazers JOIN users ON users.id = stargazers.user_id"
+            " WHERE stargazers.repo_id = ? AND stargazers.position < ?"
+            " AND (users.starred_fetched_at IS NULL OR users.starred_fetched_at <= ?"
+            " OR users.starred_pages < ?)",
+            (row[0], _max_position(pages), fresh_after, starred_pages),
+        ).fetchone()
+        return row[0] if not stale else None
+
+    # -------------------------------------------------------------------------
+    # Neighbours
+    def _neighbour_counts(self, repo_id, pages, starred_pages, threshold, ranking):
+        """Return [(repo_id, name, count)] ordered by count then name"""
+        size = ranking.size
+        if size is None:
+            limit, offset = -1, ranking.offset
+        else:
+            limit, offset = max(size - ranking.offset, 0), ranking.offset
+
+        return self._connection.execute(
+            "SELECT repos.id, repos.name, counts.count FROM ("
+            "  SELECT stars.repo_id, COUNT(*) AS count FROM stargazers"
+            "  JOIN stars ON stars.user_id = stargazers.user_id"
+            "  WHERE stargazers.repo_id = :repo_id"
+            "  AND stargazers.position < :max_stargazers"
+            "  AND stars.position < :max_starred AND stars.repo_id != :repo_id"
+            "  GROUP BY stars.repo_id HAVING count >= :threshold"
+            ") AS counts JOIN repos ON repos.id = counts.repo_id"
+            " ORDER BY counts.count DESC, repos.name LIMIT :limit OFFSET :offset",
+            {
+                "repo_id": repo_id,
+                "max_stargazers": _max_position(pages),
+                "max_starred": starred_pages * PAGE_SIZE,
+                "threshold": threshold,
+                "limit": limit,
+                "offset": offset,
+            },
+        ).fetchall()
+
+    def _neighbour_stargazers(self, repo_id, neighbour_id, pages, starred_pages, limit):
+        rows = self._connection.execute(
+            "SELECT users.login FROM stargazers"
+            " JOIN stars ON stars.user_id = stargazers.user_id"
+            " JOIN users ON users.id = stargazers.user_id"
+            " WHERE stargazers.repo_id = ? AND stargazers.position < ?"
+            " AND stars.repo_id = ? AND stars.position < ?"
+            " ORDER BY stargazers.position LIMIT ?",
+            (
+                repo_id,
+                _max_position(pages),
+                neighbour_id,
+                starred_pages * PAGE_SIZE,
+                limit,
+            ),
+        ).fetchall()
+        return [login for (login,) in rows]
+
+    def neighbours(
+        self,
+        repo: str,
+        pages: int = 2,
+        starred_pages: int = 2,
+        users_threshold: int = 2,
+        ranking: Ranking = None,
+        ttl: float = None,
+    ):
+        """Compute the repository's neighbours from the store only.
+
+        Same output as `CoStarCounter.compute`, stargazers being listed in the
+        repository's stargazers order.
+
+        :param repo: Repository's full name ("owner/repo")
+        :param pages: Number of stargazers' pages to consider. None for all
+        the recorded stargazers.
+        :param starred_pages: Number of starred repositories' pages per user.
+        :param users_threshold: Minimum number of in-common users.
+        :param ranking: [optional] `Ranking` options.
+        :param ttl: [optional] Override the store's `ttl` (e.g. `math.inf` to
+        use any recorded data).
+        :returns: (results, sorted_results), None when the repository's
+        stargazers or any of their starred repositories aren't fresh.
+        """
+        ranking = ranking if ranking is not None else Ranking()
+        with self._lock:
+            repo_id = self._fresh_repo_id(repo, pages, starred_pages, ttl)
+            if repo_id is None:
+                return None
+
+            counts = self._neighbour_counts(
+                repo_id, pages, starred_pages, users_threshold, ranking
+            )
+            results = []
+            for neighbour_id, name, count in counts:
+                result = {"repo": name, "stargazers_count": count}
+                if ranking.include_stargazers != "none":
+                    limit = count
+                    if ranking.include_stargazers == "sample":
+                        limit = ranking.stargazers_sample
+                    result["stargazers"] = self._neighbour_stargazers(
+                        repo_id, neighbour_id, pages, starred_pages, limit
+                    )
+                results.append(result)
+
+        return results, results
+
+    def stats(self):
+        with self._lock:
+            (users,) = self._connection.execute(
+                "SELECT COUNT(*) FROM users WHERE starred_fetched_at IS NOT NULL"
+            ).fetchone()
+            (edges,) = self._connection.execute("SELECT COUNT(*) FROM stars").fetchone()
+
+        lookups = self.hits + self.misses
+        return {
+            "users": users,
+            "edges": edges,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+    def close(self):
+        self._connection.close()
+
+
+def _max_position(pages):
+    """Stargazers' positions limit of the first `pages` pages (None: all)"""
+    return pages * PAGE_SIZE if pages is not None else math.inf
+
+
+def build_star_graph_store_from_settings(settings):
+    """Build the `StarGraphStore` from the App `Settings`.
+
+    Returns None when the store is disabled (`github_graph_path` not set).
+    """
+    if not settings.github_graph_path:
+        return None
+
+    return StarGraphStore(
+        path=settings.github_graph_path, ttl=settings.github_graph_ttl
+    )
@@ -1,6 +1,32 @@
 import asyncio
+import collections
+import contextlib
+import httpx
+import math
+import random
+import time
 
-from mergify_algos.github.clients import GitHubRestClient, GitHubGraphQLClient
+from fastapi import HTTPException
+
+from mergify_algos import metrics
+from mergify_algos.github import sampling
+from mergify_algos.github.aggregation import CoStarCounter, Ranking
+from mergify_algos.github.cache import HTTPResponseCache, SingleFlightTTLCache
+from mergify_algos.github.clients import (
+    GITHUB_API_URL,
+    GRAPHQL_MAX_USERS_BATCH,
+    GitHubRestClient,
+    GitHubGraphQLClient,
+    build_async_http_client,
+)
+from mergify_algos.github.graph import PAGE_SIZE, StarGraphStore
+from mergify_algos.github.scheduler import (
+    BudgetExhausted,
+    ComputationBudget,
+    RateLimitExceeded,
+    RequestScheduler,
+    computation_budget,
+)
 
 
 # -----------------------------------------------------------------------------
@@ -8,6 +34,8 @@ from mergify_algos.github.clients import GitHubRestClient, GitHubGraphQLClient
 def _transform_user_starred_repositories(dict, exclude_repos=None):
     """Swap keys and items.
     Turn the dict {"user": ["repos"]} to dict {"repo": ["users"]}
+
+    Reference implementation, algorithms use the compact `CoStarCounter`.
     """
     results = {}
 
@@ -15,7 +43,7 @@ def _transform_user_starred_repositories(dict, exclude_repos=None):
         exclude_repos = []
 
     # blong: Here can we use pandas or numpy to speed-up CPU process
-    # Do we want to add the dependency
+    # Do we want to add the dependency -> Done, see `CoStarCounter`
     for user in dict:
         for repo in dict[user]:
             if repo in exclude_repos:
@@ -42,15 +70,537 @@ def _compute_and_order_neighbours(repo_user_map, users_threshold=2):
             {"repo": r, "stargazers_count": len(users), "stargazers": list(users)}
         )
 
-    # Sort
-    sorted_results = sorted(results, key=lambda x: x["stargazers_count"], reverse=True)
+    # Sort by count, then by name: stargazers are fetched concurrently, so the
+    # insertion order isn't deterministic
+    sorted_results = sorted(results, key=lambda x: (-x["stargazers_count"], x["repo"]))
     return results, sorted_results
 
 
+# -----------------------------------------------------------------------------
+# Async pipeline shared utils
+_PIPELINE_DONE = object()
+# Backends fetching the stargazers' starred repositories
+# - "rest": one Rest API request chain per stargazer.
+# - "graphql": batches of stargazers per GraphQL query (aliased users).
+NEIGHBOURS_BACKENDS = ("rest", "graphql")
+# Pages of starred repositories fetched per stargazer by the async algorithms
+STARRED_PAGES = 2
+# Co-stars edges above which the aggregation is sharded across processes
+SHARDING_MIN_EDGES = 1_000_000
+# Fetched users' starred repositories recorded per graph store transaction
+GRAPH_STORE_BATCH_SIZE = 100
+
+
+class StarredReposPipeline:
+    """Producer/Consumer pipeline fetching stargazers' starred repositories.
+
+    - One producer fetches the repository's stargazers page by page and queues
+    each login as soon as its page is received.
+    - `max_concurrency` workers consume the queue and fetch the user's starred
+    repositories.
+    - Results are yielded as they complete (completion order).
+    - When the GitHub rate limit budget is exhausted, the pipeline stops and
+    `rate_limited` is set: results already fetched are kept.
+    - With a `graph_store`, fresh users are read from it instead of being
+    fetched, and fetched users are recorded in it by batches. Store calls run
+    out of the event loop.
+    - With a `ComputationBudget`, users' first starred page only is fetched
+    (one request per user: more users covered), the pipeline stops once the
+    requests are spent and in-flight fetches are cancelled at the deadline:
+    `budget_exhausted` is set, results already fetched are kept.
+
+    Usage::
+
+        pipeline = StarredReposPipeline(gh_client, owner, repo)
+        async for stargazer, starred_repos in pipeline:
+            ...
+    """
+
+    def __init__(
+        self,
+        gh_client: GitHubRestClient,
+        owner: str,
+        repo: str,
+        limit_pages: int = 2,
+        max_concurrency: int = 50,
+        stargazers_pages: list = None,
+        graph_store: StarGraphStore = None,
+        logins: list = None,
+        budget: ComputationBudget = None,
+    ):
+        """
+        :param gh_client: GitHub Rest client
+        :param owner: GitHub repo's owner.
+        :param repo: GitHub repo's name.
+        :param limit_pages: Limit the number of page the algo use to fetch data.
+        :param max_concurrency: Number of workers fetching starred repositories.
+        :param stargazers_pages: [optional] Stargazers' page numbers to fetch,
+        instead of the `limit_pages` first ones (e.g. a random sample).
+        :param graph_store: [optional] Local `StarGraphStore`, read first.
+        :param logins: [optional] Stargazers to process, instead of fetching
+        the repository's ones (e.g. the new ones only).
+        :param budget: [optional] `ComputationBudget` bounding the fetches.
+        """
+        self.gh_client = gh_client
+        self.owner = owner
+        self.repo = repo
+        self.limit_pages = limit_pages
+        self.max_concurrency = max_concurrency
+        self.stargazers_pages = stargazers_pages
+        self.graph_store = graph_store
+        self.logins = logins
+        self.budget = budget
+        self.starred_pages = STARRED_PAGES if budget is None else 1
+
+        # Fetched stargazers, in GitHub order when not sampled
+        self.stargazers = []
+        # Progress information
+        self.stargazers_total = 0
+        self.stargazers_done = 0
+        self.stargazers_complete = False
+        self.rate_limited = False
+        self.budget_exhausted = False
+
+        self._stargazers_queue = asyncio.Queue()
+        self._results_queue = asyncio.Queue()
+        # Set while the pipeline cancels its own tasks
+        self._closing = False
+        # Fetched (stargazer, starred repos) not recorded in the graph store yet
+        self._unrecorded = []
+
+    def progress(self):
+        progress = {
+            "stargazers_done": self.stargazers_done,
+            "stargazers_total": self.stargazers_total,
+            "stargazers_complete": self.stargazers_complete,
+            "rate_limited": self.rate_limited,
+        }
+        if self.budget is not None:
+            progress["requests"] = self.budget.requests
+            progress["budget_exhausted"] = self.budget_exhausted
+        return progress
+
+    async def _aiter_logins(self):
+        yield self.logins
+
+    def _aiter_stargazers(self):
+        if self.logins is not None:
+            return self._aiter_logins()
+
+        if self.stargazers_pages is not None:
+            return self.gh_client.aiter_stargazers_pages(
+                owner=self.owner, repo=self.repo, pages=self.stargazers_pages
+            )
+
+        return self.gh_client.aiter_stargazers(
+            owner=self.owner, repo=self.repo, limit_pages=self.limit_pages
+        )
+
+    async def _produce(self):
+        try:
+            with metrics.phase_timer("stargazers"):
+                async for stargazers in self._aiter_stargazers():
+                    self.stargazers_total += len(stargazers)
+                    self.stargazers += stargazers
+                    for stargazer in stargazers:
+                        self._stargazers_queue.put_nowait(stargazer)
+            self.stargazers_complete = True
+        finally:
+            # One sentinel per worker, so all of them stop
+            for _ in range(self.max_concurrency):
+                self._stargazers_queue.put_nowait(None)
+
+    async def _stored_starred_repos(self, stargazers):
+        """Return the stargazers' stored starred repositories (None if not)"""
+        if self.graph_store is None:
+            return [None] * len(stargazers)
+
+        return await asyncio.to_thread(
+            lambda: [
+                self.graph_store.get_starred_repos(stargazer, self.starred_pages)
+                for stargazer in stargazers
+            ]
+        )
+
+    async def _record_starred_repos(self, batch_size=1):
+        """Record the fetched users in the graph store, by `batch_size` ones"""
+        if len(self._unrecorded) < batch_size:
+            return
+
+        users, self._unrecorded = self._unrecorded, []
+        await asyncio.to_thread(
+            self.graph_store.put_many_starred_repos, users, self.starred_pages
+        )
+
+    async def _put_result(self, stargazer, starred_repos, fetched=True):
+        self._results_queue.put_nowait((stargazer, starred_repos))
+        if fetched and self.graph_store is not None:
+            self._unrecorded.append((stargazer, starred_repos))
+            await self._record_starred_repos(GRAPH_STORE_BATCH_SIZE)
+
+    async def _consume(self):
+        while (stargazer := await self._stargazers_queue.get()) is not None:
+            (starred_repos,) = await self._stored_starred_repos([stargazer])
+            if starred_repos is not None:
+                await self._put_result(stargazer, starred_repos, fetched=False)
+                continue
+
+            starred_repos = await self.gh_client.afetch_user_starred_repos(
+                stargazer, limit_pages=self.starred_pages
+            )
+            await self._put_result(stargazer, starred_repos)
+
+    async def _run(self, coroutine):
+        # Forward the task outcome (done or exception) to the results queue
+        try:
+            await coroutine
+        except RateLimitExceeded:
+            self.rate_limited = True
+            self._results_queue.put_nowait(_PIPELINE_DONE)
+        except BudgetExhausted:
+            self.budget_exhausted = True
+            self._results_queue.put_nowait(_PIPELINE_DONE)
+        except asyncio.CancelledError:
+            if self._closing:
+                raise
+            # Cancelled by someone else (e.g. a shared fetch): fail, don't hang
+            self._results_queue.put_nowait(
+                RuntimeError("Starred repositories fetch was cancelled")
+            )
+        except Exception as exc:
+            self._results_queue.put_nowait(exc)
+        else:
+            self._results_queue.put_nowait(_PIPELINE_DONE)
+
+    async def _record_stargazers(self):
+        # Only complete, unsampled stargazers lists can answer `neighbours`
+        if (
+            self.graph_store is None
+            or self.stargazers_pages is not None
+            or self.logins is not None
+            or not self.stargazers_complete
+            or self.rate_limited
+            or self.budget is not None
+        ):
+            return
+
+        await asyncio.to_thread(
+            self.graph_store.put_stargazers,
+            f"{self.owner}/{self.repo}",
+            self.stargazers,
+            self.limit_pages,
+        )
+
+    async def _next_result(self):
+        """Return the next results queue item, None at the budget's deadline"""
+        timeout = self.budget.remaining() if self.budget is not None else None
+        try:
+            return await asyncio.wait_for(self._results_queue.get(), timeout)
+        except asyncio.TimeoutError:
+            self.budget_exhausted = True
+            return None
+
+    async def __aiter__(self):
+        # Tasks' requests consume the budget (tasks copy the current context)
+        with computation_budget(self.budget):
+            tasks = [asyncio.ensure_future(self._run(self._produce()))]
+            tasks += [
+                asyncio.ensure_future(self._run(self._consume()))
+                for _ in range(self.max_concurrency)
+            ]
+
+        try:
+            running = len(tasks)
+            while running:
+                item = await self._next_result()
+                if item is None:
+                    # Deadline: in-flight fetches are cancelled below
+                    break
+                elif item is _PIPELINE_DONE:
+                    running -= 1
+                elif isinstance(item, Exception):
+                    raise item
+                else:
+                    self.stargazers_done += 1
+                    yield item
+            await self._record_stargazers()
+        finally:
+            self._closing = True
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            # Users fetched before an error or the deadline are recorded too
+            if self._unrecorded:
+                await self._record_starred_repos()
+
+
+class BatchedStarredReposPipeline(StarredReposPipeline):
+    """`StarredReposPipeline` fetching stargazers' starred repositories by
+    batches, with GitHub GraphQL API (see `GitHubGraphQLClient`).
+
+    Each worker takes up to `batch_size` queued stargazers at once and fetches
+    them in a single query: hundreds of Rest requests become a few queries.
+    """
+
+    def __init__(
+        self,
+        gh_client: GitHubRestClient,
+        graphql_client: GitHubGraphQLClient,
+        owner: str,
+        repo: str,
+        limit_pages: int = 2,
+        max_concurrency: int = 50,
+        stargazers_pages: list = None,
+        graph_store: StarGraphStore = None,
+        logins: list = None,
+        budget: ComputationBudget = None,
+        batch_size: int = GRAPHQL_MAX_USERS_BATCH,
+    ):
+        """
+        :param graphql_client: GitHub GraphQL client, fetching the batches.
+        :param batch_size: Maximum number of stargazers per batch.
+
+        See `StarredReposPipeline` for the other parameters.
+        """
+        super().__init__(
+            gh_client,
+            owner,
+            repo,
+            limit_pages,
+            max_concurrency,
+            stargazers_pages,
+            graph_store,
+            logins,
+            budget,
+        )
+        self.graphql_client = graphql_client
+        self.batch_size = batch_size
+
+    async def _next_batch(self):
+        """Return the next queued stargazers, None once the queue is done"""
+        stargazers = [await self._stargazers_queue.get()]
+        # Each worker must get its own sentinel: stop at the first one
+        while (
+            stargazers[-1] is not None
+            and len(stargazers) < self.batch_size
+            and not self._stargazers_queue.empty()
+        ):
+            stargazers.append(self._stargazers_queue.get_nowait())
+
+        if stargazers[-1] is None:
+            stargazers.pop()
+            if stargazers:
+                # Process the batch first, the sentinel stops the next call
+                self._stargazers_queue.put_nowait(None)
+
+        return stargazers or None
+
+    async def _consume(self):
+        while (stargazers := await self._next_batch()) is not None:
+            missing = []
+            stored = await self._stored_starred_repos(stargazers)
+            for stargazer, starred_repos in zip(stargazers, stored):
+                if starred_repos is None:
+                    missing.append(stargazer)
+                else:
+                    await self._put_result(stargazer, starred_repos, fetched=False)
+
+            async for (
+                stargazer,
+                starred_repos,
+            ) in self.graphql_client.aiter_users_starred_repos(
+                missing, limit_pages=self.starred_pages
+            ):
+                await self._put_result(stargazer, starred_repos)
+
+
+@contextlib.asynccontextmanager
+async def _ahttp_client(http_client=None):
+    """Yield the shared `http_client`, or a pooled client opened for the
+    duration of the computation.
+    """
+    if http_client is not None:
+        yield http_client
+        return
+
+    async with build_async_http_client() as _http_client:
+        yield _http_client
+
+
+async def _atimed(aiterable, phase):
+    """Iterate `aiterable`, recording the time spent waiting for its items as
+    the `phase` duration (see `metrics.PhaseTimer`).
+    """
+    timer = metrics.PhaseTimer(phase)
+    iterator = aiterable.__aiter__()
+    try:
+        while True:
+            with timer:
+                try:
+                    item = await iterator.__anext__()
+                except StopAsyncIteration:
+                    return
+            yield item
+    finally:
+        timer.record()
+        if hasattr(iterator, "aclose"):
+            await iterator.aclose()
+
+
+def _timed(iterable, phase):
+    """Sync implementation of `_atimed`"""
+    timer = metrics.PhaseTimer(phase)
+    iterator = iter(iterable)
+    try:
+        while True:
+            with timer:
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+    finally:
+        timer.record()
+
+
+def _compute(counter, threshold, ranking, executor=None, shards=None):
+    """Compute and sort the neighbours of a `counter`.
+
+    Large graphs (`SHARDING_MIN_EDGES`) are counted by shards of repositories
+    in the `executor` processes when provided (see
+    `CoStarCounter.compute_sharded`).
+    """
+    with metrics.phase_timer("sort"):
+        if executor is None or counter.edges_count < SHARDING_MIN_EDGES:
+            return counter.compute(users_threshold=threshold, ranking=ranking)
+
+        return counter.compute_sharded(
+            executor, shards or 1, users_threshold=threshold, ranking=ranking
+        )
+
+
+async def _acompute(counter, threshold, ranking, executor=None, shards=None):
+    """`_compute` in a thread: the event loop keeps serving other requests"""
+    return await asyncio.to_thread(
+        _compute, counter, threshold, ranking, executor, shards
+    )
+
+
+def _build_pipeline(
+    http_client,
+    token,
+    owner,
+    repo,
+    limit_pages=2,
+    max_concurrency=50,
+    backend="rest",
+    scheduler=None,
+    cache=None,
+    starred_cache=None,
+    stargazers_pages=None,
+    graph_store=None,
+    logins=None,
+    base_url=GITHUB_API_URL,
+    budget=None,
+):
+    """Build the `StarredReposPipeline` of the given backend"""
+    if backend not in NEIGHBOURS_BACKENDS:
+        raise ValueError(f"backend must be one of {NEIGHBOURS_BACKENDS}")
+
+    gh_client = GitHubRestClient(
+        token=token,
+        http_client=http_client,
+        scheduler=scheduler,
+        cache=cache,
+        starred_cache=starred_cache,
+        base_url=base_url,
+    )
+    if backend == "rest":
+        return StarredReposPipeline(
+            gh_client,
+            owner,
+            repo,
+            limit_pages,
+            max_concurrency=max_concurrency,
+            stargazers_pages=stargazers_pages,
+            graph_store=graph_store,
+            logins=logins,
+            budget=budget,
+        )
+
+    graphql_client = GitHubGraphQLClient(
+        token=token, http_client=http_client, scheduler=scheduler, base_url=base_url
+    )
+    return BatchedStarredReposPipeline(
+        gh_client,
+        graphql_client,
+        owner,
+        repo,
+        limit_pages,
+        max_concurrency=max_concurrency,
+        stargazers_pages=stargazers_pages,
+        graph_store=graph_store,
+        logins=logins,
+        budget=budget,
+    )
+
+
+def _build_budget(deadline_ms=None, max_requests=None):
+    """Return the `ComputationBudget`, None when unbounded"""
+    if deadline_ms is None and max_requests is None:
+        return None
+    return ComputationBudget(deadline_ms=deadline_ms, max_requests=max_requests)
+
+
+def _stored_neighbours(
+    graph_store, owner, repo, limit_pages, starred_pages, threshold, ranking
+):
+    """Neighbours computed from the `graph_store` only, None when unavailable"""
+    if graph_store is None:
+        return None
+
+    with metrics.phase_timer("graph_store"):
+        return graph_store.neighbours(
+            f"{owner}/{repo}",
+            pages=limit_pages,
+            starred_pages=starred_pages,
+            users_threshold=threshold,
+            ranking=ranking,
+        )
+
+
+async def _astored_neighbours(graph_store, *args):
+    """`_stored_neighbours`, out of the event loop: the store's join takes
+    seconds for large repositories.
+    """
+    if graph_store is None:
+        return None
+
+    return await asyncio.to_thread(_stored_neighbours, graph_store, *args)
+
+
 # -----------------------------------------------------------------------------
 # Algo using GitHub Rest API
 def find_neighbour_repos(
-    owner: str, repo: str, token: str, limit_pages: int = 2, threshold: int = 2
+    owner: str,
+    repo: str,
+    token: str,
+    limit_pages: int = 2,
+    threshold: int = 2,
+    scheduler: RequestScheduler = None,
+    cache: HTTPResponseCache = None,
+    starred_cache: SingleFlightTTLCache = None,
+    graph_store: StarGraphStore = None,
+    base_url: str = GITHUB_API_URL,
+    ranking: Ranking = None,
+    backend: str = "rest",
+    memory_budget: int = None,
+    spill_dir: str = None,
+    aggregation_executor=None,
+    aggregation_shards: int = None,
+    deadline_ms: float = None,
+    max_requests: int = None,
+    on_progress=None,
 ):
     """Find repositories that share stargazers with the given repository.
     Brut synchronize implementation...
@@ -61,7 +611,7 @@ def find_neighbour_repos(
     Because fetching information from GitHub API will eventually take lots of
     time, we have limit_pages parameters.
     TODO: Should we limit the number of stargazers?
-    2- Swap dictionary
+    2- Count in-common users of each repository (see `CoStarCounter`)
     3- Compute neighbours count and order results
 
     :param owner: GitHub repo's owner.
@@ -69,44 +619,188 @@ def find_neighbour_repos(
     :param token: GitHub access token.
     :param limit_pages: Limit the number of page the algo use to fetch data.
     :param threshold: Only return repository with more than 'n' common user
+    :param scheduler: [optional] Shared `RequestScheduler` handling rate limits
+    and retries.
+    :param cache: [optional] Shared `HTTPResponseCache` of GitHub responses.
+    :param starred_cache: [optional] Shared in-process cache of users' starred
+    repositories.
+    :param graph_store: [optional] Local `StarGraphStore`: fresh stargazers are
+    read from it, and the neighbours of a fully stored repository are computed
+    without any request.
+    :param base_url: GitHub API url (e.g. a local fake GitHub one).
+    :param ranking: [optional] `Ranking` options (top-K, page, stargazers
+    lists). Default: all neighbours, with their stargazers.
+    :param backend: Stargazers' starred repositories backend, "rest" or
+    "graphql" (batches of users per query). See `NEIGHBOURS_BACKENDS`.
+    :param memory_budget: [optional] Co-stars edges kept in memory, in bytes,
+    before spilling them to disk (see `CoStarCounter`).
+    :param spill_dir: [optional] Directory of the spilled edges.
+    :param aggregation_executor: [optional] `concurrent.futures.Executor`
+    counting large graphs by shards (see `CoStarCounter.compute_sharded`).
+    :param aggregation_shards: Number of shards, default: 1.
+    :param deadline_ms: [optional] Time allowed, in milliseconds: no request is
+    sent past it, neighbours are ranked from the users fetched so far.
+    :param max_requests: [optional] Maximum number of GitHub requests sent.
+    With a deadline or a requests budget, only users' first starred page is
+    fetched (see `StarredReposPipeline`).
+    :param on_progress: [optional] Callback called with keyword arguments
+    `stargazers_done`, `stargazers_total` and `stargazers_complete` (and the
+    budget's `requests` and `budget_exhausted`) once fetched.
     :returns neighbour_repos: Sorted List of repository neighbour of {owner}/{repo}
     """
-    # Init data structure used by neighbour algorithm and Github client
-    user_repo_map = {}
-    gh_client = GitHubRestClient(token=token)
+    if backend not in NEIGHBOURS_BACKENDS:
+        raise ValueError(f"backend must be one of {NEIGHBOURS_BACKENDS}")
 
-    # Fetch repository's stargazers
-    repo_stargazers = gh_client.fetch_stargazers(
-        owner=owner,
-        repo=repo,
-        limit_pages=limit_pages,
+    # Warm path: everything needed is already in the local graph
+    stored = _stored_neighbours(
+        graph_store, owner, repo, limit_pages, limit_pages, threshold, ranking
     )
+    if stored is not None:
+        return stored
 
-    # For each stargazer, fetch user's starred repositories
-    for stargazer in repo_stargazers:
-        # Sorting by desc `updated` attribute to have active repositories first
-        _stargazer_starred_repos = gh_client.fetch_user_starred_repos(
-            user=stargazer,
-            params={"sort": "updated", "direction": "desc"},
-            limit_pages=limit_pages,
+    # Init Github client
+    gh_client = GitHubRestClient(
+        token=token,
+        scheduler=scheduler,
+        cache=cache,
+        starred_cache=starred_cache,
+        base_url=base_url,
+    )
+    graphql_client = None
+    if backend == "graphql":
+        graphql_client = GitHubGraphQLClient(
+            token=token, scheduler=scheduler, base_url=base_url
         )
-        user_repo_map[stargazer] = _stargazer_starred_repos
 
-    # Revert the user_repo_map dictionary to be "repo" listing in-common "users"
-    repo_user_map = _transform_user_starred_repositories(
-        user_repo_map, exclude_repos=[f"{owner}/{repo}"]
-    )
+    budget = _build_budget(deadline_ms, max_requests)
+    progress = {"stargazers_done": 0, "stargazers_complete": True}
+    with computation_budget(budget), CoStarCounter(
+        exclude_repos=[f"{owner}/{repo}"],
+        memory_budget=memory_budget,
+        spill_dir=spill_dir,
+    ) as counter:
+        try:
+            # Fetch repository's stargazers
+            with metrics.phase_timer("stargazers"):
+                repo_stargazers = gh_client.fetch_stargazers(
+                    owner=owner,
+                    repo=repo,
+                    limit_pages=limit_pages,
+                )
+            progress["stargazers_total"] = len(repo_stargazers)
 
-    # Compute neighbours and sort result
-    results, sorted_results = _compute_and_order_neighbours(
-        repo_user_map, users_threshold=threshold
-    )
+            # Fold each stargazer's starred repositories in as soon as they are
+            # read or fetched: the raw lists are not kept.
+            starred_pages = limit_pages if budget is None else 1
+            _fold_users(
+                counter,
+                _iter_starred_repos(
+                    gh_client,
+                    graphql_client,
+                    repo_stargazers,
+                    starred_pages,
+                    graph_store,
+                ),
+                progress,
+            )
+        except BudgetExhausted:
+            progress.setdefault("stargazers_total", 0)
+            progress["stargazers_complete"] = False
 
-    return results, sorted_results
+        if graph_store is not None and budget is None:
+            graph_store.put_stargazers(f"{owner}/{repo}", repo_stargazers, limit_pages)
+        if on_progress is not None:
+            if budget is not None:
+                progress["requests"] = budget.requests
+                progress["budget_exhausted"] = not progress["stargazers_complete"]
+            on_progress(**progress)
+
+        # Compute neighbours and sort result
+        return _compute(
+            counter, threshold, ranking, aggregation_executor, aggregation_shards
+        )
+
+
+def _fold_users(counter, starred_repos, progress):
+    """Fold the (stargazer, starred repositories) items into the `counter`,
+    counting them in `progress["stargazers_done"]`.
+    """
+    transform = metrics.PhaseTimer("transform")
+    try:
+        for stargazer, starred_repos in _timed(starred_repos, "starred"):
+            with transform:
+                counter.add_user(stargazer, starred_repos)
+            progress["stargazers_done"] += 1
+    finally:
+        transform.record()
+
+
+def _iter_starred_repos(
+    gh_client, graphql_client, stargazers, limit_pages, graph_store
+):
+    """Yield (stargazer, starred repositories) for `find_neighbour_repos`.
+
+    Stored stargazers' starred repositories are read from the `graph_store`,
+    the other ones are fetched (and stored). With the Rest `gh_client`,
+    stargazers are yielded in order; with a `graphql_client`, the fetched ones
+    come after the stored ones, by batches. Duplicated stargazers (e.g. stars
+    shifting between pages during the crawl) are yielded once.
+    """
+    missing = []
+    for stargazer in dict.fromkeys(stargazers):
+        starred_repos = None
+        if graph_store is not None:
+            starred_repos = graph_store.get_starred_repos(stargazer, limit_pages)
+        if starred_repos is not None:
+            yield stargazer, starred_repos
+        elif graphql_client is not None:
+            missing.append(stargazer)
+        else:
+            # Sorting by desc `updated` attribute to have active repositories first
+            starred_repos = gh_client.fetch_user_starred_repos(
+                user=stargazer,
+                params={"sort": "updated", "direction": "desc"},
+                limit_pages=limit_pages,
+            )
+            if graph_store is not None:
+                graph_store.put_starred_repos(stargazer, starred_repos, limit_pages)
+            yield stargazer, starred_repos
+
+    if not missing:
+        return
+
+    # Fetch stargazers' starred repositories by batches
+    fetched = graphql_client.fetch_users_starred_repos(missing, limit_pages=limit_pages)
+    if graph_store is not None:
+        graph_store.put_many_starred_repos(
+            [(stargazer, fetched[stargazer]) for stargazer in missing], limit_pages
+        )
+    for stargazer in missing:
+        yield stargazer, fetched.pop(stargazer)
 
 
 async def afind_neighbour_repos(
-    owner: str, repo: str, token: str, limit_pages: int = 2, threshold: int = 2
+    owner: str,
+    repo: str,
+    token: str,
+    limit_pages: int = 2,
+    threshold: int = 2,
+    http_client: httpx.AsyncClient = None,
+    max_concurrency: int = 50,
+    scheduler: RequestScheduler = None,
+    cache: HTTPResponseCache = None,
+    starred_cache: SingleFlightTTLCache = None,
+    graph_store: StarGraphStore = None,
+    base_url: str = GITHUB_API_URL,
+    ranking: Ranking = None,
+    backend: str = "rest",
+    on_progress=None,
+    memory_budget: int = None,
+    spill_dir: str = None,
+    aggregation_executor=None,
+    aggregation_shards: int = None,
+    deadline_ms: float = None,
+    max_requests: int = None,
 ):
     """Aysnc implementation of `find_neighbour_repos`
 
@@ -115,86 +809,634 @@ async def afind_neighbour_repos(
     :param token: GitHub access token.
     :param limit_pages: Limit the number of page the algo use to fetch data.
     :param threshold: Only return repository with more than 'n' common user
+    :param http_client: [optional] Shared pooled `httpx.AsyncClient`. When not
+    provided, a pooled client is opened for the duration of the computation.
+    :param max_concurrency: Maximum number of concurrent GitHub requests.
+    :param scheduler: [optional] Shared `RequestScheduler` adapting the actual
+    concurrency to GitHub latency and rate limits.
+    :param cache: [optional] Shared `HTTPResponseCache` of GitHub responses.
+    :param starred_cache: [optional] Shared in-process cache of users' starred
+    repositories.
+    :param graph_store: [optional] Local `StarGraphStore`: fresh stargazers are
+    read from it, and the neighbours of a fully stored repository are computed
+    without any request.
+    :param base_url: GitHub API url (e.g. a local fake GitHub one).
+    :param ranking: [optional] `Ranking` options (top-K, page, stargazers
+    lists). Default: all neighbours, with their stargazers.
+    :param backend: Stargazers' starred repositories backend, "rest" or
+    "graphql" (batches of users per query). See `NEIGHBOURS_BACKENDS`.
+    :param on_progress: [optional] Callback called with keyword arguments
+    `stargazers_done`, `stargazers_total`, `stargazers_complete` and
+    `rate_limited` (and the budget's `requests` and `budget_exhausted`) each
+    time a stargazer's starred repositories are fetched, and once done.
+    :param memory_budget: [optional] Co-stars edges kept in memory, in bytes,
+    before spilling them to disk (see `CoStarCounter`).
+    :param spill_dir: [optional] Directory of the spilled edges.
+    :param aggregation_executor: [optional] `concurrent.futures.Executor`
+    counting large graphs by shards (see `CoStarCounter.compute_sharded`).
+    :param aggregation_shards: Number of shards, default: 1.
+    :param deadline_ms: [optional] Time allowed, in milliseconds: in-flight
+    requests are cancelled past it, neighbours are ranked from the users
+    fetched so far.
+    :param max_requests: [optional] Maximum number of GitHub requests sent.
+    With a deadline or a requests budget, only users' first starred page is
+    fetched (see `StarredReposPipeline`).
     :returns neighbour_repos: Sorted List of repository neighbour of {owner}/{repo}
 
-    Simple Async implementation to speed up fetching user's starred repositories
+    Pipelined implementation: each stargazers' page is fetched asynchronously,
+    and its users are queued for fetching their starred repositories as soon
+    as the page lands. See `StarredReposPipeline`.
+    """
+    # Warm path: everything needed is already in the local graph
+    stored = await _astored_neighbours(
+        graph_store, owner, repo, limit_pages, STARRED_PAGES, threshold, ranking
+    )
+    if stored is not None:
+        return stored
+
+    counter = CoStarCounter(
+        exclude_repos=[f"{owner}/{repo}"],
+        memory_budget=memory_budget,
+        spill_dir=spill_dir,
+    )
+
+    with counter:
+        async with _ahttp_client(http_client) as _http_client:
+            # Stargazers are streamed into the starred repositories fetches and
+            # results are folded in as soon as they complete.
+            pipeline = _build_pipeline(
+                _http_client,
+                token,
+                owner,
+                repo,
+                limit_pages=limit_pages,
+                max_concurrency=max_concurrency,
+                backend=backend,
+                scheduler=scheduler,
+                cache=cache,
+                starred_cache=starred_cache,
+                graph_store=graph_store,
+                base_url=base_url,
+                budget=_build_budget(deadline_ms, max_requests),
+            )
+            transform = metrics.PhaseTimer("transform")
+            async for stargazer, starred_repos in _atimed(pipeline, "starred"):
+                with transform:
+                    counter.add_user(stargazer, starred_repos)
+                if on_progress is not None:
+                    on_progress(**pipeline.progress())
+            transform.record()
+            if on_progress is not None:
+                on_progress(**pipeline.progress())
+
+        # Compute neighbours and sort result, out of the event loop
+        return await _acompute(
+            counter, threshold, ranking, aggregation_executor, aggregation_shards
+        )
+
+
+async def afind_approximate_neighbour_repos(
+    owner: str,
+    repo: str,
+    token: str,
+    sample_pages: int = 5,
+    threshold: int = 2,
+    confidence: float = 0.95,
+    seed: int = None,
+    http_client: httpx.AsyncClient = None,
+    max_concurrency: int = 50,
+    scheduler: RequestScheduler = None,
+    cache: HTTPResponseCache = None,
+    starred_cache: SingleFlightTTLCache = None,
+    graph_store: StarGraphStore = None,
+    base_url: str = GITHUB_API_URL,
+    ranking: Ranking = None,
+    backend: str = "rest",
+):
+    """Approximate `afind_neighbour_repos`, for repositories with many stargazers.
+
+    `limit_pages` only sees the oldest stargazers. Instead:
+    1- Fetch the repository's stargazers count, and the number of listable
+    stargazers' pages: GitHub only lists the first ones (about 400 pages, see
+    `afetch_stargazers_last_page`).
+    2- Draw `sample_pages` listable stargazers' pages uniformly at random.
+    3- Fetch the sampled stargazers' starred repositories and count co-stars.
+    4- Scale counts to the listable stargazers, with confidence intervals (see
+    `sampling.add_estimates`). `threshold` applies to the estimated counts.
+    For repositories with more stargazers than listable, estimates only cover
+    the listable ones (the oldest stargazers).
+
+    Stargazers' requests are bounded by the number of sampled pages; the
+    starred repositories of up to 100 x `sample_pages` users are fetched.
+
+    :param sample_pages: Number of stargazers' pages (of 100) sampled.
+    :param confidence: Confidence level of the counts' intervals.
+    :param seed: [optional] Random seed, to reproduce a sample.
+
+    See `afind_neighbour_repos` for the other parameters.
 
-    Idea to improve/speed up algorithm:
-    Start fetch first 100 stargezers, when complete start fetch user's starred
-    repositories, then second 100 stargezers, when complete add async tasks
-    to fetch newly added user's starred repositories. Ect...
-    using asyncio.as_completed
+    :returns: (results, sorted_results, sampling) where sampling is a dict
+    with the "population" (listable stargazers the estimates cover), the
+    repository's "stargazers_count", "sample_size", "pages" and "confidence".
     """
-    # Init data structure used by neighbour algorithm and Github Client
-    gh_client = GitHubRestClient(token=token)
-
-    # Fetch repository's stargazers
-    repo_stargazers = gh_client.fetch_stargazers(
-        owner=owner,
-        repo=repo,
-        limit_pages=limit_pages,
-    )
-
-    # Fetch stargazers' starred repositories concurrently
-    # Batch process 25 stargazers at a time. When doing all stargazers at once
-    # We reach httpx TimeOut.
-    index = 0
-    batch = 25
-    max_index = len(repo_stargazers)
-    user_repo_map = {}
-    while index <= max_index:
-        end_index = min(index + batch, max_index)
-        tmp_stargazers = repo_stargazers[index:end_index]
-        coroutines = (
-            gh_client.afetch_user_starred_repos(stargazer)
-            for stargazer in tmp_stargazers
-        )
-        tmp_results = await asyncio.gather(*coroutines)
-        tmp_dict = dict(zip(tmp_stargazers, tmp_results))
-        user_repo_map.update(tmp_dict)
-        index = end_index + 1
-
-    # Fetch stargazers' starred repositories concurrently
-    # coroutines = (
-    #     gh_client.afetch_user_starred_repos(stargazer) for stargazer in repo_stargazers
-    # )
-    # results = await asyncio.gather(*coroutines)
-
-    # Map the results
-    # user_repo_map = dict(zip(repo_stargazers, results))
-
-    # Revert the user_repo_map dictionary to be "repo" listing in-common "users"
-    repo_user_map = _transform_user_starred_repositories(
-        user_repo_map, exclude_repos=[f"{owner}/{repo}"]
+    counter = CoStarCounter(exclude_repos=[f"{owner}/{repo}"])
+
+    async with _ahttp_client(http_client) as _http_client:
+        gh_client = GitHubRestClient(
+            token=token,
+            http_client=_http_client,
+            scheduler=scheduler,
+            cache=cache,
+            base_url=base_url,
+        )
+        repository = await gh_client.afetch_repository(owner, repo)
+        stargazers_count = repository["stargazers_count"]
+        last_page = await gh_client.afetch_stargazers_last_page(owner, repo)
+        population = min(stargazers_count, last_page * PAGE_SIZE)
+        pages = sampling.sample_pages(
+            population, sample_pages, per_page=PAGE_SIZE, rng=random.Random(seed)
+        )
+
+        pipeline = _build_pipeline(
+            _http_client,
+            token,
+            owner,
+            repo,
+            max_concurrency=max_concurrency,
+            backend=backend,
+            scheduler=scheduler,
+            cache=cache,
+            starred_cache=starred_cache,
+            stargazers_pages=pages,
+            graph_store=graph_store,
+            base_url=base_url,
+        )
+        transform = metrics.PhaseTimer("transform")
+        async for stargazer, starred_repos in _atimed(pipeline, "starred"):
+            with transform:
+                counter.add_user(stargazer, starred_repos)
+        transform.record()
+
+    sample_size = counter.users_count
+    results, sorted_results = await _acompute(
+        counter,
+        sampling.sample_threshold(threshold, sample_size, population),
+        ranking,
     )
+    # Sorted results are the same dicts as (a part of) the results
+    sampling.add_estimates(results, sample_size, population, confidence)
 
-    # Compute neighbours and sort result
-    results, sorted_results = _compute_and_order_neighbours(
-        repo_user_map, users_threshold=threshold
+    return (
+        results,
+        sorted_results,
+        {
+            "population": population,
+            "stargazers_count": stargazers_count,
+            "sample_size": sample_size,
+            "pages": pages,
+            "confidence": confidence,
+        },
     )
 
-    return results, sorted_results
+
+async def arefresh_neighbour_repos(
+    owner: str,
+    repo: str,
+    token: str,
+    graph_store: StarGraphStore,
+    threshold: int = 2,
+    max_pages: int = 10,
+    http_client: httpx.AsyncClient = None,
+    max_concurrency: int = 50,
+    scheduler: RequestScheduler = None,
+    cache: HTTPResponseCache = None,
+    starred_cache: SingleFlightTTLCache = None,
+    base_url: str = GITHUB_API_URL,
+    ranking: Ranking = None,
+    backend: str = "rest",
+):
+    """Incrementally refresh the neighbours of a repository recorded in the
+    `graph_store`, fetching only what changed since the previous refresh.
+
+    1- Walk the stargazers' pages backward from the last one, until the newest
+    recorded stargazer (`starred_at`, see `afetch_new_stargazers`).
+    2- Fetch the starred repositories of the new stargazers only (and of the
+    recorded ones missing theirs, e.g. after a rate limited refresh).
+    3- Append the new stargazers to the recorded ones, and compute the
+    neighbours of all of them from the `graph_store`.
+
+    Recorded users' starred repositories are reused whatever their age, and
+    stargazers who unstarred the repository are kept. The first refresh
+    records up to `max_pages` newest pages; when a later one can't reach the
+    recorded stargazers within `max_pages`, the recorded ones are replaced.
+
+    :param graph_store: Local `StarGraphStore` holding the previous state.
+    :param max_pages: Maximum number of stargazers' pages walked.
+
+    See `afind_neighbour_repos` for the other parameters.
+
+    :returns: (results, sorted_results, refresh) where refresh is a dict with
+    the number of "new_stargazers", recorded "stargazers" and whether the
+    recorded stargazers are all the repository's ones ("complete").
+    """
+    full_name = f"{owner}/{repo}"
+    # Store calls run out of the event loop
+    since = await asyncio.to_thread(graph_store.latest_starred_at, full_name)
+
+    async with _ahttp_client(http_client) as _http_client:
+        gh_client = GitHubRestClient(
+            token=token,
+            http_client=_http_client,
+            scheduler=scheduler,
+            cache=cache,
+            base_url=base_url,
+        )
+        with metrics.phase_timer("stargazers"):
+            new_stargazers, reached = await gh_client.afetch_new_stargazers(
+                owner, repo, since=since, max_pages=max_pages
+            )
+        new_logins = [login for login, _ in new_stargazers]
+        logins = list(new_logins)
+        if since is not None and reached:
+            logins += await asyncio.to_thread(
+                graph_store.missing_starred_repos, full_name, STARRED_PAGES
+            )
+
+        pipeline = _build_pipeline(
+            _http_client,
+            token,
+            owner,
+            repo,
+            max_concurrency=max_concurrency,
+            backend=backend,
+            scheduler=scheduler,
+            cache=cache,
+            starred_cache=starred_cache,
+            graph_store=graph_store,
+            base_url=base_url,
+            logins=logins,
+        )
+        async for _ in _atimed(pipeline, "starred"):
+            pass
+
+    # Fetched users are recorded: the next refresh resumes from them
+    if pipeline.rate_limited:
+        raise RateLimitExceeded()
+
+    starred_at = [_starred_at for _, _starred_at in new_stargazers]
+    if since is not None and reached:
+        await asyncio.to_thread(
+            graph_store.add_stargazers, full_name, new_logins, starred_at
+        )
+    else:
+        # First refresh, or new stargazers not reaching the recorded ones:
+        # only a complete list is recorded as the first pages.
+        pages = math.ceil(len(new_logins) / PAGE_SIZE) if reached else None
+        await asyncio.to_thread(
+            graph_store.put_stargazers, full_name, new_logins, pages, starred_at
+        )
+
+    with metrics.phase_timer("graph_store"):
+        results, sorted_results = await asyncio.to_thread(
+            graph_store.neighbours,
+            full_name,
+            pages=None,
+            starred_pages=STARRED_PAGES,
+            users_threshold=threshold,
+            ranking=ranking,
+            ttl=math.inf,
+        )
+    stargazers_count, stargazers_pages = await asyncio.to_thread(
+        graph_store.stargazers_info, full_name
+    )
+    return (
+        results,
+        sorted_results,
+        {
+            "new_stargazers": len(new_stargazers),
+            "stargazers": stargazers_count,
+            "complete": stargazers_pages is not None,
+        },
+    )
+
+
+async def aiter_neighbour_repos(
+    owner: str,
+    repo: str,
+    token: str,
+    limit_pages: int = 2,
+    threshold: int = 2,
+    snapshot_size: int = 20,
+    snapshot_interval: float = 1.0,
+    http_client: httpx.AsyncClient = None,
+    max_concurrency: int = 50,
+    scheduler: RequestScheduler = None,
+    cache: HTTPResponseCache = None,
+    starred_cache: SingleFlightTTLCache = None,
+    graph_store: StarGraphStore = None,
+    base_url: str = GITHUB_API_URL,
+    ranking: Ranking = None,
+    backend: str = "rest",
+    memory_budget: int = None,
+    spill_dir: str = None,
+    aggregation_executor=None,
+    aggregation_shards: int = None,
+    deadline_ms: float = None,
+    max_requests: int = None,
+):
+    """Streaming implementation of `afind_neighbour_repos`.
+
+    Yield events (dict with an "event" key) while fetching:
+    - "progress": stargazers processed / total, at most every
+    `snapshot_interval` seconds.
+    - "snapshot": top `snapshot_size` neighbours so far (without stargazers
+    lists), sent with the progress event.
+    - "result": final sorted neighbours, as returned by `afind_neighbour_repos`.
+
+    See `afind_neighbour_repos` for the other parameters.
+
+    :param snapshot_size: Number of neighbours in the snapshot events.
+    :param snapshot_interval: Minimum seconds between two progress events.
+    :returns: Async generator of events
+    """
+    # Warm path: everything needed is already in the local graph
+    stored = await _astored_neighbours(
+        graph_store, owner, repo, limit_pages, STARRED_PAGES, threshold, ranking
+    )
+    if stored is not None:
+        yield {"event": "result", "results": stored[1]}
+        return
+
+    counter = CoStarCounter(
+        exclude_repos=[f"{owner}/{repo}"],
+        memory_budget=memory_budget,
+        spill_dir=spill_dir,
+    )
+
+    with counter:
+        async with _ahttp_client(http_client) as _http_client:
+            pipeline = _build_pipeline(
+                _http_client,
+                token,
+                owner,
+                repo,
+                limit_pages=limit_pages,
+                max_concurrency=max_concurrency,
+                backend=backend,
+                scheduler=scheduler,
+                cache=cache,
+                starred_cache=starred_cache,
+                graph_store=graph_store,
+                base_url=base_url,
+                budget=_build_budget(deadline_ms, max_requests),
+            )
+            last_event_at = time.monotonic()
+            transform = metrics.PhaseTimer("transform")
+            async for stargazer, starred_repos in _atimed(pipeline, "starred"):
+                with transform:
+                    counter.add_user(stargazer, starred_repos)
+
+                if time.monotonic() - last_event_at < snapshot_interval:
+                    continue
+
+                last_event_at = time.monotonic()
+                yield {"event": "progress", **pipeline.progress()}
+                yield {
+                    "event": "snapshot",
+                    "results": counter.snapshot(snapshot_size, threshold),
+                }
+
+            transform.record()
+            yield {"event": "progress", **pipeline.progress()}
+
+        results, sorted_results = await _acompute(
+            counter, threshold, ranking, aggregation_executor, aggregation_shards
+        )
+    yield {"event": "result", "results": sorted_results}
+
+
+async def _afetch_batch_stargazers(gh_client, full_name, limit_pages):
+    """Return a batch repository's stargazers, or its `HTTPException`"""
+    owner, repo = full_name.split("/", 1)
+    try:
+        return await gh_client.afetch_stargazers(owner, repo, limit_pages=limit_pages)
+    except HTTPException as exc:
+        return exc
+
+
+def _compute_batch(counter, stargazers, threshold, ranking, executor, shards):
+    """Rank each batch repository's neighbours, from its stargazers' edges"""
+    results = {}
+    for full_name, repo_stargazers in stargazers.items():
+        if isinstance(repo_stargazers, HTTPException):
+            results[full_name] = {
+                "error": repo_stargazers.detail,
+                "status_code": repo_stargazers.status_code,
+            }
+            continue
+
+        subset = counter.subset(repo_stargazers, exclude_repos=[full_name])
+        _, sorted_results = _compute(subset, threshold, ranking, executor, shards)
+        results[full_name] = {"results": sorted_results}
+    return results
+
+
+async def afind_batch_neighbour_repos(
+    repos: list,
+    token: str,
+    limit_pages: int = 2,
+    threshold: int = 2,
+    http_client: httpx.AsyncClient = None,
+    max_concurrency: int = 50,
+    scheduler: RequestScheduler = None,
+    cache: HTTPResponseCache = None,
+    starred_cache: SingleFlightTTLCache = None,
+    graph_store: StarGraphStore = None,
+    base_url: str = GITHUB_API_URL,
+    ranking: Ranking = None,
+    backend: str = "rest",
+    aggregation_executor=None,
+    aggregation_shards: int = None,
+):
+    """Find the neighbours of several repositories at once, fetching each
+    stargazer's starred repositories only once.
+
+    1- Fetch the repositories' stargazers concurrently.
+    2- Deduplicate the stargazers across the batch, fetch their starred
+    repositories once (see `StarredReposPipeline`) and fold them into one
+    shared `CoStarCounter`.
+    3- Rank each repository's neighbours from its own stargazers' edges (see
+    `CoStarCounter.subset`).
+
+    Repositories whose stargazers can't be fetched (e.g. not found) get an
+    "error" and its "status_code" instead of "results". When the rate limit
+    budget is exhausted, the neighbours are ranked from the users fetched.
+
+    :param repos: Repositories' full names ("owner/repo").
+
+    See `afind_neighbour_repos` for the other parameters.
+
+    :returns: (results, batch) where results is a dict {"owner/repo":
+    {"results": sorted_results}} and batch a dict with the number of "repos",
+    "stargazers" (per repository, summed), "unique_stargazers",
+    "shared_stargazers" (starring several of the repositories),
+    "starred_fetches_saved" and whether the fetch was "rate_limited".
+    """
+    repos = list(dict.fromkeys(repos))
+    counter = CoStarCounter()
+
+    async with _ahttp_client(http_client) as _http_client:
+        gh_client = GitHubRestClient(
+            token=token,
+            http_client=_http_client,
+            scheduler=scheduler,
+            cache=cache,
+            base_url=base_url,
+        )
+        with metrics.phase_timer("stargazers"):
+            fetched = await asyncio.gather(
+                *(
+                    _afetch_batch_stargazers(gh_client, full_name, limit_pages)
+                    for full_name in repos
+                )
+            )
+        stargazers = dict(zip(repos, fetched))
+
+        stargazers_count = collections.Counter(
+            login
+            for repo_stargazers in fetched
+            if not isinstance(repo_stargazers, HTTPException)
+            for login in repo_stargazers
+        )
+        pipeline = _build_pipeline(
+            _http_client,
+            token,
+            None,
+            None,
+            max_concurrency=max_concurrency,
+            backend=backend,
+            scheduler=scheduler,
+            cache=cache,
+            starred_cache=starred_cache,
+            graph_store=graph_store,
+            base_url=base_url,
+            logins=list(stargazers_count),
+        )
+        transform = metrics.PhaseTimer("transform")
+        async for stargazer, starred_repos in _atimed(pipeline, "starred"):
+            with transform:
+                counter.add_user(stargazer, starred_repos)
+        transform.record()
+
+    results = await asyncio.to_thread(
+        _compute_batch,
+        counter,
+        stargazers,
+        threshold,
+        ranking,
+        aggregation_executor,
+        aggregation_shards,
+    )
+    total = sum(stargazers_count.values())
+    return results, {
+        "repos": len(repos),
+        "stargazers": total,
+        "unique_stargazers": len(stargazers_count),
+        "shared_stargazers": sum(1 for n in stargazers_count.values() if n > 1),
+        "starred_fetches_saved": total - len(stargazers_count),
+        "rate_limited": pipeline.rate_limited,
+    }
 
 
 # -----------------------------------------------------------------------------
 # Algo using GitHub GraphQL API
-def find_graphql_neighbour_repos(owner: str, repo: str, token: str, threshold: int = 2):
+def find_graphql_neighbour_repos(
+    owner: str,
+    repo: str,
+    token: str,
+    limit_pages: int = 2,
+    threshold: int = 2,
+    scheduler: RequestScheduler = None,
+    base_url: str = GITHUB_API_URL,
+    ranking: Ranking = None,
+):
+    """Find repositories that share stargazers with the given repository,
+    using GitHub GraphQL API.
+
+    Stargazers and their starred repositories are fetched together, crawling
+    GraphQL cursors (see `GitHubGraphQLClient`).
+
+    :param owner: GitHub repo's owner.
+    :param repo: GitHub repo's name.
+    :param token: GitHub access token.
+    :param limit_pages: Limit the number of page the algo use to fetch data.
+    :param threshold: Only return repository with more than 'n' common user
+    :param scheduler: [optional] Shared `RequestScheduler` handling rate limits
+    and retries.
+    :param base_url: GitHub API url (e.g. a local fake GitHub one).
+    :param ranking: [optional] `Ranking` options (top-K, page, stargazers
+    lists). Default: all neighbours, with their stargazers.
+    :returns neighbour_repos: Sorted List of repository neighbour of {owner}/{repo}
+    """
     # Init data structure used by neighbour algorithm and Github Client
-    gh_client = GitHubGraphQLClient(token=token)
+    gh_client = GitHubGraphQLClient(token=token, scheduler=scheduler, base_url=base_url)
 
-    # Fetch repository's stargazers and their related first starred repositories
-    user_repo_map = gh_client.fetch_stargazers_with_starred_repos(
-        owner=owner, repo=repo
-    )
+    # Fetch repository's stargazers and their related starred repositories
+    with metrics.phase_timer("starred"):
+        user_repo_map = gh_client.fetch_stargazers_with_starred_repos(
+            owner=owner, repo=repo, limit_pages=limit_pages
+        )
 
-    # Revert the user_repo_map dictionary to be "repo" listing in-common "users"
-    repo_user_map = _transform_user_starred_repositories(
-        user_repo_map, exclude_repos=[f"{owner}/{repo}"]
-    )
+    # Count in-common users of each repository
+    with metrics.phase_timer("transform"):
+        counter = CoStarCounter.from_user_repo_map(
+            user_repo_map, exclude_repos=[f"{owner}/{repo}"]
+        )
 
     # Compute neighbours and sort result
-    results, sorted_results = _compute_and_order_neighbours(
-        repo_user_map, users_threshold=threshold
+    return _compute(counter, threshold, ranking)
+
+
+async def afind_graphql_neighbour_repos(
+    owner: str,
+    repo: str,
+    token: str,
+    limit_pages: int = 2,
+    threshold: int = 2,
+    http_client: httpx.AsyncClient = None,
+    max_concurrency: int = 50,
+    scheduler: RequestScheduler = None,
+    base_url: str = GITHUB_API_URL,
+    ranking: Ranking = None,
+):
+    """Async implementation of `find_graphql_neighbour_repos`.
+
+    Users' starred repositories cursors are followed concurrently, and users
+    are folded in as soon as they are complete.
+
+    :param http_client: [optional] Shared pooled `httpx.AsyncClient`.
+    :param max_concurrency: Maximum number of cursors followed concurrently.
+
+    See `find_graphql_neighbour_repos` for the other parameters.
+    """
+    counter = CoStarCounter(exclude_repos=[f"{owner}/{repo}"])
+    gh_client = GitHubGraphQLClient(
+        token=token, http_client=http_client, scheduler=scheduler, base_url=base_url
     )
 
-    return results, sorted_results
+    transform = metrics.PhaseTimer("transform")
+    async for stargazer, starred_repos in _atimed(
+        gh_client.aiter_stargazers_with_starred_repos(
+            owner=owner,
+            repo=repo,
+            limit_pages=limit_pages,
+            max_concurrency=max_concurrency,
+        ),
+        "starred",
+    ):
+        with transform:
+            counter.add_user(stargazer, starred_repos)
+    transform.record()
+
+    # Compute neighbours and sort result, out of the event loop
+    return await _acompute(counter, threshold, ranking)
@@ -0,0 +1,87 @@
+import math
+import random
+
+from statistics import NormalDist
+
+
+def sample_pages(population: int, max_pages: int, per_page: int = 100, rng=None):
+    """Draw stargazers' page numbers uniformly, without replacement.
+
+    GitHub lists stargazers by starring date: the first pages only hold the
+    oldest stargazers. Random pages spread the sample over the whole range.
+
+    :param population: Number of listable stargazers (GitHub doesn't list
+    the stargazers past its last page, see `afetch_stargazers_last_page`).
+    :param max_pages: Maximum number of pages drawn.
+    :param per_page: Number of stargazers per page.
+    :param rng: [optional] `random.Random` instance (Default: module's one).
+    :returns: Sorted list of page numbers (starting at 1)
+    """
+    rng = rng if rng is not None else random
+    pages_count = math.ceil(population / per_page)
+    return sorted(rng.sample(range(1, pages_count + 1), min(max_pages, pages_count)))
+
+
+def wilson_interval(
+    count: int, sample_size: int, population: int, confidence: float = 0.95
+):
+    """Confidence interval of the number of users in the population, given
+    `count` users among a uniform sample of `sample_size` users.
+
+    Wilson score interval of the proportion, with the finite population
+    correction, scaled to the population.
+
+    :returns: (low, high) number of users
+    """
+    if sample_size >= population:
+        return float(count), float(count)
+
+    z = NormalDist().inv_cdf((1 + confidence) / 2)
+    fpc = (population - sample_size) / (population - 1)
+    n = sample_size / fpc
+    p = count / sample_size
+
+    denominator = 1 + z**2 / n
+    center = (p + z**2 / (2 * n)) / denominator
+    half_width = z * math.sqrt(p * (1 - p) / n + z**2 / (4 * n**2)) / denominator
+
+    # At least the users observed in the sample
+    low = max(population * (center - half_width), float(count))
+    high = min(population * (center + half_width), float(population))
+    return low, high
+
+
+def sample_threshold(threshold: int, sample_size: int, population: int):
+    """Minimum sampled count of a repository whose estimated count reaches
+    `threshold`.
+    """
+    if not sample_size:
+        return threshold
+
+    return max(1, math.ceil(threshold * min(sample_size / population, 1.0)))
+
+
+def add_estimates(results, sample_size, population, confidence=0.95):
+    """Add the population estimates to sampled neighbours results (in place).
+
+    - "stargazers_estimate": sampled count scaled to the population.
+    - "stargazers_interval": (low, high) confidence interval of the count.
+
+    :param results: Neighbours results computed on the sample.
+    :param sample_size: Number of sampled stargazers.
+    :param population: Total number of stargazers.
+    :param confidence: Confidence level of the intervals.
+    :returns: results
+    """
+    if not results:
+        return results
+
+    scale = population / sample_size if sample_size < population else 1.0
+    for result in results:
+        count = result["stargazers_count"]
+        result["stargazers_estimate"] = count * scale
+        result["stargazers_interval"] = wilson_interval(
+            count, sample_size, population, confidence
+        )
+
+    return results
@@ -0,0 +1,555 @@
+import asyncio
+import contextlib
+import contextvars
+import httpx
+import math
+import random
+import requests
+import threading
+import time
+
+from fastapi import HTTPException
+
+from mergify_algos import metrics
+from mergify_algos.utils import display_secret
+
+# Transient statuses worth retrying
+RETRY_STATUS_CODES = (500, 502, 503, 504)
+# GitHub answers 403 (or 429) when reaching a primary or secondary rate limit
+# See: https://docs.github.com/en/rest/using-the-rest-api/rate-limits-for-the-rest-api
+RATE_LIMIT_STATUS_CODES = (403, 429)
+
+ASYNC_TRANSPORT_ERRORS = (httpx.TransportError,)
+SYNC_TRANSPORT_ERRORS = (requests.ConnectionError, requests.Timeout)
+
+
+class RateLimitExceeded(HTTPException):
+    """Raised when the GitHub rate limit budget is exhausted for too long"""
+
+    def __init__(self, reset: float = None):
+        self.reset = reset
+        super().__init__(
+            status_code=429,
+            detail={"message": "GitHub API rate limit exceeded", "reset": reset},
+        )
+
+
+class BudgetExhausted(Exception):
+    """Raised when a computation's deadline or requests budget is reached"""
+
+
+class ComputationBudget:
+    """Deadline and GitHub requests budget of one neighbours computation.
+
+    Set for the computation context (see `computation_budget`): each GitHub
+    request attempt sent through a `RequestScheduler` meanwhile consumes one
+    request, and is refused with `BudgetExhausted` once the requests are
+    spent or the deadline is passed. Responses served by caches are free.
+    """
+
+    def __init__(self, deadline_ms: float = None, max_requests: int = None):
+        """
+        :param deadline_ms: [optional] Time allowed from now, in milliseconds.
+        :param max_requests: [optional] Maximum number of GitHub requests.
+        """
+        self.deadline_ms = deadline_ms
+        self.max_requests = max_requests
+        self.deadline = (
+            time.monotonic() + deadline_ms / 1000 if deadline_ms is not None else None
+        )
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def remaining(self):
+        """Seconds left before the deadline (None without deadline)"""
+        if self.deadline is None:
+            return None
+        return max(self.deadline - time.monotonic(), 0.0)
+
+    @property
+    def exhausted(self):
+        if self.deadline is not None and time.monotonic() >= self.deadline:
+            return True
+        return self.max_requests is not None and self.requests >= self.max_requests
+
+    def consume(self):
+        """Consume one request, raise `BudgetExhausted` if none is left"""
+        with self._lock:
+            if self.exhausted:
+                raise BudgetExhausted()
+            self.requests += 1
+
+    def to_dict(self):
+        return {
+            "deadline_ms": self.deadline_ms,
+            "max_requests": self.max_requests,
+            "requests": self.requests,
+            "exhausted": self.exhausted,
+        }
+
+
+_computation_budget = contextvars.ContextVar("computation_budget", default=None)
+
+
+@contextlib.contextmanager
+def computation_budget(budget: ComputationBudget = None):
+    """Apply `budget` to the GitHub requests sent in the current context"""
+    reset_token = _computation_budget.set(budget)
+    try:
+        yield budget
+    finally:
+        _computation_budget.reset(reset_token)
+
+
+def computation_timeout(timeout):
+    """Return the `timeout` (seconds) of a request sent now, bounded by the
+    current `ComputationBudget`'s deadline, if any.
+    """
+    budget = _computation_budget.get()
+    remaining = budget.remaining() if budget is not None else None
+    if remaining is None:
+        return timeout
+    # A null timeout isn't valid: past the deadline, the request fails fast
+    return min(timeout, max(remaining, 0.001))
+
+
+def _consume_computation_budget():
+    budget = _computation_budget.get()
+    if budget is not None:
+        budget.consume()
+
+
+class RateLimitBudget:
+    """GitHub rate limit budget of one token / resource.
+
+    Updated from `X-RateLimit-*` response headers. The remaining budget is
+    decremented locally for each request sent, so concurrent requests don't
+    all rely on the same stale value.
+    """
+
+    def __init__(self):
+        self.limit = None
+        self.remaining = None
+        self.reset = None
+
+    def update(self, headers):
+        """Update the budget from response headers"""
+        for attr, header in (
+            ("limit", "x-ratelimit-limit"),
+            ("remaining", "x-ratelimit-remaining"),
+            ("reset", "x-ratelimit-reset"),
+        ):
+            value = headers.get(header)
+            if value is not None:
+                setattr(self, attr, int(value))
+
+    def consume(self):
+        if self.remaining is not None and self.remaining > 0:
+            self.remaining -= 1
+
+    def is_exhausted(self, reserve=0, now=None):
+        """Return True when the budget is under `reserve` until its reset"""
+        if self.remaining is None or self.reset is None:
+            return False
+
+        now = now if now is not None else time.time()
+        return self.remaining <= reserve and self.reset > now
+
+    def delay(self, reserve=0, pacing_ratio=0.1, now=None):
+        """Return how long the next request should wait, in seconds.
+
+        - Plenty of budget: no wait.
+        - Less than `pacing_ratio` of the budget: spread the remaining
+        requests evenly until the reset time.
+        - Less than `reserve` requests: wait until the reset time.
+        """
+        if self.remaining is None or self.reset is None:
+            return 0
+
+        window = self.reset - (now if now is not None else time.time())
+        if window <= 0:
+            return 0
+
+        if self.remaining <= reserve:
+            return window
+
+        if self.limit and self.remaining < self.limit * pacing_ratio:
+            return window / (self.remaining - reserve)
+
+        return 0
+
+
+class TokenPool:
+    """Pool of GitHub tokens sharing the requests, to add up their budgets.
+
+    Each request is assigned the token with the most remaining budget of its
+    resource (see `RateLimitBudget`, updated from response headers), ties going
+    to the least used token. Exhausted tokens are out of rotation until their
+    reset time.
+    """
+
+    def __init__(self, tokens: list):
+        """
+        :param tokens: GitHub access tokens.
+        """
+        self.tokens = list(dict.fromkeys(tokens))
+        self.requests = dict.fromkeys(self.tokens, 0)
+
+    def select(self, budgets, reserve=0, now=None):
+        """Return the token to use for the next request.
+
+        :param budgets: {token: `RateLimitBudget`} of the request's resource.
+        :param reserve: Tokens with less remaining requests are exhausted.
+        :returns: The token with the most remaining budget. When all of them are
+        exhausted, the one reset first.
+        """
+        available = [
+            token
+            for token in self.tokens
+            if not budgets[token].is_exhausted(reserve, now)
+        ]
+        if available:
+            token = max(
+                available,
+                key=lambda t: (
+                    _remaining(budgets[t]),
+                    -self.requests[t],
+                ),
+            )
+        else:
+            token = min(self.tokens, key=lambda t: budgets[t].reset)
+
+        self.requests[token] += 1
+        return token
+
+    def has_available(self, budgets, reserve=0, now=None):
+        return any(
+            not budgets[token].is_exhausted(reserve, now) for token in self.tokens
+        )
+
+
+def _record_budget(budget, token, resource):
+    if budget.remaining is not None:
+        metrics.GITHUB_RATE_LIMIT_REMAINING.set(
+            budget.remaining,
+            token=display_secret(token) or "anonymous",
+            resource=resource,
+        )
+
+
+def _record_retry(response, resource):
+    reason = "transport_error" if response is None else str(response.status_code)
+    metrics.GITHUB_RETRIES.inc(resource=resource, reason=reason)
+
+
+def _remaining(budget):
+    # Unknown budget: not used yet, so full
+    return budget.remaining if budget.remaining is not None else math.inf
+
+
+class AIMDLimiter:
+    """Adaptive concurrency limiter (Additive Increase, Multiplicative Decrease).
+
+    The limit grows by ~1 each time a full window of requests succeeds and is
+    cut by `decrease_factor` on congestion: throttling responses, transient
+    errors, or latency exceeding `latency_tolerance` times the best observed.
+    """
+
+    def __init__(
+        self,
+        initial_limit: int = 10,
+        min_limit: int = 1,
+        max_limit: int = 50,
+        decrease_factor: float = 0.5,
+        latency_tolerance: float = 3.0,
+    ):
+        self.limit = float(min(max(initial_limit, min_limit), max_limit))
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.decrease_factor = decrease_factor
+        self.latency_tolerance = latency_tolerance
+
+        self.in_flight = 0
+        self.min_latency = None
+        self._last_decrease = 0.0
+        self._loop = None
+        self._condition = None
+
+    def _get_condition(self):
+        # asyncio primitives are bound to the event loop they are used with
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop, self._condition = loop, asyncio.Condition()
+            self.in_flight = 0
+        return self._condition
+
+    async def __aenter__(self):
+        condition = self._get_condition()
+        async with condition:
+            await condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+
+    async def __aexit__(self, exc_type, exc, tb):
+        condition = self._get_condition()
+        async with condition:
+            self.in_flight -= 1
+            condition.notify_all()
+
+    def on_success(self, latency: float):
+        # Slowly forget the best latency, so the baseline follows the network
+        if self.min_latency is None or latency < self.min_latency:
+            self.min_latency = latency
+        else:
+            self.min_latency *= 1.01
+
+        if latency > self.latency_tolerance * self.min_latency:
+            self.on_congestion()
+            return
+
+        self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+
+    def on_congestion(self):
+        # Only decrease once per round trip, in-flight requests share the cause
+        now = time.monotonic()
+        if now - self._last_decrease < (self.min_latency or 0):
+            return
+
+        self.limit = max(self.min_limit, self.limit * self.decrease_factor)
+        self._last_decrease = now
+
+
+class RequestScheduler:
+    """Schedule GitHub requests: adaptive concurrency, rate limits & retries.
+
+    - Concurrency of async requests is adapted by an `AIMDLimiter`.
+    - Rate limit headers are tracked per (token, resource) and the remaining
+    budget is paced until its reset time (see `RateLimitBudget`).
+    - Transient errors (5xx, 429, secondary rate limits, transport errors) are
+    retried with a jittered exponential backoff.
+    - With a `TokenPool`, requests not pinned to a token are spread over the
+    pool's tokens, and a rate limited request is retried with another token.
+
+    Requests are given as callables (`send`) taking the token to use (None for
+    anonymous requests), returning either a `requests.Response` (`send`) or an
+    awaitable `httpx.Response` (`asend`). The last response is returned when
+    retries are exhausted, the caller is in charge of handling it.
+
+    Each attempt consumes the current `ComputationBudget`, if any.
+    """
+
+    def __init__(
+        self,
+        max_retries: int = 3,
+        backoff_base: float = 0.5,
+        backoff_cap: float = 30.0,
+        rate_limit_reserve: int = 10,
+        rate_limit_pacing_ratio: float = 0.1,
+        rate_limit_max_wait: float = 60.0,
+        limiter: AIMDLimiter = None,
+        token_pool: TokenPool = None,
+    ):
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.rate_limit_reserve = rate_limit_reserve
+        self.rate_limit_pacing_ratio = rate_limit_pacing_ratio
+        self.rate_limit_max_wait = rate_limit_max_wait
+        self.limiter = limiter if limiter is not None else AIMDLimiter()
+        self.token_pool = token_pool
+
+        self._budgets = {}
+
+    def budget(self, token=None, resource="core"):
+        """Return the `RateLimitBudget` of the given token / resource"""
+        return self._budgets.setdefault((token, resource), RateLimitBudget())
+
+    def _pool_budgets(self, resource):
+        return {token: self.budget(token, resource) for token in self.token_pool.tokens}
+
+    def _select_token(self, token, resource):
+        """Return the request's token: the pinned one, or one of the pool"""
+        if token is not None or self.token_pool is None:
+            return token
+
+        return self.token_pool.select(
+            self._pool_budgets(resource), reserve=self.rate_limit_reserve
+        )
+
+    def _pool_available(self, resource):
+        """Return True when a pool's token still has some budget"""
+        return self.token_pool is not None and self.token_pool.has_available(
+            self._pool_budgets(resource), reserve=self.rate_limit_reserve
+        )
+
+    def tokens_stats(self):
+        """Return the per-token usage of the pool's tokens"""
+        if self.token_pool is None:
+            return []
+
+        stats = []
+        for token in self.token_pool.tokens:
+            budgets = {
+                resource: vars(budget)
+                for (_token, resource), budget in self._budgets.items()
+                if _token == token
+            }
+            stats.append(
+                {
+                    "token": display_secret(token),
+                    "requests": self.token_pool.requests[token],
+                    "budgets": budgets,
+                }
+            )
+        return stats
+
+    def _backoff(self, attempt):
+        """Full jitter exponential backoff"""
+        return random.uniform(0, min(self.backoff_cap, self.backoff_base * 2**attempt))
+
+    def _budget_delay(self, budget):
+        """Return the delay before sending, raise if the budget is exhausted"""
+        delay = budget.delay(
+            reserve=self.rate_limit_reserve, pacing_ratio=self.rate_limit_pacing_ratio
+        )
+        if delay > self.rate_limit_max_wait:
+            raise RateLimitExceeded(reset=budget.reset)
+
+        budget.consume()
+        return delay
+
+    def _retry_delay(self, response, budget, attempt, pooled=False, resource="core"):
+        """Return the delay before retrying the response, None if no retry"""
+        status_code = response.status_code
+        if status_code in RETRY_STATUS_CODES:
+            return self._backoff(attempt)
+
+        if status_code not in RATE_LIMIT_STATUS_CODES:
+            return None
+
+        retry_after = response.headers.get("retry-after")
+        if retry_after is not None:
+            delay = float(retry_after)
+            if delay > self.rate_limit_max_wait:
+                raise RateLimitExceeded(reset=time.time() + delay)
+            return delay
+
+        # Primary rate limit: wait until the reset time
+        if budget.remaining == 0 and budget.reset is not None:
+            if pooled and self._pool_available(resource):
+                return 0
+            delay = max(budget.reset - time.time(), 0)
+            if delay > self.rate_limit_max_wait:
+                raise RateLimitExceeded(reset=budget.reset)
+            return delay
+
+        # Secondary rate limit without `Retry-After`: GitHub asks to wait at
+        # least one minute
+        if "secondary rate limit" in response.text.lower():
+            return min(60.0, self.rate_limit_max_wait) + self._backoff(attempt)
+
+        if status_code == 429:
+            return self._backoff(attempt)
+
+        # A "regular" 403 (e.g. forbidden resource)
+        return None
+
+    async def asend(self, send, token=None, resource="core"):
+        """Send an async request through the scheduler
+
+        :param send: Callable taking the token to use and returning an
+        awaitable `httpx.Response`
+        :param token: GitHub token pinned for the request (rate limit budget
+        key). When None, a token of the `token_pool` is selected, if any.
+        :param resource: GitHub rate limit resource ("core", "graphql", ...)
+        :returns: httpx.Response
+        """
+        pooled = token is None and self.token_pool is not None
+        attempt = 0
+        while True:
+            _consume_computation_budget()
+            _token = self._select_token(token, resource)
+            budget = self.budget(_token, resource)
+            await asyncio.sleep(self._budget_delay(budget))
+
+            async with self.limiter:
+                start = time.monotonic()
+                try:
+                    response = await send(_token)
+                except ASYNC_TRANSPORT_ERRORS:
+                    self.limiter.on_congestion()
+                    if attempt >= self.max_retries:
+                        raise
+                    response = None
+                latency = time.monotonic() - start
+
+            if response is None:
+                delay = self._backoff(attempt)
+            else:
+                budget.update(response.headers)
+                _record_budget(budget, _token, resource)
+                delay = self._retry_delay(response, budget, attempt, pooled, resource)
+                if delay is None:
+                    self.limiter.on_success(latency)
+                    return response
+
+                self.limiter.on_congestion()
+                if attempt >= self.max_retries:
+                    return response
+
+            _record_retry(response, resource)
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    def send(self, send, token=None, resource="core"):
+        """Send a sync request through the scheduler (see `asend`)
+
+        Sync requests are sequential, so the concurrency limiter isn't used.
+
+        :returns: requests.Response
+        """
+        pooled = token is None and self.token_pool is not None
+        attempt = 0
+        while True:
+            _consume_computation_budget()
+            _token = self._select_token(token, resource)
+            budget = self.budget(_token, resource)
+            time.sleep(self._budget_delay(budget))
+
+            try:
+                response = send(_token)
+            except SYNC_TRANSPORT_ERRORS:
+                if attempt >= self.max_retries:
+                    raise
+                response = None
+
+            if response is None:
+                delay = self._backoff(attempt)
+            else:
+                budget.update(response.headers)
+                _record_budget(budget, _token, resource)
+                delay = self._retry_delay(response, budget, attempt, pooled, resource)
+                if delay is None or attempt >= self.max_retries:
+                    return response
+
+            _record_retry(response, resource)
+            attempt += 1
+            time.sleep(delay)
+
+
+def build_request_scheduler_from_settings(settings):
+    """Build the shared `RequestScheduler` from the App `Settings`"""
+    return RequestScheduler(
+        max_retries=settings.github_max_retries,
+        backoff_base=settings.github_backoff_base,
+        backoff_cap=settings.github_backoff_cap,
+        rate_limit_reserve=settings.github_rate_limit_reserve,
+        rate_limit_max_wait=settings.github_rate_limit_max_wait,
+        limiter=AIMDLimiter(
+            initial_limit=settings.github_initial_concurrency,
+            min_limit=1,
+            max_limit=settings.github_max_concurrency,
+        ),
+        token_pool=(
+            TokenPool(settings.github_tokens) if settings.github_tokens else None
+        ),
+    )
@@ -0,0 +1,155 @@
+import asyncio
+import json
+import sqlite3
+import threading
+import time
+import uuid
+
+JOB_PENDING = "pending"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+
+
+class Job:
+    """A long-running computation, run as an asyncio task"""
+
+    def __init__(self, job_id, key, params, created_at=None):
+        self.id = job_id
+        self.key = key
+        self.params = params
+        self.status = JOB_PENDING
+        self.progress = {}
+        self.result = None
+        self.error = None
+        self.created_at = created_at if created_at is not None else time.time()
+        self.finished_at = None
+        self.task = None
+
+    def update_progress(self, **progress):
+        self.progress.update(progress)
+
+    def to_dict(self):
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "params": self.params,
+            "progress": self.progress,
+            "result": self.result,
+            "error": self.error,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class JobStore:
+    """SQLite store of finished jobs, expiring after `ttl` seconds"""
+
+    def __init__(self, path: str = ":memory:", ttl: float = 24 * 3600.0):
+        self.ttl = ttl
+
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " id TEXT PRIMARY KEY,"
+            " key TEXT NOT NULL,"
+            " data TEXT NOT NULL,"
+            " expires_at REAL NOT NULL)"
+        )
+        self._connection.commit()
+
+    def save(self, job: Job):
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO jobs VALUES (?, ?, ?, ?)",
+                (job.id, job.key, json.dumps(job.to_dict()), time.time() + self.ttl),
+            )
+            self._connection.commit()
+
+    def get(self, job_id: str):
+        """Return the stored job as a dict, None if unknown or expired"""
+        with self._lock:
+            self._connection.execute(
+                "DELETE FROM jobs WHERE expires_at <= ?", (time.time(),)
+            )
+            self._connection.commit()
+            row = self._connection.execute(
+                "SELECT data FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+
+        return json.loads(row[0]) if row is not None else None
+
+    def close(self):
+        self._connection.close()
+
+
+class JobManager:
+    """Run computations in the background and keep track of them.
+
+    - Jobs with the same `key` (same computation and parameters) are
+    deduplicated while in flight: the running job's id is returned.
+    - Finished jobs are saved in the `JobStore`, where they expire.
+    """
+
+    def __init__(self, store: JobStore = None):
+        self.store = store if store is not None else JobStore()
+        self._jobs = {}
+        self._inflight = {}
+
+    def submit(self, key: str, params: dict, run):
+        """Submit a job, or return the in-flight one with the same key.
+
+        :param key: Key identifying the computation and its parameters.
+        :param params: Job's parameters, returned with the job status.
+        :param run: Callable taking the `Job` and returning the coroutine to
+        run. The coroutine can report progress with `job.update_progress`.
+        :returns: Job
+        """
+        job_id = self._inflight.get(key)
+        if job_id is not None:
+            return self._jobs[job_id]
+
+        job = Job(uuid.uuid4().hex, key, params)
+        self._jobs[job.id] = job
+        self._inflight[key] = job.id
+        job.task = asyncio.ensure_future(self._run(job, run))
+        return job
+
+    async def _run(self, job: Job, run):
+        job.status = JOB_RUNNING
+        try:
+            job.result = await run(job)
+            job.status = JOB_DONE
+        except Exception as exc:
+            job.status = JOB_FAILED
+            job.error = getattr(exc, "detail", None) or repr(exc)
+        finally:
+            job.finished_at = time.time()
+            del self._inflight[job.key]
+            del self._jobs[job.id]
+            if job.status != JOB_RUNNING:
+                self.store.save(job)
+
+    def get(self, job_id: str):
+        """Return the job as a dict, None if unknown or expired"""
+        job = self._jobs.get(job_id)
+        if job is not None:
+            return job.to_dict()
+
+        return self.store.get(job_id)
+
+    async def close(self):
+        """Cancel the jobs still running"""
+        tasks = [job.task for job in self._jobs.values()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.store.close()
+
+
+def build_job_manager_from_settings(settings):
+    """Build the App `JobManager` from the App `Settings`"""
+    return JobManager(
+        store=JobStore(path=settings.jobs_db_path or ":memory:", ttl=settings.jobs_ttl)
+    )
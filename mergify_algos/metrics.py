@@ -0,0 +1,308 @@
+import bisect
+import contextlib
+import contextvars
+import threading
+import time
+
+# Latency buckets, in seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _format_labels(labelnames, values, extra=()):
+    pairs = list(zip(labelnames, values)) + list(extra)
+    if not pairs:
+        return ""
+
+    def escape(value):
+        return str(value).replace("\\", r"\\").replace('"', r"\"").replace("\n", r"\n")
+
+    return "{" + ",".join(f'{name}="{escape(value)}"' for name, value in pairs) + "}"
+
+
+def _format_value(value):
+    return repr(float(value)) if value != float("inf") else "+Inf"
+
+
+class _Metric:
+    """Metric with labels, exposed in the Prometheus text format"""
+
+    type = None
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} labels must be {self.labelnames}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def get(self, **labels):
+        """Return the current value of the given labels (None if unset)"""
+        return self._values.get(self._key(labels))
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+    def _samples(self):
+        with self._lock:
+            return [
+                (self.name, _format_labels(self.labelnames, key), value)
+                for key, value in sorted(self._values.items())
+            ]
+
+    def render(self):
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type}",
+        ]
+        lines += [
+            f"{name}{labels} {_format_value(value)}"
+            for name, labels, value in self._samples()
+        ]
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    type = "gauge"
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class _HistogramValue:
+    def __init__(self, buckets_count):
+        self.buckets = [0] * buckets_count
+        self.count = 0
+        self.sum = 0.0
+
+
+class Histogram(_Metric):
+    """Cumulative histogram, with `_bucket`, `_count` and `_sum` samples"""
+
+    type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            histogram = self._values.get(key)
+            if histogram is None:
+                histogram = self._values[key] = _HistogramValue(len(self.buckets))
+            histogram.buckets[bisect.bisect_left(self.buckets, value)] += 1
+            histogram.count += 1
+            histogram.sum += value
+
+    def get(self, **labels):
+        """Return the (count, sum) of the given labels (None if unset)"""
+        histogram = self._values.get(self._key(labels))
+        return None if histogram is None else (histogram.count, histogram.sum)
+
+    def _samples(self):
+        samples = []
+        with self._lock:
+            for key, histogram in sorted(self._values.items()):
+                cumulated = 0
+                for bound, count in zip(self.buckets, histogram.buckets):
+                    cumulated += count
+                    labels = _format_labels(
+                        self.labelnames, key, [("le", _format_value(bound))]
+                    )
+                    samples.append((f"{self.name}_bucket", labels, cumulated))
+                labels = _format_labels(self.labelnames, key)
+                samples.append((f"{self.name}_count", labels, histogram.count))
+                samples.append((f"{self.name}_sum", labels, histogram.sum))
+        return samples
+
+
+class MetricsRegistry:
+    """Set of metrics, rendered together for the `/metrics` endpoint"""
+
+    def __init__(self):
+        self._metrics = {}
+
+    def _register(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def clear(self):
+        for metric in self._metrics.values():
+            metric.clear()
+
+    def render(self):
+        """Return the metrics in the Prometheus text exposition format"""
+        return "\n".join(metric.render() for metric in self._metrics.values()) + "\n"
+
+
+# -----------------------------------------------------------------------------
+# App metrics
+REGISTRY = MetricsRegistry()
+
+GITHUB_REQUEST_SECONDS = REGISTRY.histogram(
+    "github_request_duration_seconds",
+    "GitHub API requests latency (each attempt)",
+    ("endpoint", "status"),
+)
+GITHUB_PAGES = REGISTRY.counter(
+    "github_pages_total",
+    "GitHub pages fetched (from the network or a cache)",
+    ("endpoint",),
+)
+GITHUB_RETRIES = REGISTRY.counter(
+    "github_retries_total", "GitHub API requests retried", ("resource", "reason")
+)
+GITHUB_RATE_LIMIT_REMAINING = REGISTRY.gauge(
+    "github_rate_limit_remaining",
+    "GitHub rate limit budget left, per token and resource",
+    ("token", "resource"),
+)
+CACHE_LOOKUPS = REGISTRY.counter(
+    "cache_lookups_total", "Cache lookups, by cache and result", ("cache", "result")
+)
+AGGREGATION_SPILLED_BYTES = REGISTRY.counter(
+    "aggregation_spilled_bytes_total",
+    "Co-stars postings spilled to disk (see `CoStarCounter.memory_budget`)",
+)
+NEIGHBOURS_PHASE_SECONDS = REGISTRY.histogram(
+    "neighbours_phase_duration_seconds",
+    "Neighbours computation phases duration",
+    ("phase",),
+)
+
+
+# -----------------------------------------------------------------------------
+# Per API request timings (`Server-Timing` header)
+_request_timings = contextvars.ContextVar("request_timings", default=None)
+
+
+class RequestTimings:
+    """Phases and GitHub requests timings of one API request.
+
+    Set for the request context (see `request_timings`): asyncio tasks and
+    threads started by the request share it.
+    """
+
+    def __init__(self):
+        self.phases = {}
+        self.github_requests = 0
+        self.github_seconds = 0.0
+        self.started_at = time.perf_counter()
+
+    def add_phase(self, phase, seconds):
+        self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+
+    def add_github_request(self, seconds):
+        self.github_requests += 1
+        self.github_seconds += seconds
+
+    def server_timing(self):
+        """Return the `Server-Timing` header value (durations in ms)"""
+        metrics = [
+            f"{phase};dur={seconds * 1000:.1f}"
+            for phase, seconds in self.phases.items()
+        ]
+        if self.github_requests:
+            metrics.append(
+                f"github;dur={self.github_seconds * 1000:.1f};"
+                f'desc="{self.github_requests} requests"'
+            )
+        total = time.perf_counter() - self.started_at
+        metrics.append(f"total;dur={total * 1000:.1f}")
+        return ", ".join(metrics)
+
+
+@contextlib.contextmanager
+def request_timings():
+    """Collect the timings of the current API request (yield `RequestTimings`)"""
+    timings = RequestTimings()
+    reset_token = _request_timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _request_timings.reset(reset_token)
+
+
+def current_request_timings():
+    return _request_timings.get()
+
+
+class PhaseTimer:
+    """Accumulate the duration of a neighbours phase, over several blocks.
+
+    Usage::
+
+        transform = PhaseTimer("transform")
+        for user, starred_repos in ...:
+            with transform:
+                counter.add_user(user, starred_repos)
+        transform.record()
+    """
+
+    def __init__(self, phase: str):
+        self.phase = phase
+        self.seconds = 0.0
+        self._started_at = None
+
+    def __enter__(self):
+        self._started_at = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.seconds += time.perf_counter() - self._started_at
+
+    def record(self):
+        """Record the accumulated duration (histogram and `Server-Timing`)"""
+        NEIGHBOURS_PHASE_SECONDS.observe(self.seconds, phase=self.phase)
+        timings = current_request_timings()
+        if timings is not None:
+            timings.add_phase(self.phase, self.seconds)
+
+
+@contextlib.contextmanager
+def phase_timer(phase: str):
+    """Time one block of a neighbours phase"""
+    timer = PhaseTimer(phase)
+    try:
+        with timer:
+            yield timer
+    finally:
+        timer.record()
+
+
+def observe_github_request(endpoint: str, status, seconds: float):
+    """Record one GitHub request attempt"""
+    GITHUB_REQUEST_SECONDS.observe(seconds, endpoint=endpoint, status=status)
+    timings = current_request_timings()
+    if timings is not None:
+        timings.add_github_request(seconds)
@@ -0,0 +1,208 @@
+import asyncio
+import cProfile
+import functools
+import io
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+import uuid
+
+from fastapi import HTTPException
+
+# Event loop lags above this are reported as blocking, in seconds
+BLOCKING_THRESHOLD = 0.01
+# Only one profiled computation at a time: profilers are process / thread wide
+_profiling_lock = threading.Lock()
+
+
+class RequestProfiler:
+    """Opt-in profiler of one API request's computation.
+
+    - CPU: deterministic `cProfile` of the event loop thread, and of the
+    threads running wrapped callables (see `wrap`, e.g. sequential algorithms).
+    - Event loop blocking: a monitor task measures how late its wake-ups are,
+    anything synchronous in the async path (CPU bound aggregation, blocking
+    I/O) shows up as lag.
+    - Memory: allocations peak and top allocation sites (`tracemalloc`).
+
+    Profilers being process wide, profiled computations are exclusive (409
+    while another one runs) and other requests served meanwhile are included.
+
+    Usage::
+
+        async with profiler:
+            results = await ...
+        response["profile"] = profiler.report()
+    """
+
+    def __init__(
+        self,
+        enabled: bool = True,
+        top: int = 20,
+        monitor_interval: float = 0.005,
+        output_dir: str = None,
+    ):
+        """
+        :param enabled: When False, the profiler does nothing.
+        :param top: Number of functions and allocation sites reported.
+        :param monitor_interval: Event loop monitor wake-up interval, in seconds.
+        :param output_dir: [optional] Directory where the `pstats` dump is
+        stored (e.g. for `snakeviz`).
+        """
+        self.enabled = enabled
+        self.top = top
+        self.monitor_interval = monitor_interval
+        self.output_dir = output_dir
+
+        self._profiles = []
+        self._started_at = None
+        self._cpu_started_at = None
+        self._started_tracemalloc = False
+        self._monitor = None
+        self._lags = []
+        self._report = None
+
+    # ---
+    # Event loop monitoring
+    async def _monitor_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.monitor_interval)
+            self._lags.append(loop.time() - start - self.monitor_interval)
+
+    def _loop_report(self):
+        blocks = [lag for lag in self._lags if lag > BLOCKING_THRESHOLD]
+        return {
+            "max_lag_ms": max(self._lags, default=0.0) * 1000,
+            "blocked_ms": sum(blocks) * 1000,
+            "blocks": len(blocks),
+        }
+
+    # ---
+    # CPU profiles
+    def _start_profile(self):
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Python >= 3.12: a single (process wide) profiler can be active,
+            # the event loop one already sees all threads.
+            return None
+        self._profiles.append(profile)
+        return profile
+
+    def wrap(self, function):
+        """Return `function` profiled in the thread calling it"""
+        if not self.enabled:
+            return function
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            profile = self._start_profile()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                if profile is not None:
+                    profile.disable()
+
+        return wrapper
+
+    def _functions_report(self):
+        if not self._profiles:
+            return [], None
+
+        stats = pstats.Stats(self._profiles[0], stream=io.StringIO())
+        for profile in self._profiles[1:]:
+            stats.add(profile)
+
+        rows = []
+        for (filename, line, name), (_, calls, tottime, cumtime, _) in sorted(
+            stats.stats.items(), key=lambda item: item[1][3], reverse=True
+        )[: self.top]:
+            rows.append(
+                {
+                    "function": f"{filename}:{line}({name})",
+                    "calls": calls,
+                    "tottime": tottime,
+                    "cumtime": cumtime,
+                }
+            )
+
+        if self.output_dir:
+            path = os.path.join(self.output_dir, f"{uuid.uuid4().hex}.prof")
+            stats.dump_stats(path)
+            return rows, path
+        return rows, None
+
+    # ---
+    # Memory
+    def _memory_report(self):
+        _, peak = tracemalloc.get_traced_memory()
+        snapshot = tracemalloc.take_snapshot().filter_traces(
+            [
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"),
+            ]
+        )
+        return {
+            "peak_mib": peak / 2**20,
+            "top_allocations": [
+                {"site": str(stat.traceback), "size_kib": stat.size / 1024}
+                for stat in snapshot.statistics("lineno")[: self.top]
+            ],
+        }
+
+    # ---
+    # Context manager
+    async def __aenter__(self):
+        if not self.enabled:
+            return self
+
+        if not _profiling_lock.acquire(blocking=False):
+            raise HTTPException(
+                status_code=409, detail="Another request is being profiled"
+            )
+
+        if tracemalloc.is_tracing():
+            tracemalloc.reset_peak()
+        else:
+            tracemalloc.start()
+            self._started_tracemalloc = True
+        self._monitor = asyncio.ensure_future(self._monitor_loop())
+        self._started_at = time.perf_counter()
+        self._cpu_started_at = time.process_time()
+        self._start_profile()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        if not self.enabled:
+            return
+
+        try:
+            for profile in self._profiles:
+                profile.disable()
+            wall_seconds = time.perf_counter() - self._started_at
+            cpu_seconds = time.process_time() - self._cpu_started_at
+            self._monitor.cancel()
+            await asyncio.gather(self._monitor, return_exceptions=True)
+
+            functions, profile_path = self._functions_report()
+            self._report = {
+                "wall_seconds": wall_seconds,
+                "cpu_seconds": cpu_seconds,
+                "event_loop": self._loop_report(),
+                "memory": self._memory_report(),
+                "functions": functions,
+                "profile_path": profile_path,
+            }
+        finally:
+            if self._started_tracemalloc:
+                tracemalloc.stop()
+            _profiling_lock.release()
+
+    def report(self):
+        """Return the profile report, None when disabled"""
+        return self._report
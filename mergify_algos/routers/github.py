@@ -1,8 +1,48 @@
-from fastapi import APIRouter
+import asyncio
+import orjson
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import BaseModel, Field
+from typing import Annotated, List, Literal
 
 from mergify_algos import github
 from mergify_algos.config import settings
-from mergify_algos.utils import display_secret
+from mergify_algos.dependencies import (
+    get_aggregation_options,
+    get_github_cache,
+    get_github_graph_store,
+    get_github_options,
+    get_github_scheduler,
+    get_github_starred_cache,
+    get_job_manager,
+    get_neighbours_cache,
+    get_profiler,
+    get_ranking,
+)
+from mergify_algos.github.aggregation import Ranking
+from mergify_algos.github.cache import (
+    HTTPResponseCache,
+    SingleFlightTTLCache,
+    StaleWhileRevalidateCache,
+)
+from mergify_algos.github.graph import StarGraphStore
+from mergify_algos.github.scheduler import RequestScheduler
+from mergify_algos.jobs import JobManager
+from mergify_algos.profiling import RequestProfiler
+from mergify_algos.utils import display_secret, token_fingerprint
+
+
+class NeighboursJSONResponse(JSONResponse):
+    """JSON response serialized with orjson.
+
+    Returned as is by the neighbours endpoints: their (large) results skip
+    FastAPI's `jsonable_encoder` walk and the stdlib encoder.
+    """
+
+    def render(self, content) -> bytes:
+        return orjson.dumps(content)
 
 
 router = APIRouter(
@@ -13,20 +53,31 @@ router = APIRouter(
 )
 
 
-@router.get("/repos/{owner}/{repo}")
+@router.get("/repos/{owner}/{repo}", response_class=NeighboursJSONResponse)
 async def compute_starneighbours(
     owner: str,
     repo: str,
     limit_pages: int = 2,
-    threshold: int = 1,
+    threshold: int = Query(1, ge=1),
     use_async: bool = True,
+    backend: Literal["rest", "graphql"] = "rest",
+    approximate: bool = False,
+    sample_pages: int = Query(5, ge=1),
+    confidence: float = Query(0.95, gt=0, lt=1),
+    seed: int = None,
+    deadline_ms: int = Query(None, ge=1),
+    max_requests: int = Query(None, ge=1),
     gh_token: str = None,
+    github_options: dict = Depends(get_github_options),
+    aggregation_options: dict = Depends(get_aggregation_options),
+    neighbours_cache: StaleWhileRevalidateCache = Depends(get_neighbours_cache),
+    ranking: Ranking = Depends(get_ranking),
+    profiler: RequestProfiler = Depends(get_profiler),
 ):
     """Compute Star neighbours API. Using Github Rest API.
 
-    WARNING: Computation eventually take lots of time. Do we use a background task
-    and provide a different API to get the results when available ?
-    Which means we need a db to save requested computation and results.
+    WARNING: Computation eventually take lots of time. For large repositories,
+    use the jobs API (`POST /github/jobs`) to compute it in the background.
 
     :param owner: Github's repository owner
     :param repo: Github's repository name
@@ -34,13 +85,137 @@ async def compute_starneighbours(
     the results but speed up the process.
     :param use_async: True use async algorithm, False use sequential algorithm.
     :param threshold: Only return repository with more than 'n' common user
+    :param backend: Fetch stargazers' starred repositories with the "rest" API
+    (one request per user) or "graphql" API (batches of users per query).
+    :param approximate: Sample `sample_pages` random stargazers' pages instead
+    of the `limit_pages` first ones. Counts are scaled to the stargazers
+    GitHub lists (about 40,000 at most, see "algo-info" "sampling"), with
+    `confidence` level intervals. See `github.afind_approximate_neighbour_repos`.
+    :param sample_pages: Number of stargazers' pages sampled (approximate).
+    :param confidence: Confidence level of the intervals (approximate).
+    :param seed: Random seed, to reproduce a sample (approximate).
+    :param deadline_ms: Time allowed, in milliseconds: neighbours are ranked
+    from the stargazers fetched by then (see "algo-info" "coverage"). Requests
+    still pending at the deadline are given up.
+    :param max_requests: Maximum number of GitHub requests sent. With a
+    deadline or a requests budget, only the first starred repositories page of
+    each stargazer is fetched: more stargazers are covered, each with fewer
+    repositories.
     :param gh_token: Override App Github Token
+    :param neighbours_cache: Results of the recent computations (not for
+    `gh_token` nor profiled ones, nor partial results), stale ones are served
+    while being recomputed in the background. See "algo-info" "cache".
+    :param ranking: Top-K, pagination and stargazers lists options. See
+    `get_ranking`.
+    :param profiler: Computation profiler (`profile=true`), see `get_profiler`.
     :return: List of GitHub Repository
     """
-    # If no gh_token provided, try to use the App GitHub token from the settings
-    if gh_token is None:
-        gh_token = settings.github_token
+    # Pinned tokens may see private repositories: their results aren't shared
+    cacheable = neighbours_cache is not None and gh_token is None
+    github_options = _token_github_options(github_options, gh_token)
+    gh_token = _resolve_token(gh_token)
+
+    if approximate:
+        async with profiler:
+            results, sorted_results, sampling = (
+                await github.afind_approximate_neighbour_repos(
+                    owner=owner,
+                    repo=repo,
+                    token=gh_token,
+                    sample_pages=sample_pages,
+                    threshold=threshold,
+                    confidence=confidence,
+                    seed=seed,
+                    ranking=ranking,
+                    backend=backend,
+                    **github_options,
+                )
+            )
+        response = _build_starneighbours_response(
+            owner, repo, sorted_results, None, threshold, gh_token, True, ranking
+        )
+        response["algo-info"]["sampling"] = sampling
+        return _neighbours_response(response, profiler)
+
+    async def acompute():
+        return await _acompute_starneighbours(
+            owner=owner,
+            repo=repo,
+            gh_token=gh_token,
+            limit_pages=limit_pages,
+            threshold=threshold,
+            use_async=use_async,
+            backend=backend,
+            deadline_ms=deadline_ms,
+            max_requests=max_requests,
+            ranking=ranking,
+            github_options=github_options,
+            aggregation_options=aggregation_options,
+            profiler=profiler,
+        )
+
+    async with profiler:
+        if cacheable and not profiler.enabled:
+            key = _neighbours_cache_key(
+                owner,
+                repo,
+                limit_pages,
+                threshold,
+                backend,
+                deadline_ms,
+                max_requests,
+                ranking,
+            )
+            (sorted_results, coverage), cache_status = (
+                await neighbours_cache.aget_or_compute(
+                    key, acompute, cacheable=_is_complete_result
+                )
+            )
+        else:
+            (sorted_results, coverage), cache_status = await acompute(), None
+
+    response = _build_starneighbours_response(
+        owner,
+        repo,
+        sorted_results,
+        limit_pages,
+        threshold,
+        gh_token,
+        use_async,
+        ranking,
+    )
+    if deadline_ms is not None or max_requests is not None:
+        response["algo-info"]["budget"] = {
+            "deadline_ms": deadline_ms,
+            "max_requests": max_requests,
+        }
+        response["algo-info"]["coverage"] = coverage
+    response["algo-info"]["cache"] = cache_status
+    return _neighbours_response(response, profiler)
 
+
+async def _acompute_starneighbours(
+    owner,
+    repo,
+    gh_token,
+    limit_pages,
+    threshold,
+    use_async,
+    backend,
+    deadline_ms,
+    max_requests,
+    ranking,
+    github_options,
+    aggregation_options,
+    profiler,
+):
+    """Compute the neighbours, return (sorted results, stargazers coverage).
+
+    Coverage's `stargazers_complete`, `rate_limited` and `budget_exhausted`
+    tell partial results apart (see `_is_complete_result`). It's empty when
+    the results were read from the star graph store (complete).
+    """
+    coverage = {}
     if use_async:
         results, sorted_results = await github.afind_neighbour_repos(
             owner=owner,
@@ -48,16 +223,158 @@ async def compute_starneighbours(
             token=gh_token,
             limit_pages=limit_pages,
             threshold=threshold,
+            ranking=ranking,
+            backend=backend,
+            on_progress=coverage.update,
+            deadline_ms=deadline_ms,
+            max_requests=max_requests,
+            **github_options,
+            **aggregation_options,
         )
     else:
-        results, sorted_results = github.find_neighbour_repos(
+        # Sequential algorithm is blocking, keep it out of the event loop
+        results, sorted_results = await run_in_threadpool(
+            profiler.wrap(github.find_neighbour_repos),
             owner=owner,
             repo=repo,
             token=gh_token,
             limit_pages=limit_pages,
             threshold=threshold,
+            scheduler=github_options["scheduler"],
+            cache=github_options["cache"],
+            starred_cache=github_options["starred_cache"],
+            graph_store=github_options["graph_store"],
+            base_url=github_options["base_url"],
+            ranking=ranking,
+            backend=backend,
+            on_progress=coverage.update,
+            deadline_ms=deadline_ms,
+            max_requests=max_requests,
+            **aggregation_options,
         )
+    return sorted_results, coverage
+
+
+def _is_complete_result(result):
+    """Whether `_acompute_starneighbours` (sorted results, coverage) covers
+    all the stargazers. Partial results (deadline, requests budget or rate
+    limit) aren't cached: they would be served for the whole TTL.
+    """
+    _, coverage = result
+    return (
+        coverage.get("stargazers_complete", True)
+        and not coverage.get("rate_limited", False)
+        and not coverage.get("budget_exhausted", False)
+    )
+
+
+def _neighbours_cache_key(
+    owner, repo, limit_pages, threshold, backend, deadline_ms, max_requests, ranking
+):
+    """Neighbours results cache key. Results don't depend on the algorithm
+    (`use_async`), nor on the token (pinned tokens bypass the cache).
+    """
+    return (
+        f"{owner}/{repo}".lower(),
+        limit_pages,
+        threshold,
+        backend,
+        deadline_ms,
+        max_requests,
+        tuple(ranking.to_dict().items()),
+    )
+
+
+async def warm_up_neighbours_cache(
+    neighbours_cache: StaleWhileRevalidateCache,
+    repos: list,
+    github_options: dict,
+    aggregation_options: dict,
+    interval: float = None,
+):
+    """Compute the neighbours of `repos` ("owner/repo") into the
+    `neighbours_cache`, with the `compute_starneighbours` default parameters.
+
+    :param interval: [optional] Compute them again every `interval` seconds.
+    """
+    ranking = Ranking()
+    while True:
+        for full_name in repos:
+            owner, repo = full_name.split("/", 1)
+            key = _neighbours_cache_key(owner, repo, 2, 1, "rest", None, None, ranking)
+
+            def acompute(owner=owner, repo=repo):
+                return _acompute_starneighbours(
+                    owner=owner,
+                    repo=repo,
+                    gh_token=_resolve_token(None),
+                    limit_pages=2,
+                    threshold=1,
+                    use_async=True,
+                    backend="rest",
+                    deadline_ms=None,
+                    max_requests=None,
+                    ranking=ranking,
+                    github_options=github_options,
+                    aggregation_options=aggregation_options,
+                    profiler=RequestProfiler(enabled=False),
+                )
 
+            try:
+                await neighbours_cache.arefresh(
+                    key, acompute, cacheable=_is_complete_result
+                )
+            except Exception:
+                # e.g. unknown repository: the other ones are still computed
+                continue
+
+        if interval is None:
+            return
+        await asyncio.sleep(interval)
+
+
+def _token_github_options(github_options, gh_token):
+    """Return the GitHub options of a request pinning `gh_token` or not.
+
+    The star graph store is shared by all the requests: the stargazers and
+    starred repositories fetched with a caller's token (which may see private
+    repositories) are neither recorded there nor served from it.
+    """
+    if gh_token is None:
+        return github_options
+
+    return {**github_options, "graph_store": None}
+
+
+def _resolve_token(gh_token):
+    """Return the token pinned by the request, else the App GitHub token.
+
+    With a tokens pool (`github_tokens`), requests without `gh_token` aren't
+    pinned: the scheduler spreads them over the pool (None is returned).
+    """
+    if gh_token is not None or settings.github_tokens:
+        return gh_token
+
+    return settings.github_token
+
+
+def _neighbours_response(response, profiler):
+    """Return the neighbours response, with the profile report when profiled"""
+    if profiler.enabled:
+        response["profile"] = profiler.report()
+    return NeighboursJSONResponse(response)
+
+
+def _build_starneighbours_response(
+    owner,
+    repo,
+    sorted_results,
+    limit_pages,
+    threshold,
+    gh_token,
+    use_async=True,
+    ranking=None,
+):
     return {
         "algo-info": {
             "github-repo": f"{owner}/{repo}",
@@ -65,40 +382,398 @@ async def compute_starneighbours(
             "limit_pages": limit_pages,
             "threshold": threshold,
             "gh_token": display_secret(gh_token),
+            "ranking": (ranking or Ranking()).to_dict(),
         },
         "results": sorted_results,
     }
 
 
-@router.get("/repos/{owner}/{repo}/graphql")
+STREAM_MEDIA_TYPES = {"ndjson": "application/x-ndjson", "sse": "text/event-stream"}
+
+
+def _format_stream_event(event, stream_format):
+    if stream_format == "sse":
+        return f"event: {event['event']}\ndata: {orjson.dumps(event).decode()}\n\n"
+    return orjson.dumps(event).decode() + "\n"
+
+
+@router.get("/repos/{owner}/{repo}/stream")
+async def stream_starneighbours(
+    owner: str,
+    repo: str,
+    limit_pages: int = 2,
+    threshold: int = Query(1, ge=1),
+    top_n: int = Query(20, ge=1),
+    snapshot_interval: float = 1.0,
+    stream_format: Literal["ndjson", "sse"] = "ndjson",
+    backend: Literal["rest", "graphql"] = "rest",
+    deadline_ms: int = Query(None, ge=1),
+    max_requests: int = Query(None, ge=1),
+    gh_token: str = None,
+    github_options: dict = Depends(get_github_options),
+    aggregation_options: dict = Depends(get_aggregation_options),
+    ranking: Ranking = Depends(get_ranking),
+):
+    """Streaming Star neighbours API. Using Github Rest API.
+
+    Emit events while fetching: progress, periodically refreshed top `top_n`
+    neighbours snapshots, then the final result. See
+    `github.aiter_neighbour_repos`.
+
+    :param owner: Github's repository owner
+    :param repo: Github's repository name
+    :param limit_pages: Only Fetch 'n' page from GitHub paginated API.
+    :param threshold: Only return repository with more than 'n' common user
+    :param top_n: Number of neighbours in the snapshot events
+    :param snapshot_interval: Minimum seconds between two snapshot events
+    :param stream_format: "ndjson" (one JSON event per line) or "sse"
+    (Server-Sent Events)
+    :param backend: Stargazers' starred repositories backend, "rest" or
+    "graphql".
+    :param deadline_ms: Time allowed, in milliseconds, before the final result.
+    :param max_requests: Maximum number of GitHub requests sent. With a
+    deadline or a requests budget, only the first starred repositories page of
+    each stargazer is fetched (see `compute_starneighbours`).
+    :param gh_token: Override App Github Token
+    :param ranking: Final result's top-K, pagination and stargazers lists
+    options. See `get_ranking`.
+    :return: Stream of events
+    """
+    github_options = _token_github_options(github_options, gh_token)
+    gh_token = _resolve_token(gh_token)
+
+    events = github.aiter_neighbour_repos(
+        owner=owner,
+        repo=repo,
+        token=gh_token,
+        limit_pages=limit_pages,
+        threshold=threshold,
+        snapshot_size=top_n,
+        snapshot_interval=snapshot_interval,
+        ranking=ranking,
+        backend=backend,
+        deadline_ms=deadline_ms,
+        max_requests=max_requests,
+        **github_options,
+        **aggregation_options,
+    )
+
+    async def content():
+        async for event in events:
+            yield _format_stream_event(event, stream_format)
+
+    return StreamingResponse(content(), media_type=STREAM_MEDIA_TYPES[stream_format])
+
+
+@router.get("/repos/{owner}/{repo}/graphql", response_class=NeighboursJSONResponse)
 async def graphql_starneighbours(
-    owner: str, repo: str, threshold: int = 1, gh_token: str = None
+    owner: str,
+    repo: str,
+    limit_pages: int = 2,
+    threshold: int = Query(1, ge=1),
+    use_async: bool = True,
+    gh_token: str = None,
+    github_options: dict = Depends(get_github_options),
+    ranking: Ranking = Depends(get_ranking),
+    profiler: RequestProfiler = Depends(get_profiler),
 ):
     """Compute Star neighbours API. Using GitHub GraphQL API.
 
-    Testing GitHub GraphQL API to speed-up process.
-    Still a Work-In-Progress, on large scale repository, we reach errors.
+    Stargazers and their starred repositories are crawled with GraphQL
+    cursors, page sizes being adapted to GitHub node limits and errors.
 
     :param owner: Github's repository owner
     :param repo: Github's repository name
+    :param limit_pages: Only Fetch 'n' pages of 100 stargazers / starred
+    repositories.
     :param threshold: Only return repository with more than 'n' common user
+    :param use_async: True use async algorithm, False use sequential algorithm.
     :param gh_token: Override App Github Token
+    :param ranking: Top-K, pagination and stargazers lists options. See
+    `get_ranking`.
+    :param profiler: Computation profiler (`profile=true`), see `get_profiler`.
     :return: List of GitHub Repository
     """
-    # If no gh_token provided, try to use the App GitHub token from the settings
-    if gh_token is None:
-        gh_token = settings.github_token
+    gh_token = _resolve_token(gh_token)
 
-    results, sorted_results = github.find_graphql_neighbour_repos(
-        owner=owner, repo=repo, token=gh_token, threshold=threshold
+    async with profiler:
+        if use_async:
+            results, sorted_results = await github.afind_graphql_neighbour_repos(
+                owner=owner,
+                repo=repo,
+                token=gh_token,
+                limit_pages=limit_pages,
+                threshold=threshold,
+                http_client=github_options["http_client"],
+                max_concurrency=github_options["max_concurrency"],
+                scheduler=github_options["scheduler"],
+                base_url=github_options["base_url"],
+                ranking=ranking,
+            )
+        else:
+            results, sorted_results = await run_in_threadpool(
+                profiler.wrap(github.find_graphql_neighbour_repos),
+                owner=owner,
+                repo=repo,
+                token=gh_token,
+                limit_pages=limit_pages,
+                threshold=threshold,
+                scheduler=github_options["scheduler"],
+                base_url=github_options["base_url"],
+                ranking=ranking,
+            )
+
+    response = _build_starneighbours_response(
+        owner,
+        repo,
+        sorted_results,
+        limit_pages,
+        threshold,
+        gh_token,
+        use_async,
+        ranking,
     )
+    return _neighbours_response(response, profiler)
+
 
+@router.post("/repos/{owner}/{repo}/refresh", response_class=NeighboursJSONResponse)
+async def refresh_starneighbours(
+    owner: str,
+    repo: str,
+    threshold: int = Query(1, ge=1),
+    max_pages: int = Query(10, ge=1),
+    backend: Literal["rest", "graphql"] = "rest",
+    gh_token: str = None,
+    github_options: dict = Depends(get_github_options),
+    ranking: Ranking = Depends(get_ranking),
+    profiler: RequestProfiler = Depends(get_profiler),
+):
+    """Incrementally refresh Star neighbours, from the local star graph.
+
+    Only the stargazers starred since the previous refresh, and their starred
+    repositories, are fetched. Requires the star graph store
+    (`GITHUB_GRAPH_PATH`). See `github.arefresh_neighbour_repos`.
+
+    :param owner: Github's repository owner
+    :param repo: Github's repository name
+    :param threshold: Only return repository with more than 'n' common user
+    :param max_pages: Maximum number of new stargazers' pages fetched.
+    :param backend: Stargazers' starred repositories backend, "rest" or
+    "graphql".
+    :param gh_token: Override App Github Token
+    :param ranking: Top-K, pagination and stargazers lists options. See
+    `get_ranking`.
+    :param profiler: Computation profiler (`profile=true`), see `get_profiler`.
+    :return: List of GitHub Repository
+    """
+    github_options = _token_github_options(github_options, gh_token)
+    if github_options["graph_store"] is None:
+        raise HTTPException(
+            status_code=400,
+            detail="Incremental refresh requires the star graph store "
+            "(GITHUB_GRAPH_PATH), not available with `gh_token`",
+        )
+
+    gh_token = _resolve_token(gh_token)
+
+    async with profiler:
+        results, sorted_results, refresh = await github.arefresh_neighbour_repos(
+            owner=owner,
+            repo=repo,
+            token=gh_token,
+            threshold=threshold,
+            max_pages=max_pages,
+            ranking=ranking,
+            backend=backend,
+            **github_options,
+        )
+    response = _build_starneighbours_response(
+        owner, repo, sorted_results, None, threshold, gh_token, True, ranking
+    )
+    response["algo-info"]["refresh"] = refresh
+    return _neighbours_response(response, profiler)
+
+
+@router.get("/tokens/stats")
+async def tokens_stats(scheduler: RequestScheduler = Depends(get_github_scheduler)):
+    """GitHub tokens pool usage: requests sent and rate limit budgets per token"""
+    return {"tokens": scheduler.tokens_stats() if scheduler else []}
+
+
+@router.get("/cache/stats")
+async def cache_stats(
+    cache: HTTPResponseCache = Depends(get_github_cache),
+    starred_cache: SingleFlightTTLCache = Depends(get_github_starred_cache),
+    graph_store: StarGraphStore = Depends(get_github_graph_store),
+    neighbours_cache: StaleWhileRevalidateCache = Depends(get_neighbours_cache),
+):
+    """GitHub caches statistics (hits, misses, evictions...)"""
     return {
+        "http_responses": cache.stats() if cache else None,
+        "starred_repos": starred_cache.stats() if starred_cache else None,
+        "star_graph": graph_store.stats() if graph_store else None,
+        "neighbours": (
+            neighbours_cache.stats() if neighbours_cache is not None else None
+        ),
+    }
+
+
+# -----------------------------------------------------------------------------
+# Batch API: neighbours of several repositories sharing their users' fetches
+BATCH_MAX_REPOS = 100
+
+
+class StarNeighboursBatch(BaseModel):
+    repos: List[Annotated[str, Field(pattern=r"^[^/]+/[^/]+$")]] = Field(
+        min_length=1, max_length=BATCH_MAX_REPOS
+    )
+    limit_pages: int = 2
+    threshold: int = Field(1, ge=1)
+    top_k: int = Field(None, ge=1)
+    offset: int = Field(0, ge=0)
+    limit: int = Field(None, ge=1)
+    include_stargazers: Literal["all", "sample", "none"] = "all"
+    stargazers_sample: int = Field(10, ge=0)
+    backend: Literal["rest", "graphql"] = "rest"
+    gh_token: str = None
+
+
+@router.post("/repos/neighbours:batch", response_class=NeighboursJSONResponse)
+async def batch_starneighbours(
+    batch_request: StarNeighboursBatch,
+    github_options: dict = Depends(get_github_options),
+    aggregation_options: dict = Depends(get_aggregation_options),
+    profiler: RequestProfiler = Depends(get_profiler),
+):
+    """Compute the Star neighbours of several repositories (e.g. an org's
+    ones). Using Github Rest API.
+
+    Stargazers shared by the repositories have their starred repositories
+    fetched once. See `github.afind_batch_neighbour_repos`.
+
+    :param profiler: Computation profiler (`profile=true`), see `get_profiler`.
+    :return: Neighbours per repository ("owner/repo"), and the shared fetches
+    statistics ("algo-info" "batch")
+    """
+    github_options = _token_github_options(github_options, batch_request.gh_token)
+    gh_token = _resolve_token(batch_request.gh_token)
+    ranking = Ranking(
+        top_k=batch_request.top_k,
+        offset=batch_request.offset,
+        limit=batch_request.limit,
+        include_stargazers=batch_request.include_stargazers,
+        stargazers_sample=batch_request.stargazers_sample,
+    )
+
+    async with profiler:
+        results, batch = await github.afind_batch_neighbour_repos(
+            repos=batch_request.repos,
+            token=gh_token,
+            limit_pages=batch_request.limit_pages,
+            threshold=batch_request.threshold,
+            ranking=ranking,
+            backend=batch_request.backend,
+            aggregation_executor=aggregation_options["aggregation_executor"],
+            aggregation_shards=aggregation_options["aggregation_shards"],
+            **github_options,
+        )
+
+    response = {
         "algo-info": {
-            "github-repo": f"{owner}/{repo}",
-            "limit_pages": 1,
-            "threshold": threshold,
+            "github-repos": list(results),
+            "limit_pages": batch_request.limit_pages,
+            "threshold": batch_request.threshold,
             "gh_token": display_secret(gh_token),
+            "ranking": ranking.to_dict(),
+            "batch": batch,
         },
-        "results": sorted_results,
+        "results": results,
     }
+    return _neighbours_response(response, profiler)
+
+
+# -----------------------------------------------------------------------------
+# Jobs API: long-running computations run in the background
+class StarNeighboursJob(BaseModel):
+    owner: str
+    repo: str
+    limit_pages: int = 2
+    threshold: int = Field(1, ge=1)
+    top_k: int = Field(None, ge=1)
+    offset: int = Field(0, ge=0)
+    limit: int = Field(None, ge=1)
+    include_stargazers: Literal["all", "sample", "none"] = "all"
+    stargazers_sample: int = Field(10, ge=0)
+    backend: Literal["rest", "graphql"] = "rest"
+    gh_token: str = None
+
+
+@router.post("/jobs", status_code=202)
+async def create_starneighbours_job(
+    job_request: StarNeighboursJob,
+    github_options: dict = Depends(get_github_options),
+    aggregation_options: dict = Depends(get_aggregation_options),
+    job_manager: JobManager = Depends(get_job_manager),
+):
+    """Enqueue a Star neighbours computation. Using Github Rest API.
+
+    Identical in-flight computations (same repository and parameters) are
+    deduplicated. Poll `GET /github/jobs/{job_id}` to get the result.
+
+    :return: Job id and status
+    """
+    github_options = _token_github_options(github_options, job_request.gh_token)
+    gh_token = _resolve_token(job_request.gh_token)
+    params = job_request.model_dump(exclude={"gh_token"})
+    ranking = Ranking(
+        top_k=job_request.top_k,
+        offset=job_request.offset,
+        limit=job_request.limit,
+        include_stargazers=job_request.include_stargazers,
+        stargazers_sample=job_request.stargazers_sample,
+    )
+
+    async def run(job):
+        results, sorted_results = await github.afind_neighbour_repos(
+            owner=job_request.owner,
+            repo=job_request.repo,
+            token=gh_token,
+            limit_pages=job_request.limit_pages,
+            threshold=job_request.threshold,
+            ranking=ranking,
+            backend=job_request.backend,
+            on_progress=job.update_progress,
+            **github_options,
+            **aggregation_options,
+        )
+        return _build_starneighbours_response(
+            job_request.owner,
+            job_request.repo,
+            sorted_results,
+            job_request.limit_pages,
+            job_request.threshold,
+            gh_token,
+            ranking=ranking,
+        )
+
+    key = "starneighbours:" + ":".join(f"{k}={v}" for k, v in sorted(params.items()))
+    # Jobs computed with a caller's token are only shared with the same token
+    key += f":token={token_fingerprint(job_request.gh_token)}"
+    job = job_manager.submit(key, params, run)
+    return {"job_id": job.id, "status": job.status}
+
+
+@router.get("/jobs/{job_id}", response_class=NeighboursJSONResponse)
+async def get_starneighbours_job(
+    job_id: str, job_manager: JobManager = Depends(get_job_manager)
+):
+    """Get a Star neighbours computation status, progress and result.
+
+    :param job_id: Job id returned by `POST /github/jobs`
+    :return: Job status, progress (stargazers processed / total) and result
+    """
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found or expired")
+
+    return NeighboursJSONResponse(job)
@@ -1,6 +1,12 @@
+import hashlib
+
+
 # blong: I'm sure it exists a way better implementation somewhere inside python.
 def display_secret(string: str):
     """Display only part of a secret string"""
+    if string is None:
+        return None
+
     if len(string) > 15:
         index = 5
     elif len(string) > 10:
@@ -11,3 +17,14 @@ def display_secret(string: str):
         return "***"
 
     return f"{string[:index]}***{string[-index:]}"
+
+
+def token_fingerprint(token: str):
+    """Short hash of a GitHub token, keying what it fetched: a token may see
+    private repositories, its results mustn't be served to other tokens.
+    Empty for None (App tokens pool).
+    """
+    if token is None:
+        return ""
+
+    return hashlib.sha256(token.encode()).hexdigest()[:16]
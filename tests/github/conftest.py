@@ -1,9 +1,202 @@
+import datetime
+import httpx
+import json
 import pytest
 
 from mergify_algos.github import clients
 from mergify_algos.config import settings
 
 
+# ---------------------------------------------------------------------------------------------------------------------
+# Offline GitHub API helpers
+def build_github_mock_handler(routes, calls=None, max_nodes=None):
+    """Build a `httpx.MockTransport` handler serving paginated GitHub data.
+
+    GraphQL queries (`POST /graphql`) are answered from the same data, see
+    `build_graphql_mock_handler`.
+
+    :param routes: dict {url path: [page1_items, page2_items, ...]}
+    :param calls: [optional] list where each requested url is appended.
+    :param max_nodes: [optional] GraphQL node limit, see
+    `build_graphql_mock_handler`.
+    """
+    graphql_handler = build_graphql_mock_handler(routes, max_nodes=max_nodes)
+
+    def handler(request):
+        if calls is not None:
+            calls.append(str(request.url))
+
+        if request.url.path == "/graphql":
+            return graphql_handler(request)
+
+        pages = routes.get(request.url.path)
+        if pages is None:
+            return httpx.Response(404, json={"message": "Not Found"})
+
+        page = int(request.url.params.get("page", 1))
+        headers = {}
+        if page < len(pages):
+            next_url = request.url.copy_set_param("page", page + 1)
+            last_url = request.url.copy_set_param("page", len(pages))
+            headers["link"] = f'<{next_url}>; rel="next", <{last_url}>; rel="last"'
+
+        items = pages[page - 1]
+        if request.headers.get("accept") == clients.GITHUB_STAR_MEDIA_TYPE:
+            offset = sum(len(items) for items in pages[: page - 1])
+            items = [_star_item(item, offset + i) for i, item in enumerate(items)]
+
+        return httpx.Response(200, json=items, headers=headers)
+
+    return handler
+
+
+def _star_item(item, position):
+    """`star+json` stargazer item. Stargazers without `starred_at` starred
+    the repository one minute apart, in order.
+    """
+    starred_at = item.get("starred_at")
+    if starred_at is None:
+        starred_at = (
+            datetime.datetime(2020, 1, 1) + datetime.timedelta(minutes=position)
+        ).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+    return {"starred_at": starred_at, "user": {"login": item["login"]}}
+
+
+def _graphql_connection(items, first, after, build_node):
+    start = int(after) if after else 0
+    end = min(start + first, len(items))
+    return {
+        "nodes": [build_node(item) for item in items[start:end]],
+        "pageInfo": {"endCursor": str(end), "hasNextPage": end < len(items)},
+    }
+
+
+def _graphql_query_nodes(variables):
+    """Number of nodes requested by a `GitHubGraphQLClient` query"""
+    if "starredFirst" in variables:
+        return variables["first"] * (1 + variables["starredFirst"])
+    if "login0" in variables:
+        users = sum(1 for name in variables if name.startswith("login"))
+        return users * (1 + variables["first"])
+    return variables["first"]
+
+
+def _routes_star_graph(routes):
+    """Return ({"owner/name": ["logins"]}, {"login": ["repos"]}) from routes"""
+    stargazers, starred = {}, {}
+    for path, pages in routes.items():
+        items = [item for page in pages for item in page]
+        parts = path.strip("/").split("/")
+        if parts[0] == "repos" and parts[-1] == "stargazers":
+            stargazers[f"{parts[1]}/{parts[2]}"] = [user["login"] for user in items]
+        elif parts[0] == "users" and parts[-1] == "starred":
+            starred[parts[1]] = [_repo["full_name"] for _repo in items]
+
+    return stargazers, starred
+
+
+def _graphql_users_batch(variables, starred):
+    """Body answering a users' batch query, unknown logins being NOT_FOUND"""
+    data, errors, i = {}, [], 0
+    while f"login{i}" in variables:
+        login = variables[f"login{i}"]
+        if login not in starred:
+            data[f"u{i}"] = None
+            errors.append({"type": "NOT_FOUND", "path": [f"u{i}"]})
+        else:
+            data[f"u{i}"] = {
+                "starredRepositories": _graphql_connection(
+                    starred[login],
+                    variables["first"],
+                    variables[f"after{i}"],
+                    lambda name: {"nameWithOwner": name},
+                )
+            }
+        i += 1
+    return {"data": data, "errors": errors} if errors else {"data": data}
+
+
+def build_graphql_mock_handler(routes, max_nodes=None):
+    """Build a handler answering the `GitHubGraphQLClient` queries, from the
+    Rest API `routes` (see `build_github_mock_handler`).
+
+    :param routes: dict {url path: [page1_items, page2_items, ...]}
+    :param max_nodes: [optional] Answer a node limit error to queries
+    requesting more nodes.
+    """
+    stargazers, starred = _routes_star_graph(routes)
+
+    def repo_node(name):
+        return {"nameWithOwner": name}
+
+    def handler(request):
+        variables = json.loads(request.content)["variables"]
+        first, after = variables["first"], variables.get("after")
+
+        if max_nodes is not None and _graphql_query_nodes(variables) > max_nodes:
+            error = {"type": "MAX_NODE_LIMIT_EXCEEDED", "message": "Too many nodes"}
+            return httpx.Response(200, json={"errors": [error]})
+
+        if "login0" in variables:
+            return httpx.Response(200, json=_graphql_users_batch(variables, starred))
+
+        if "login" in variables:
+            starred_repos = starred.get(variables["login"], [])
+            connection = _graphql_connection(starred_repos, first, after, repo_node)
+            return httpx.Response(
+                200, json={"data": {"user": {"starredRepositories": connection}}}
+            )
+
+        full_name = f"{variables['owner']}/{variables['name']}"
+        if full_name not in stargazers:
+            error = {"type": "NOT_FOUND", "message": "Could not resolve repository"}
+            return httpx.Response(
+                200, json={"data": {"repository": None}, "errors": [error]}
+            )
+
+        def user_node(login):
+            return {
+                "login": login,
+                "starredRepositories": _graphql_connection(
+                    starred.get(login, []), variables["starredFirst"], None, repo_node
+                ),
+            }
+
+        connection = _graphql_connection(stargazers[full_name], first, after, user_node)
+        return httpx.Response(
+            200, json={"data": {"repository": {"stargazers": connection}}}
+        )
+
+    return handler
+
+
+def build_github_mock_get(routes, calls=None):
+    """Build a `requests.get` replacement answering from `routes`"""
+    handler = build_github_mock_handler(routes, calls=calls)
+
+    def get(url, headers=None, timeout=None):
+        return handler(httpx.Request("GET", url, headers=headers))
+
+    return get
+
+
+def build_graphql_mock_post(routes, max_nodes=None):
+    """Build a `requests.post` replacement answering GraphQL queries"""
+    handler = build_graphql_mock_handler(routes, max_nodes=max_nodes)
+
+    def post(url, headers=None, json=None, timeout=None):
+        return handler(httpx.Request("POST", url, headers=headers, json=json))
+
+    return post
+
+
+def build_github_mock_client(routes, calls=None, max_nodes=None):
+    """Build an `httpx.AsyncClient` answering from `routes` (see handler)"""
+    handler = build_github_mock_handler(routes, calls=calls, max_nodes=max_nodes)
+    return httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+
 # ---------------------------------------------------------------------------------------------------------------------
 # Fixtures
 # blong: Duplicated from test_client.py and conftest.py. But otherwise,
@@ -0,0 +1,182 @@
+import concurrent.futures
+import pytest
+import random
+
+from mergify_algos.github.aggregation import CoStarCounter, Ranking
+from mergify_algos.github.neighbours import (
+    _compute_and_order_neighbours,
+    _transform_user_starred_repositories,
+)
+
+USER_REPO_DICT = {
+    "user1": ["repo1", "repo2", "repo5"],
+    "user2": ["repo2", "repo3"],
+    "user3": ["repo2", "repo3", "repo4"],
+    "user4": ["repo1", "repo4"],
+}
+
+
+def test_co_star_counter():
+    counter = CoStarCounter.from_user_repo_map(USER_REPO_DICT, exclude_repos=["repo5"])
+    results, sorted_results = counter.compute(users_threshold=2)
+
+    assert counter.users_count == 4
+    assert counter.repos_count == 4
+    assert sorted_results == [
+        {
+            "repo": "repo2",
+            "stargazers_count": 3,
+            "stargazers": ["user1", "user2", "user3"],
+        },
+        {"repo": "repo1", "stargazers_count": 2, "stargazers": ["user1", "user4"]},
+        {"repo": "repo3", "stargazers_count": 2, "stargazers": ["user2", "user3"]},
+        {"repo": "repo4", "stargazers_count": 2, "stargazers": ["user3", "user4"]},
+    ]
+    assert counter.snapshot(size=2, users_threshold=2) == [
+        {"repo": "repo2", "stargazers_count": 3},
+        {"repo": "repo1", "stargazers_count": 2},
+    ]
+    assert counter.snapshot(size=0, users_threshold=1) == []
+
+
+def test_co_star_counter_empty():
+    assert CoStarCounter().compute() == ([], [])
+
+
+@pytest.mark.parametrize(
+    "ranking",
+    [
+        Ranking(top_k=3),
+        Ranking(limit=2),
+        Ranking(offset=1, limit=2),
+        Ranking(top_k=3, offset=2, limit=10),
+        Ranking(offset=3),
+        Ranking(top_k=100),
+    ],
+)
+def test_co_star_counter_ranking_page(ranking):
+    counter = CoStarCounter.from_user_repo_map(USER_REPO_DICT, exclude_repos=["repo5"])
+    _, all_results = counter.compute(users_threshold=1)
+    results, sorted_results = counter.compute(users_threshold=1, ranking=ranking)
+
+    end = ranking.offset + ranking.limit if ranking.limit is not None else None
+    expected_results = all_results[: ranking.top_k][ranking.offset : end]
+    assert sorted_results == expected_results
+
+
+def test_co_star_counter_ranking_stargazers():
+    counter = CoStarCounter.from_user_repo_map(USER_REPO_DICT)
+
+    _, sorted_results = counter.compute(
+        ranking=Ranking(top_k=2, include_stargazers="none")
+    )
+    assert sorted_results == [
+        {"repo": "repo2", "stargazers_count": 3},
+        {"repo": "repo1", "stargazers_count": 2},
+    ]
+
+    _, sorted_results = counter.compute(
+        ranking=Ranking(limit=1, include_stargazers="sample", stargazers_sample=2)
+    )
+    assert sorted_results == [
+        {"repo": "repo2", "stargazers_count": 3, "stargazers": ["user1", "user2"]}
+    ]
+
+    with pytest.raises(ValueError):
+        Ranking(include_stargazers="some")
+
+
+def test_co_star_counter_subset():
+    counter = CoStarCounter.from_user_repo_map(USER_REPO_DICT)
+    subset = counter.subset(["user4", "unknown", "user1", "user3"], ["repo5"])
+
+    expected = CoStarCounter.from_user_repo_map(
+        {user: USER_REPO_DICT[user] for user in ("user4", "user1", "user3")},
+        exclude_repos=["repo5"],
+    )
+    assert subset.users_count == 3
+    assert subset.compute(1)[1] == expected.compute(1)[1]
+    # Repositories only starred by the left out users have no co-stars
+    assert subset.compute(0)[1] == expected.compute(1)[1]
+
+
+@pytest.mark.parametrize("threshold", [1, 2, 5])
+def test_co_star_counter_matches_reference(threshold):
+    rng = random.Random(42)
+    repos = [f"owner/repo{i}" for i in range(300)]
+    user_repo_map = {
+        f"user{u}": rng.sample(repos, rng.randint(0, 60)) for u in range(200)
+    }
+
+    counter = CoStarCounter.from_user_repo_map(user_repo_map, ["owner/repo0"])
+    _, sorted_results = counter.compute(users_threshold=threshold)
+    _, top_results = counter.compute(threshold, Ranking(top_k=25, offset=5))
+
+    repo_user_map = _transform_user_starred_repositories(
+        user_repo_map, exclude_repos=["owner/repo0"]
+    )
+    _, expected_results = _compute_and_order_neighbours(repo_user_map, threshold)
+
+    assert sorted_results == expected_results
+    assert top_results == expected_results[5:25]
+
+
+@pytest.mark.parametrize(
+    "ranking",
+    [None, Ranking(top_k=10, offset=2), Ranking(include_stargazers="sample")],
+)
+def test_co_star_counter_spill(tmp_path, ranking):
+    rng = random.Random(42)
+    repos = [f"owner/repo{i}" for i in range(300)]
+    user_repo_map = {
+        f"user{u}": rng.sample(repos, rng.randint(0, 60)) for u in range(200)
+    }
+    _, expected_results = CoStarCounter.from_user_repo_map(user_repo_map).compute(
+        ranking=ranking
+    )
+
+    counter = CoStarCounter(memory_budget=8192, spill_dir=tmp_path, partitions=4)
+    with counter:
+        for user, starred_repos in user_repo_map.items():
+            counter.add_user(user, starred_repos)
+        _, sorted_results = counter.compute(ranking=ranking)
+
+        assert 0 < counter.spilled_edges < sum(map(len, user_repo_map.values()))
+        assert len(list(tmp_path.glob("costars-*/*.postings"))) == 4
+
+    assert sorted_results == expected_results
+    assert list(tmp_path.iterdir()) == []
+
+
+@pytest.fixture(scope="module")
+def process_pool():
+    with concurrent.futures.ProcessPoolExecutor(max_workers=2) as executor:
+        yield executor
+
+
+@pytest.mark.parametrize(
+    "ranking",
+    [
+        None,
+        Ranking(top_k=10, offset=2),
+        Ranking(limit=7, include_stargazers="none"),
+        Ranking(include_stargazers="sample", stargazers_sample=3),
+    ],
+)
+@pytest.mark.parametrize("shards", [1, 3])
+@pytest.mark.parametrize("memory_budget", [None, 8192])
+def test_co_star_counter_compute_sharded(
+    process_pool, tmp_path, ranking, shards, memory_budget
+):
+    rng = random.Random(42)
+    repos = [f"owner/repo{i}" for i in range(300)]
+    user_repo_map = {
+        f"user{u}": rng.sample(repos, rng.randint(0, 60)) for u in range(200)
+    }
+
+    with CoStarCounter(memory_budget=memory_budget, spill_dir=tmp_path) as counter:
+        for user, starred_repos in user_repo_map.items():
+            counter.add_user(user, starred_repos)
+
+        expected = counter.compute(users_threshold=3, ranking=ranking)
+        assert counter.compute_sharded(process_pool, shards, 3, ranking) == expected
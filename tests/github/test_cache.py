@@ -0,0 +1,368 @@
+import asyncio
+import httpx
+import pytest
+import threading
+import time
+
+from mergify_algos.github import clients
+from mergify_algos.github.cache import (
+    HTTPResponseCache,
+    SingleFlightTTLCache,
+    StaleWhileRevalidateCache,
+    get_endpoint_type,
+)
+from mergify_algos.github.scheduler import BudgetExhausted
+from tests.github.conftest import build_github_mock_client, build_github_mock_get
+
+
+def build_etag_client(calls):
+    """Serve one starred repository with an ETag, answer 304 when matching"""
+
+    def handler(request):
+        calls.append(request.headers.get("if-none-match"))
+        if request.headers.get("if-none-match") == '"v1"':
+            return httpx.Response(304)
+        return httpx.Response(
+            200, json=[{"full_name": "a/repo1"}], headers={"etag": '"v1"'}
+        )
+
+    return httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+
+@pytest.mark.parametrize(
+    "url,expected_type",
+    [
+        ("https://api.github.com/repos/octo/repo/stargazers?page=2", "stargazers"),
+        ("https://api.github.com/users/octocat/starred?per_page=100", "starred"),
+        ("https://api.github.com/repos/octo/repo", "repository"),
+        ("https://api.github.com/rate_limit", "default"),
+    ],
+)
+def test_get_endpoint_type(url, expected_type):
+    assert get_endpoint_type(url) == expected_type
+
+
+@pytest.mark.parametrize(
+    "ttl,expected_calls",
+    [
+        # Fresh entry is served without any request
+        (3600, [None]),
+        # Stale entry is revalidated
+        (0, [None, '"v1"']),
+    ],
+)
+@pytest.mark.asyncio
+async def test_http_response_cache(ttl, expected_calls, tmp_path):
+    calls = []
+    cache = HTTPResponseCache(path=str(tmp_path / "cache.db"), ttls={"starred": ttl})
+
+    async with build_etag_client(calls) as http_client:
+        client = clients.GitHubRestClient(http_client=http_client, cache=cache)
+        response = await client.afetch_user_starred_repos(user="octocat")
+        response_bis = await client.afetch_user_starred_repos(user="octocat")
+
+    assert response == response_bis == ["a/repo1"]
+    assert calls == expected_calls
+
+    stats = cache.stats()
+    assert stats["entries"] == 1
+    assert stats["hits"] == (1 if ttl else 0)
+    assert stats["revalidations"] == (0 if ttl else 1)
+
+
+@pytest.mark.asyncio
+async def test_http_response_cache_per_token():
+    calls = []
+    cache = HTTPResponseCache()
+
+    async with build_etag_client(calls) as http_client:
+        for token in ("private-token", None, "private-token"):
+            client = clients.GitHubRestClient(
+                token=token, http_client=http_client, cache=cache
+            )
+            await client.afetch_user_starred_repos(user="octocat")
+
+    # A token's responses are only served to the same token
+    assert calls == [None, None]
+    assert cache.stats()["entries"] == 2
+
+
+def test_http_response_cache_persistence_and_eviction(tmp_path):
+    path = str(tmp_path / "cache.db")
+    response = httpx.Response(200, json=[], headers={"x-ratelimit-remaining": "1"})
+
+    cache = HTTPResponseCache(path=path, max_entries=2)
+    for key in ("key1", "key2", "key3"):
+        cache.put(key, response)
+    cache.close()
+
+    cache = HTTPResponseCache(path=path, max_entries=2)
+    assert cache.get("key1") is None
+    entry = cache.get("key3")
+    assert entry.body == b"[]"
+    # Rate limit headers aren't replayed from the cache
+    assert "x-ratelimit-remaining" not in entry.to_response().headers
+    assert cache.stats()["entries"] == 2
+
+
+def test_http_response_cache_lru_without_lookup_writes(tmp_path):
+    path = str(tmp_path / "cache.db")
+    response = httpx.Response(200, json=[])
+
+    cache = HTTPResponseCache(path=path, max_entries=2)
+    for key in ("key1", "key2"):
+        cache.put(key, response)
+    # Lookups don't write: access times are written with the next response
+    changes = cache._connection.total_changes
+    assert cache.get("key1") is not None
+    assert cache._connection.total_changes == changes
+
+    cache.put("key3", response)
+    assert cache.get("key2") is None
+    assert cache.get("key1") is not None
+    assert cache.stats()["entries"] == 2
+    assert cache.stats()["evictions"] == 1
+
+
+def test_single_flight_ttl_cache_lru_and_ttl():
+    cache = SingleFlightTTLCache(max_entries=2, ttl=3600)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    # "b" is the least recently used entry
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+
+    cache.ttl = 0
+    cache.set("d", 4)
+    assert cache.get("d") is None
+
+    stats = cache.stats()
+    assert stats["evictions"] == 2
+    assert stats["expirations"] == 1
+
+
+@pytest.mark.asyncio
+async def test_single_flight_ttl_cache_async_coalescing():
+    cache = SingleFlightTTLCache()
+    calls = []
+
+    async def afetch():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return ["a/repo1"]
+
+    results = await asyncio.gather(
+        *(cache.aget_or_fetch("user", afetch) for _ in range(5))
+    )
+    assert results == [["a/repo1"]] * 5
+    assert await cache.aget_or_fetch("user", afetch) == ["a/repo1"]
+    assert len(calls) == 1
+    assert cache.stats()["coalesced"] == 4
+    assert cache.stats()["hits"] == 1
+
+
+@pytest.mark.asyncio
+async def test_single_flight_ttl_cache_async_errors():
+    cache = SingleFlightTTLCache()
+
+    async def afetch():
+        await asyncio.sleep(0.01)
+        raise ValueError("GitHub is down")
+
+    results = await asyncio.gather(
+        *(cache.aget_or_fetch("user", afetch) for _ in range(2)),
+        return_exceptions=True,
+    )
+    assert all(isinstance(result, ValueError) for result in results)
+    # Errors aren't cached
+    assert len(cache) == 0
+
+
+@pytest.mark.asyncio
+async def test_single_flight_ttl_cache_async_leader_cancelled():
+    cache = SingleFlightTTLCache()
+
+    async def afetch():
+        await asyncio.sleep(0.05)
+        return ["a/repo1"]
+
+    leader = asyncio.ensure_future(cache.aget_or_fetch("user", afetch))
+    await asyncio.sleep(0.01)
+    waiter = asyncio.ensure_future(cache.aget_or_fetch("user", afetch))
+    await asyncio.sleep(0.01)
+    leader.cancel()
+
+    # The shared fetch isn't the leader's: it completes for the waiter
+    assert await waiter == ["a/repo1"]
+    assert leader.cancelled()
+    assert cache.get("user") == ["a/repo1"]
+
+
+@pytest.mark.asyncio
+async def test_single_flight_ttl_cache_async_leader_budget_exhausted():
+    cache = SingleFlightTTLCache()
+
+    async def aexhausted():
+        await asyncio.sleep(0.01)
+        raise BudgetExhausted()
+
+    async def afetch():
+        return ["a/repo1"]
+
+    results = await asyncio.gather(
+        cache.aget_or_fetch("user", aexhausted),
+        cache.aget_or_fetch("user", afetch),
+        return_exceptions=True,
+    )
+    # The leader's budget is exhausted, not the waiter's one: it fetches again
+    assert isinstance(results[0], BudgetExhausted)
+    assert results[1] == ["a/repo1"]
+
+
+def test_single_flight_ttl_cache_sync_coalescing():
+    cache = SingleFlightTTLCache()
+    calls = []
+
+    def fetch():
+        calls.append(1)
+        time.sleep(0.05)
+        return ["a/repo1"]
+
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(cache.get_or_fetch("u", fetch)))
+        for _ in range(4)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results == [["a/repo1"]] * 4
+    assert len(calls) == 1
+
+
+@pytest.mark.asyncio
+async def test_stale_while_revalidate_cache_coalescing():
+    cache = StaleWhileRevalidateCache()
+    calls = []
+
+    async def acompute():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return ["repo1"]
+
+    results = await asyncio.gather(
+        *(cache.aget_or_compute("octo/repo", acompute) for _ in range(3))
+    )
+    assert results == [(["repo1"], "miss")] + [(["repo1"], "coalesced")] * 2
+    assert await cache.aget_or_compute("octo/repo", acompute) == (["repo1"], "hit")
+    assert len(calls) == 1
+
+
+@pytest.mark.asyncio
+async def test_stale_while_revalidate_cache_refresh():
+    # Values are stale as soon as stored
+    cache = StaleWhileRevalidateCache(ttl=0, stale_ttl=3600)
+    values = iter(["v1", "v2"])
+
+    async def acompute():
+        await asyncio.sleep(0.01)
+        return next(values)
+
+    async def afail():
+        raise ValueError("GitHub is down")
+
+    assert await cache.aget_or_compute("key", acompute) == ("v1", "miss")
+    # Served stale, refreshed in the background (once)
+    assert await cache.aget_or_compute("key", acompute) == ("v1", "stale")
+    assert await cache.aget_or_compute("key", acompute) == ("v1", "stale")
+    await asyncio.sleep(0.05)
+    assert await cache.aget_or_compute("key", afail) == ("v2", "stale")
+
+    # Failed refreshes keep the stale value
+    await asyncio.sleep(0.01)
+    assert await cache.aget_or_compute("key", afail) == ("v2", "stale")
+    await cache.close()
+    assert cache.stats()["refreshes"] == 1
+    assert cache.stats()["refresh_errors"] == 1
+
+    # Too stale values aren't served
+    cache.stale_ttl = 0
+    with pytest.raises(ValueError):
+        await cache.aget_or_compute("key", afail)
+    assert len(cache) == 0
+
+
+@pytest.mark.asyncio
+async def test_stale_while_revalidate_cache_leader_cancelled():
+    cache = StaleWhileRevalidateCache()
+
+    async def acompute():
+        await asyncio.sleep(0.05)
+        return ["repo1"]
+
+    leader = asyncio.ensure_future(cache.aget_or_compute("octo/repo", acompute))
+    await asyncio.sleep(0.01)
+    waiter = asyncio.ensure_future(cache.aget_or_compute("octo/repo", acompute))
+    await asyncio.sleep(0.01)
+    leader.cancel()
+
+    # The shared computation isn't the leader's: it completes for the waiter
+    assert await waiter == (["repo1"], "coalesced")
+    assert leader.cancelled()
+    assert await cache.aget_or_compute("octo/repo", None) == (["repo1"], "hit")
+
+
+@pytest.mark.asyncio
+async def test_stale_while_revalidate_cache_not_cacheable():
+    cache = StaleWhileRevalidateCache()
+    values = iter([("repo1", False), ("repo1", True)])
+
+    async def acompute():
+        return next(values)
+
+    def cacheable(value):
+        _, complete = value
+        return complete
+
+    # Rejected values are returned, not stored
+    for value in (("repo1", False), ("repo1", True)):
+        assert await cache.aget_or_compute("key", acompute, cacheable) == (
+            value,
+            "miss",
+        )
+    assert await cache.aget_or_compute("key", acompute, cacheable) == (
+        ("repo1", True),
+        "hit",
+    )
+
+
+@pytest.mark.asyncio
+async def test_starred_cache_shared_by_sync_and_async(mocker):
+    calls = []
+    routes = {"/users/octocat/starred": [[{"full_name": "a/repo1"}]]}
+    mocker.patch.object(clients.requests, "get", build_github_mock_get(routes, calls))
+
+    client = clients.GitHubRestClient(starred_cache=SingleFlightTTLCache())
+    assert client.fetch_user_starred_repos(user="octocat") == ["a/repo1"]
+    assert await client.afetch_user_starred_repos(user="octocat") == ["a/repo1"]
+    assert len(calls) == 1
+
+
+@pytest.mark.asyncio
+async def test_starred_cache_per_token():
+    calls = []
+    starred_cache = SingleFlightTTLCache()
+    routes = {"/users/octocat/starred": [[{"full_name": "a/repo1"}]]}
+
+    async with build_github_mock_client(routes, calls) as http_client:
+        for token in ("private-token", None, "private-token"):
+            client = clients.GitHubRestClient(
+                token=token, http_client=http_client, starred_cache=starred_cache
+            )
+            await client.afetch_user_starred_repos(user="octocat")
+
+    assert len(calls) == 2
@@ -1,4 +1,31 @@
 import pytest
+import requests
+
+from fastapi import HTTPException
+
+from mergify_algos.github import clients
+from tests.github.conftest import (
+    build_github_mock_client,
+    build_github_mock_get,
+    build_graphql_mock_post,
+)
+
+# Offline paginated starred repositories: 4 pages of 2 repositories
+MOCK_STARRED_ROUTES = {
+    "/users/octocat/starred": [
+        [{"full_name": f"a/repo{page}-{i}"} for i in range(2)] for page in range(4)
+    ]
+}
+
+# Offline star graph: 30 stargazers, the first one starring 250 repositories
+MOCK_GRAPHQL_ROUTES = {
+    "/repos/octo/repo/stargazers": [[{"login": f"user{i}"} for i in range(30)]],
+    "/users/user0/starred": [[{"full_name": f"a/repo{i}"} for i in range(250)]],
+    **{
+        f"/users/user{u}/starred": [[{"full_name": f"a/repo{i}"} for i in range(u)]]
+        for u in range(1, 30)
+    },
+}
 
 
 # ---------------------------------------------------------------------------------------------------------------------
@@ -38,6 +65,153 @@ async def test_fetch_user_starred_repos(
     assert len(response) == expected_length
 
 
+@pytest.mark.asyncio
+async def test_afetch_user_starred_repos_shared_http_client():
+    routes = {
+        "/users/octocat/starred": [
+            [{"full_name": "a/repo1"}, {"full_name": "a/repo2"}],
+            [{"full_name": "b/repo3"}],
+        ]
+    }
+    calls = []
+    async with build_github_mock_client(routes, calls=calls) as http_client:
+        client = clients.GitHubRestClient(http_client=http_client)
+        response = await client.afetch_user_starred_repos(user="octocat")
+        response_bis = await client.afetch_user_starred_repos(user="octocat")
+
+        # The shared client isn't closed by the GitHub client
+        assert not http_client.is_closed
+
+    assert response == response_bis == ["a/repo1", "a/repo2", "b/repo3"]
+    assert len(calls) == 4
+
+
+@pytest.mark.parametrize(
+    "link,limit_pages,expected_pages",
+    [
+        (None, 10, []),
+        ('<https://x/y?per_page=2&page=2>; rel="next"', 10, None),
+        (
+            '<https://x/y?per_page=2&page=2>; rel="next", '
+            '<https://x/y?per_page=2&page=4>; rel="last"',
+            10,
+            [2, 3, 4],
+        ),
+        (
+            '<https://x/y?per_page=2&page=2>; rel="next", '
+            '<https://x/y?per_page=2&page=4>; rel="last"',
+            3,
+            [2, 3],
+        ),
+    ],
+)
+def test_get_page_urls(link, limit_pages, expected_pages):
+    headers = {"link": link} if link else {}
+    response = clients.httpx.Response(200, headers=headers)
+
+    page_urls = clients.GitHubRestClient()._get_page_urls(response, limit_pages)
+
+    if expected_pages is None:
+        assert page_urls is None
+    else:
+        assert page_urls == [
+            f"https://x/y?per_page=2&page={page}" for page in expected_pages
+        ]
+
+
+def test_extract_pages():
+    repo = {"full_name": "a/repo", "owner": {"login": "a"}, "topics": ["x"]}
+    user = {"login": "octocat", "id": 1}
+    starred = clients.httpx.Response(200, json=[repo, repo])
+    stargazers = clients.httpx.Response(200, json=[user])
+    star_stargazers = clients.httpx.Response(
+        200, json=[{"starred_at": "2020-01-01T00:00:00Z", "user": user}]
+    )
+
+    assert clients._extract_full_names(starred) == ["a/repo", "a/repo"]
+    assert clients._extract_logins(stargazers) == ["octocat"]
+    assert clients._extract_logins(star_stargazers) == ["octocat"]
+    assert clients._extract_stargazers_starred_at(star_stargazers) == [
+        ("octocat", "2020-01-01T00:00:00Z")
+    ]
+    assert clients._decode_page(stargazers) == [user]
+
+
+@pytest.mark.parametrize("limit_pages,expected_calls", [(1, 1), (3, 3), (10, 4)])
+@pytest.mark.asyncio
+async def test_aget_paginated_data_fan_out(limit_pages, expected_calls):
+    calls = []
+    async with build_github_mock_client(MOCK_STARRED_ROUTES, calls) as http_client:
+        client = clients.GitHubRestClient(http_client=http_client)
+        response = await client.afetch_user_starred_repos(
+            user="octocat", limit_pages=limit_pages
+        )
+
+    assert len(calls) == expected_calls
+    assert response == [
+        f"a/repo{page}-{i}" for page in range(expected_calls) for i in range(2)
+    ]
+
+
+@pytest.mark.parametrize("limit_pages,expected_calls", [(1, 1), (3, 3), (10, 4)])
+def test_get_paginated_data_fan_out(limit_pages, expected_calls, mocker):
+    calls = []
+    mocker.patch.object(
+        clients.requests, "get", build_github_mock_get(MOCK_STARRED_ROUTES, calls)
+    )
+
+    client = clients.GitHubRestClient()
+    response = client.fetch_user_starred_repos(user="octocat", limit_pages=limit_pages)
+
+    assert len(calls) == expected_calls
+    assert response == [
+        f"a/repo{page}-{i}" for page in range(expected_calls) for i in range(2)
+    ]
+
+
+# Offline stargazers: 4 pages of 2, starred one minute apart from 00:00
+MOCK_STARGAZERS_ROUTES = {
+    "/repos/octo/repo/stargazers": [
+        [{"login": f"user{page}-{i}"} for i in range(2)] for page in range(4)
+    ]
+}
+
+
+@pytest.mark.parametrize(
+    "since,max_pages,expected_logins,expected_reached,expected_calls",
+    [
+        (None, 10, [f"user{p}-{i}" for p in range(4) for i in range(2)], True, 4),
+        (None, 2, ["user2-0", "user2-1", "user3-0", "user3-1"], False, 3),
+        ("2020-01-01T00:04:00Z", 10, ["user2-1", "user3-0", "user3-1"], True, 3),
+        ("2020-01-01T00:07:00Z", 10, [], True, 2),
+    ],
+)
+@pytest.mark.asyncio
+async def test_afetch_new_stargazers(
+    since, max_pages, expected_logins, expected_reached, expected_calls
+):
+    calls = []
+    async with build_github_mock_client(MOCK_STARGAZERS_ROUTES, calls) as http_client:
+        client = clients.GitHubRestClient(http_client=http_client)
+        stargazers, reached = await client.afetch_new_stargazers(
+            "octo", "repo", since=since, max_pages=max_pages
+        )
+
+    assert [login for login, _ in stargazers] == expected_logins
+    assert all(starred_at > (since or "") for _, starred_at in stargazers)
+    assert reached is expected_reached
+    assert len(calls) == expected_calls
+
+
+def test_build_async_http_client():
+    http_client = clients.build_async_http_client(
+        max_connections=10, timeout=5.0, connect_timeout=1.0
+    )
+    assert isinstance(http_client, clients.httpx.AsyncClient)
+    assert http_client.timeout.pool is None
+    assert http_client.timeout.connect == 1.0
+
+
 # ---------------------------------------------------------------------------------------------------------------------
 # Testing GitHub GraphQL Client
 @pytest.mark.parametrize(
@@ -54,3 +228,141 @@ def test_graphql_fetch_stargazers(owner, repo, expected_length, github_graphql_c
 
     assert isinstance(response, dict)
     assert len(response) == expected_length
+
+
+def _expected_graphql_results(limit_pages):
+    max_items = limit_pages * 100
+    return {
+        f"user{u}": [f"a/repo{i}" for i in range(250 if u == 0 else u)][:max_items]
+        for u in range(30)
+    }
+
+
+@pytest.mark.parametrize("limit_pages", [1, 2, 3])
+@pytest.mark.asyncio
+async def test_graphql_afetch_follows_cursors(limit_pages):
+    http_client = build_github_mock_client(MOCK_GRAPHQL_ROUTES)
+    gh_client = clients.GitHubGraphQLClient(http_client=http_client)
+
+    results = await gh_client.afetch_stargazers_with_starred_repos(
+        "octo", "repo", limit_pages=limit_pages
+    )
+
+    assert results == _expected_graphql_results(limit_pages)
+
+
+@pytest.mark.asyncio
+async def test_graphql_afetch_shrinks_pages_on_errors():
+    http_client = build_github_mock_client(MOCK_GRAPHQL_ROUTES, max_nodes=500)
+    gh_client = clients.GitHubGraphQLClient(http_client=http_client)
+
+    results = await gh_client.afetch_stargazers_with_starred_repos("octo", "repo")
+
+    assert results == _expected_graphql_results(limit_pages=2)
+    assert gh_client._stargazers_sizer.shrinks > 0
+
+
+def test_graphql_fetch_follows_cursors(mocker):
+    mocker.patch.object(
+        clients.requests, "post", build_graphql_mock_post(MOCK_GRAPHQL_ROUTES, 500)
+    )
+    gh_client = clients.GitHubGraphQLClient()
+
+    results = gh_client.fetch_stargazers_with_starred_repos("octo", "repo")
+
+    assert results == _expected_graphql_results(limit_pages=2)
+
+
+def test_graphql_fetch_shrinks_pages_on_timeouts(mocker):
+    post = build_graphql_mock_post(MOCK_GRAPHQL_ROUTES)
+
+    def slow_post(url, timeout=None, **kwargs):
+        # Large pages take too long: the request must be given up
+        assert timeout == clients.REQUESTS_TIMEOUT
+        if kwargs["json"]["variables"]["first"] > 2:
+            raise requests.Timeout()
+        return post(url, **kwargs)
+
+    mocker.patch.object(clients.requests, "post", slow_post)
+    gh_client = clients.GitHubGraphQLClient(
+        scheduler=clients.RequestScheduler(max_retries=0)
+    )
+
+    results = gh_client.fetch_stargazers_with_starred_repos("octo", "repo")
+
+    assert results == _expected_graphql_results(limit_pages=2)
+    assert gh_client._stargazers_sizer.shrinks > 0
+
+
+@pytest.mark.asyncio
+async def test_graphql_afetch_not_found():
+    http_client = build_github_mock_client(MOCK_GRAPHQL_ROUTES)
+    gh_client = clients.GitHubGraphQLClient(http_client=http_client)
+
+    with pytest.raises(HTTPException) as exc_info:
+        await gh_client.afetch_stargazers_with_starred_repos("octo", "unknown")
+
+    assert exc_info.value.status_code == 404
+
+
+def test_graphql_page_sizer():
+    sizer = clients.GraphQLPageSizer(max_nested_first=100, node_budget=1000)
+    assert sizer.sizes() == (9, 100)
+
+    while sizer.shrink():
+        pass
+    assert sizer.sizes() == (1, 1)
+
+    sizer.on_success()
+    assert sizer.sizes() == (11, 1)
+
+
+@pytest.mark.parametrize("max_nodes", [None, 500])
+@pytest.mark.asyncio
+async def test_graphql_afetch_users_starred_repos(max_nodes):
+    http_client = build_github_mock_client(MOCK_GRAPHQL_ROUTES, max_nodes=max_nodes)
+    gh_client = clients.GitHubGraphQLClient(http_client=http_client)
+    logins = [f"user{u}" for u in range(30)]
+
+    results = await gh_client.afetch_users_starred_repos(logins)
+
+    assert results == _expected_graphql_results(limit_pages=2)
+    if max_nodes is not None:
+        assert gh_client._users_sizer.shrinks > 0
+
+
+def test_graphql_fetch_users_starred_repos(mocker):
+    mocker.patch.object(
+        clients.requests, "post", build_graphql_mock_post(MOCK_GRAPHQL_ROUTES, 500)
+    )
+    gh_client = clients.GitHubGraphQLClient()
+    logins = [f"user{u}" for u in range(30)]
+
+    results = gh_client.fetch_users_starred_repos(logins, limit_pages=1)
+
+    assert results == _expected_graphql_results(limit_pages=1)
+
+
+@pytest.mark.asyncio
+async def test_graphql_afetch_users_starred_repos_deleted_user():
+    http_client = build_github_mock_client(MOCK_GRAPHQL_ROUTES)
+    gh_client = clients.GitHubGraphQLClient(http_client=http_client)
+
+    results = await gh_client.afetch_users_starred_repos(["user2", "ghost", "user3"])
+
+    assert results == {
+        "user2": ["a/repo0", "a/repo1"],
+        "ghost": [],
+        "user3": ["a/repo0", "a/repo1", "a/repo2"],
+    }
+
+
+def test_graphql_fetch_users_starred_repos_deleted_user(mocker):
+    mocker.patch.object(
+        clients.requests, "post", build_graphql_mock_post(MOCK_GRAPHQL_ROUTES)
+    )
+    gh_client = clients.GitHubGraphQLClient()
+
+    results = gh_client.fetch_users_starred_repos(["ghost", "user1"])
+
+    assert results == {"ghost": [], "user1": ["a/repo0"]}
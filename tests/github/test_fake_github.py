@@ -0,0 +1,85 @@
+import httpx
+import pytest
+
+from benchmarks.fake_github import FakeGitHub, SyntheticStarGraph
+from mergify_algos.github.aggregation import CoStarCounter
+from mergify_algos.github.neighbours import (
+    afind_graphql_neighbour_repos,
+    afind_neighbour_repos,
+)
+
+FAKE_GITHUB_URL = "http://fake-github"
+
+
+def _expected_neighbours(graph, threshold=2):
+    counter = CoStarCounter.from_user_repo_map(
+        graph.starred, exclude_repos=[graph.target]
+    )
+    _, sorted_results = counter.compute(users_threshold=threshold)
+    return _sorted_stargazers(sorted_results)
+
+
+def _sorted_stargazers(sorted_results):
+    return [dict(r, stargazers=sorted(r["stargazers"])) for r in sorted_results]
+
+
+def _fake_github_client(fake_github):
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=fake_github.app))
+
+
+@pytest.mark.parametrize("backend", ["rest", "graphql"])
+@pytest.mark.asyncio
+async def test_afind_neighbour_repos_fake_github(backend):
+    # 150 stargazers (2 pages), starred repositories fit in one page
+    graph = SyntheticStarGraph(stargazers=150, stars=20, repos=500)
+    fake_github = FakeGitHub(graph)
+
+    async with _fake_github_client(fake_github) as http_client:
+        _, sorted_response = await afind_neighbour_repos(
+            owner="bench",
+            repo="target",
+            token=None,
+            http_client=http_client,
+            base_url=FAKE_GITHUB_URL,
+            backend=backend,
+        )
+
+    assert _sorted_stargazers(sorted_response) == _expected_neighbours(graph)
+    if backend == "rest":
+        # 2 stargazers pages, 1 starred page per stargazer
+        assert fake_github.requests_count == {"core": 2 + 150}
+
+
+@pytest.mark.asyncio
+async def test_afind_graphql_neighbour_repos_fake_github():
+    graph = SyntheticStarGraph(stargazers=150, stars=20, repos=500)
+    fake_github = FakeGitHub(graph)
+
+    async with _fake_github_client(fake_github) as http_client:
+        _, sorted_response = await afind_graphql_neighbour_repos(
+            owner="bench",
+            repo="target",
+            token=None,
+            http_client=http_client,
+            base_url=FAKE_GITHUB_URL,
+        )
+
+    assert _sorted_stargazers(sorted_response) == _expected_neighbours(graph)
+    assert set(fake_github.requests_count) == {"graphql"}
+
+
+@pytest.mark.asyncio
+async def test_fake_github_rate_limit():
+    fake_github = FakeGitHub(SyntheticStarGraph(stargazers=10), rate_limit=1)
+
+    async with _fake_github_client(fake_github) as http_client:
+        response = await http_client.get(f"{FAKE_GITHUB_URL}/repos/bench/target")
+        assert response.status_code == 200
+        assert response.headers["x-ratelimit-remaining"] == "0"
+
+        response = await http_client.get(f"{FAKE_GITHUB_URL}/repos/bench/target")
+        assert response.status_code == 403
+
+        await http_client.post(f"{FAKE_GITHUB_URL}/_reset")
+        response = await http_client.get(f"{FAKE_GITHUB_URL}/repos/bench/target")
+        assert response.status_code == 200
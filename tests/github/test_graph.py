@@ -0,0 +1,120 @@
+import pytest
+
+from mergify_algos.github.aggregation import CoStarCounter, Ranking
+from mergify_algos.github.graph import StarGraphStore
+
+
+USER_REPO_MAP = {
+    "user1": ["octo/repo", "repo1", "repo2", "repo5"],
+    "user2": ["repo2", "repo3"],
+    "user3": ["repo2", "repo3", "repo4"],
+    "user4": ["repo1", "repo4"],
+}
+
+
+@pytest.fixture
+def graph_store():
+    store = StarGraphStore()
+    for user, repos in USER_REPO_MAP.items():
+        store.put_starred_repos(user, repos)
+    store.put_stargazers("octo/repo", list(USER_REPO_MAP))
+    yield store
+    store.close()
+
+
+def test_starred_repos():
+    store = StarGraphStore()
+    assert store.get_starred_repos("user1") is None
+
+    store.put_starred_repos("user1", ["repo2", "repo1"], pages=1)
+    assert store.get_starred_repos("user1", pages=1) == ["repo2", "repo1"]
+    # Fetched with less pages than requested
+    assert store.get_starred_repos("user1", pages=2) is None
+
+    store.put_starred_repos("user1", ["repo3"], pages=2)
+    assert store.get_starred_repos("user1", pages=1) == ["repo3"]
+    assert store.stats() == {
+        "users": 1,
+        "edges": 1,
+        "hits": 2,
+        "misses": 2,
+        "hit_rate": 0.5,
+    }
+
+
+def test_put_many_starred_repos():
+    store = StarGraphStore()
+    store.put_many_starred_repos(list(USER_REPO_MAP.items()), pages=1)
+
+    for user, repos in USER_REPO_MAP.items():
+        assert store.get_starred_repos(user, pages=1) == repos
+    assert store.stats()["users"] == 4
+
+
+def test_starred_repos_stale():
+    store = StarGraphStore(ttl=0)
+    store.put_starred_repos("user1", ["repo1"])
+    assert store.get_starred_repos("user1") is None
+
+
+def test_persistent(tmp_path):
+    path = str(tmp_path / "graph.db")
+    store = StarGraphStore(path=path)
+    store.put_starred_repos("user1", ["repo1"])
+    store.close()
+
+    store = StarGraphStore(path=path)
+    assert store.get_starred_repos("user1") == ["repo1"]
+    store.close()
+
+
+@pytest.mark.parametrize(
+    "ranking",
+    [
+        None,
+        Ranking(top_k=2),
+        Ranking(offset=1, limit=2, include_stargazers="sample", stargazers_sample=1),
+        Ranking(include_stargazers="none"),
+    ],
+)
+def test_neighbours(graph_store, ranking):
+    counter = CoStarCounter.from_user_repo_map(
+        USER_REPO_MAP, exclude_repos=["octo/repo"]
+    )
+    _, expected = counter.compute(users_threshold=2, ranking=ranking)
+
+    _, sorted_results = graph_store.neighbours("octo/repo", ranking=ranking)
+    assert sorted_results == expected
+
+
+def test_neighbours_missing(graph_store):
+    assert graph_store.neighbours("octo/other") is None
+    # More stargazers' pages than stored
+    assert graph_store.neighbours("octo/repo", pages=3) is None
+
+    # One stargazer isn't fresh anymore
+    graph_store.put_starred_repos("user2", ["repo2"], pages=1)
+    assert graph_store.neighbours("octo/repo") is None
+
+
+def test_add_stargazers():
+    store = StarGraphStore()
+    assert store.latest_starred_at("octo/repo") is None
+    assert store.stargazers_info("octo/repo") == (0, None)
+
+    store.put_stargazers(
+        "octo/repo", ["user1", "user2"], pages=1, starred_at=["2020-01", "2020-02"]
+    )
+    store.put_starred_repos("user1", ["repo1"])
+    store.add_stargazers(
+        "octo/repo", ["user2", "user3"], starred_at=["2020-02", "2020-03"]
+    )
+
+    assert store.latest_starred_at("octo/repo") == "2020-03"
+    assert store.stargazers_info("octo/repo") == (3, 1)
+    assert store.missing_starred_repos("octo/repo") == ["user2", "user3"]
+
+    # Not the first stargazers: the number of pages stays unknown
+    store.put_stargazers("octo/other", ["user3"], pages=None)
+    store.add_stargazers("octo/other", ["user4"])
+    assert store.stargazers_info("octo/other") == (2, None)
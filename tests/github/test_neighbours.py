@@ -1,12 +1,56 @@
+import asyncio
+import concurrent.futures
+import httpx
 import pytest
+import threading
 import time
 
+from fastapi import HTTPException
+
 from mergify_algos.github.neighbours import (
     find_neighbour_repos,
     afind_neighbour_repos,
+    afind_graphql_neighbour_repos,
+    afind_approximate_neighbour_repos,
+    afind_batch_neighbour_repos,
+    arefresh_neighbour_repos,
+    _iter_starred_repos,
     _transform_user_starred_repositories,
     _compute_and_order_neighbours,
 )
+from mergify_algos.github import clients, neighbours
+from mergify_algos.github.cache import SingleFlightTTLCache
+from mergify_algos.github.graph import StarGraphStore
+from tests.github.conftest import (
+    build_github_mock_client,
+    build_github_mock_get,
+    build_github_mock_handler,
+    build_graphql_mock_post,
+)
+
+
+# Offline star graph: "octo/repo" stargazers and their starred repositories
+MOCK_GITHUB_ROUTES = {
+    "/repos/octo/repo": [{"stargazers_count": 4}],
+    "/repos/octo/repo/stargazers": [
+        [{"login": "user1"}, {"login": "user2"}],
+        [{"login": "user3"}, {"login": "user4"}],
+    ],
+    "/users/user1/starred": [
+        [{"full_name": "octo/repo"}, {"full_name": "repo1"}],
+        [{"full_name": "repo2"}, {"full_name": "repo5"}],
+    ],
+    "/users/user2/starred": [[{"full_name": "repo2"}, {"full_name": "repo3"}]],
+    "/users/user3/starred": [
+        [{"full_name": "repo2"}, {"full_name": "repo3"}, {"full_name": "repo4"}]
+    ],
+    "/users/user4/starred": [[{"full_name": "repo1"}, {"full_name": "repo4"}]],
+}
+
+
+def _sorted_stargazers(results):
+    """Results with sorted stargazers: concurrent fetches complete in any order"""
+    return [dict(r, stargazers=sorted(r["stargazers"])) for r in results]
 
 
 @pytest.mark.parametrize(
@@ -58,6 +102,538 @@ async def test_afind_neighbour_repos(owner, repo, expected_length, github_token)
         assert len(response) == len(sorted_response) == expected_length
 
 
+@pytest.mark.parametrize("max_concurrency", [1, 3, 50])
+@pytest.mark.asyncio
+async def test_afind_neighbour_repos_offline(max_concurrency):
+    async with build_github_mock_client(MOCK_GITHUB_ROUTES) as http_client:
+        response, sorted_response = await afind_neighbour_repos(
+            owner="octo",
+            repo="repo",
+            token=None,
+            http_client=http_client,
+            max_concurrency=max_concurrency,
+        )
+
+    assert [(r["repo"], r["stargazers_count"]) for r in sorted_response] == [
+        ("repo2", 3),
+        ("repo1", 2),
+        ("repo3", 2),
+        ("repo4", 2),
+    ]
+    assert sorted(sorted_response[0]["stargazers"]) == ["user1", "user2", "user3"]
+
+
+@pytest.mark.asyncio
+async def test_afind_neighbour_repos_offline_spill(tmp_path):
+    async with build_github_mock_client(MOCK_GITHUB_ROUTES) as http_client:
+        _, expected_response = await afind_neighbour_repos(
+            owner="octo", repo="repo", token=None, http_client=http_client
+        )
+        _, sorted_response = await afind_neighbour_repos(
+            owner="octo",
+            repo="repo",
+            token=None,
+            http_client=http_client,
+            memory_budget=0,
+            spill_dir=tmp_path,
+        )
+
+    assert _sorted_stargazers(sorted_response) == _sorted_stargazers(expected_response)
+    assert list(tmp_path.iterdir()) == []
+
+
+@pytest.mark.asyncio
+async def test_afind_neighbour_repos_offline_sharded(monkeypatch):
+    monkeypatch.setattr(neighbours, "SHARDING_MIN_EDGES", 0)
+    async with build_github_mock_client(MOCK_GITHUB_ROUTES) as http_client:
+        _, expected_response = await afind_neighbour_repos(
+            owner="octo", repo="repo", token=None, http_client=http_client
+        )
+        with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+            _, sorted_response = await afind_neighbour_repos(
+                owner="octo",
+                repo="repo",
+                token=None,
+                http_client=http_client,
+                aggregation_executor=executor,
+                aggregation_shards=2,
+            )
+
+    assert _sorted_stargazers(sorted_response) == _sorted_stargazers(expected_response)
+
+
+@pytest.mark.asyncio
+async def test_afind_neighbour_repos_offline_cancelled_fetch(monkeypatch):
+    async def cancelled_fetch(*args, **kwargs):
+        # e.g. a shared fetch cancelled by another computation
+        raise asyncio.CancelledError()
+
+    monkeypatch.setattr(
+        neighbours.GitHubRestClient, "afetch_user_starred_repos", cancelled_fetch
+    )
+    async with build_github_mock_client(MOCK_GITHUB_ROUTES) as http_client:
+        with pytest.raises(RuntimeError):
+            await asyncio.wait_for(
+                afind_neighbour_repos(
+                    owner="octo", repo="repo", token=None, http_client=http_client
+                ),
+                5,
+            )
+
+
+@pytest.mark.asyncio
+async def test_afind_neighbour_repos_offline_max_requests():
+    progress = []
+    async with build_github_mock_client(MOCK_GITHUB_ROUTES) as http_client:
+        # Under a budget, users' first starred page only is fetched
+        _, sorted_response = await afind_neighbour_repos(
+            owner="octo",
+            repo="repo",
+            token=None,
+            threshold=1,
+            http_client=http_client,
+            max_requests=100,
+            on_progress=lambda **kwargs: progress.append(kwargs),
+        )
+        assert ("repo5", 1) not in [
+            (r["repo"], r["stargazers_count"]) for r in sorted_response
+        ]
+        assert progress[-1]["stargazers_done"] == 4
+        assert not progress[-1]["budget_exhausted"]
+
+        # Stargazers' pages and one user: partial results
+        _, sorted_response = await afind_neighbour_repos(
+            owner="octo",
+            repo="repo",
+            token=None,
+            threshold=1,
+            http_client=http_client,
+            max_concurrency=1,
+            max_requests=3,
+            on_progress=lambda **kwargs: progress.append(kwargs),
+        )
+
+    assert progress[-1]["requests"] == 3
+    assert progress[-1]["budget_exhausted"]
+    assert progress[-1]["stargazers_done"] < 4
+    assert sum(r["stargazers_count"] for r in sorted_response) < 8
+
+
+@pytest.mark.asyncio
+async def test_afind_neighbour_repos_offline_deadline():
+    handler = build_github_mock_handler(MOCK_GITHUB_ROUTES)
+
+    async def slow_handler(request):
+        if request.url.path == "/users/user4/starred":
+            await asyncio.sleep(10)
+        return handler(request)
+
+    progress = {}
+    transport = httpx.MockTransport(slow_handler)
+    async with httpx.AsyncClient(transport=transport) as http_client:
+        start = time.monotonic()
+        _, sorted_response = await afind_neighbour_repos(
+            owner="octo",
+            repo="repo",
+            token=None,
+            http_client=http_client,
+            deadline_ms=500,
+            on_progress=progress.update,
+        )
+
+    # user4's fetch is cancelled: ranked from the 3 other users
+    assert time.monotonic() - start < 5
+    assert progress["budget_exhausted"]
+    assert progress["stargazers_done"] == 3
+    assert [(r["repo"], r["stargazers_count"]) for r in sorted_response] == [
+        ("repo2", 2),
+        ("repo3", 2),
+    ]
+
+
+def test_find_neighbour_repos_offline_deadline(mocker):
+    get = build_github_mock_get(MOCK_GITHUB_ROUTES)
+
+    def slow_get(url, headers=None, timeout=None):
+        if "/users/user4/starred" in url:
+            # Hung request: only given up at its timeout, if any
+            time.sleep(min(timeout) if timeout else 10)
+            raise clients.requests.Timeout()
+        return get(url, headers=headers)
+
+    mocker.patch.object(clients.requests, "get", slow_get)
+    progress = {}
+    start = time.monotonic()
+    _, sorted_response = find_neighbour_repos(
+        owner="octo",
+        repo="repo",
+        token=None,
+        deadline_ms=500,
+        on_progress=lambda **kwargs: progress.update(kwargs),
+    )
+
+    # user4's request times out at the deadline: ranked from the 3 other users
+    assert time.monotonic() - start < 5
+    assert progress["budget_exhausted"]
+    assert progress["stargazers_done"] == 3
+    assert [(r["repo"], r["stargazers_count"]) for r in sorted_response] == [
+        ("repo2", 2),
+        ("repo3", 2),
+    ]
+
+
+@pytest.mark.asyncio
+async def test_afind_neighbour_repos_offline_overlapping_budgets():
+    handler = build_github_mock_handler(MOCK_GITHUB_ROUTES)
+
+    async def slow_handler(request):
+        if request.url.path == "/users/user4/starred":
+            await asyncio.sleep(1)
+        return handler(request)
+
+    transport = httpx.MockTransport(slow_handler)
+    async with httpx.AsyncClient(transport=transport) as http_client:
+
+        async def compute(starred_cache, delay=0, **budget):
+            await asyncio.sleep(delay)
+            progress = {}
+            await afind_neighbour_repos(
+                owner="octo",
+                repo="repo",
+                token=None,
+                http_client=http_client,
+                starred_cache=starred_cache,
+                on_progress=progress.update,
+                **budget,
+            )
+            return progress
+
+        # The short deadline stops awaiting user4's fetch it leads, which
+        # the other computation still gets
+        starred_cache = SingleFlightTTLCache()
+        short, long = await asyncio.wait_for(
+            asyncio.gather(
+                compute(starred_cache, deadline_ms=300),
+                compute(starred_cache, delay=0.1, deadline_ms=5000),
+            ),
+            5,
+        )
+        assert short["budget_exhausted"] and short["stargazers_done"] == 3
+        assert not long["budget_exhausted"] and long["stargazers_done"] == 4
+        assert starred_cache.stats()["coalesced"] > 0
+
+        # Shared fetches exhausting a budget are fetched again by the others,
+        # nobody waits forever
+        starred_cache = SingleFlightTTLCache()
+        small, large = await asyncio.wait_for(
+            asyncio.gather(
+                compute(starred_cache, max_requests=3, max_concurrency=1),
+                compute(starred_cache, max_requests=100),
+            ),
+            5,
+        )
+        assert small["requests"] <= 3
+        assert not large["budget_exhausted"] and large["stargazers_done"] == 4
+
+
+@pytest.mark.parametrize("backend", ["rest", "graphql"])
+@pytest.mark.asyncio
+async def test_afind_batch_neighbour_repos_offline(backend):
+    routes = dict(MOCK_GITHUB_ROUTES)
+    routes["/repos/octo/other/stargazers"] = [
+        [{"login": "user2"}, {"login": "user3"}, {"login": "user5"}]
+    ]
+    routes["/users/user5/starred"] = [[{"full_name": "repo3"}, {"full_name": "repo1"}]]
+    async with build_github_mock_client(routes) as http_client:
+        _, expected_repo = await afind_neighbour_repos(
+            owner="octo", repo="repo", token=None, http_client=http_client
+        )
+        _, expected_other = await afind_neighbour_repos(
+            owner="octo", repo="other", token=None, http_client=http_client
+        )
+
+    calls = []
+    async with build_github_mock_client(routes, calls) as http_client:
+        results, batch = await afind_batch_neighbour_repos(
+            repos=["octo/repo", "octo/other", "octo/missing", "octo/repo"],
+            token=None,
+            http_client=http_client,
+            backend=backend,
+        )
+
+    assert list(results) == ["octo/repo", "octo/other", "octo/missing"]
+    assert _sorted_stargazers(results["octo/repo"]["results"]) == _sorted_stargazers(
+        expected_repo
+    )
+    assert _sorted_stargazers(results["octo/other"]["results"]) == _sorted_stargazers(
+        expected_other
+    )
+    assert results["octo/missing"]["status_code"] == 404
+    assert batch == {
+        "repos": 3,
+        "stargazers": 7,
+        "unique_stargazers": 5,
+        "shared_stargazers": 2,
+        "starred_fetches_saved": 2,
+        "rate_limited": False,
+    }
+    if backend == "rest":
+        assert sum("/users/user2/starred" in url for url in calls) == 1
+
+
+@pytest.mark.parametrize("max_concurrency", [1, 3])
+@pytest.mark.asyncio
+async def test_afind_neighbour_repos_offline_graphql_backend(max_concurrency):
+    async with build_github_mock_client(MOCK_GITHUB_ROUTES) as http_client:
+        _, expected_response = await afind_neighbour_repos(
+            owner="octo", repo="repo", token=None, http_client=http_client
+        )
+        _, sorted_response = await afind_neighbour_repos(
+            owner="octo",
+            repo="repo",
+            token=None,
+            http_client=http_client,
+            max_concurrency=max_concurrency,
+            backend="graphql",
+        )
+
+    assert _sorted_stargazers(sorted_response) == _sorted_stargazers(expected_response)
+
+
+@pytest.mark.parametrize("backend", ["rest", "graphql"])
+@pytest.mark.asyncio
+async def test_afind_neighbour_repos_offline_graph_store(backend):
+    graph_store = StarGraphStore()
+    calls = []
+    async with build_github_mock_client(MOCK_GITHUB_ROUTES, calls) as http_client:
+        _, expected_response = await afind_neighbour_repos(
+            owner="octo",
+            repo="repo",
+            token=None,
+            http_client=http_client,
+            graph_store=graph_store,
+            backend=backend,
+        )
+        cold_calls = len(calls)
+
+        # Warm: computed from the local graph, without any request
+        _, sorted_response = await afind_neighbour_repos(
+            owner="octo",
+            repo="repo",
+            token=None,
+            http_client=http_client,
+            graph_store=graph_store,
+            backend=backend,
+        )
+
+    assert cold_calls > 0
+    assert len(calls) == cold_calls
+    assert _sorted_stargazers(sorted_response) == _sorted_stargazers(expected_response)
+    assert graph_store.stats()["users"] == 4
+
+
+@pytest.mark.parametrize("backend", ["rest", "graphql"])
+@pytest.mark.asyncio
+async def test_afind_neighbour_repos_offline_graph_store_off_loop(backend, monkeypatch):
+    monkeypatch.setattr(neighbours, "GRAPH_STORE_BATCH_SIZE", 3)
+    graph_store = StarGraphStore()
+    loop_thread = threading.get_ident()
+    store_calls = []
+
+    def record(method):
+        def recorded(*args, **kwargs):
+            store_calls.append((method.__name__, threading.get_ident(), args))
+            return method(*args, **kwargs)
+
+        return recorded
+
+    for name in ("get_starred_repos", "put_many_starred_repos", "neighbours"):
+        monkeypatch.setattr(graph_store, name, record(getattr(graph_store, name)))
+
+    async with build_github_mock_client(MOCK_GITHUB_ROUTES) as http_client:
+        for _ in range(2):
+            await afind_neighbour_repos(
+                owner="octo",
+                repo="repo",
+                token=None,
+                http_client=http_client,
+                graph_store=graph_store,
+                backend=backend,
+            )
+
+    assert all(thread != loop_thread for _, thread, _ in store_calls)
+    # Fetched users are recorded by batches
+    batches = [args[0] for name, _, args in store_calls if name.startswith("put")]
+    assert [len(batch) for batch in batches] == [3, 1]
+    assert [name for name, _, _ in store_calls][-1] == "neighbours"
+
+
+@pytest.mark.parametrize("backend", ["rest", "graphql"])
+@pytest.mark.asyncio
+async def test_arefresh_neighbour_repos_offline(backend):
+    graph_store = StarGraphStore()
+    async with build_github_mock_client(MOCK_GITHUB_ROUTES) as http_client:
+        _, sorted_response, refresh = await arefresh_neighbour_repos(
+            owner="octo",
+            repo="repo",
+            token=None,
+            graph_store=graph_store,
+            http_client=http_client,
+            backend=backend,
+        )
+
+    assert [(r["repo"], r["stargazers_count"]) for r in sorted_response] == [
+        ("repo2", 3),
+        ("repo1", 2),
+        ("repo3", 2),
+        ("repo4", 2),
+    ]
+    assert refresh == {"new_stargazers": 4, "stargazers": 4, "complete": True}
+
+    # A new stargazer: only its starred repositories are fetched, and the
+    # first, last and previous (reaching recorded stargazers) pages
+    routes = dict(MOCK_GITHUB_ROUTES)
+    routes["/repos/octo/repo/stargazers"] = routes["/repos/octo/repo/stargazers"] + [
+        [{"login": "user5"}]
+    ]
+    routes["/users/user5/starred"] = [[{"full_name": "repo3"}, {"full_name": "repo5"}]]
+    calls = []
+    async with build_github_mock_client(routes, calls) as http_client:
+        _, sorted_response, refresh = await arefresh_neighbour_repos(
+            owner="octo",
+            repo="repo",
+            token=None,
+            graph_store=graph_store,
+            http_client=http_client,
+            backend=backend,
+        )
+        refresh_calls = list(calls)
+        _, expected_response = await afind_neighbour_repos(
+            owner="octo",
+            repo="repo",
+            token=None,
+            limit_pages=3,
+            http_client=http_client,
+        )
+
+    assert len([url for url in refresh_calls if "/stargazers" in url]) == 3
+    assert not [url for url in refresh_calls if "/users/user1" in url]
+    assert _sorted_stargazers(sorted_response) == _sorted_stargazers(expected_response)
+    assert refresh == {"new_stargazers": 1, "stargazers": 5, "complete": True}
+
+
+@pytest.mark.asyncio
+async def test_afind_neighbour_repos_offline_error():
+    routes = dict(MOCK_GITHUB_ROUTES)
+    del routes["/users/user3/starred"]
+
+    async with build_github_mock_client(routes) as http_client:
+        with pytest.raises(HTTPException) as exc_info:
+            await afind_neighbour_repos(
+                owner="octo", repo="repo", token=None, http_client=http_client
+            )
+
+    assert exc_info.value.status_code == 404
+
+
+@pytest.mark.asyncio
+async def test_afind_graphql_neighbour_repos_offline():
+    async with build_github_mock_client(MOCK_GITHUB_ROUTES) as http_client:
+        _, expected_response = await afind_neighbour_repos(
+            owner="octo", repo="repo", token=None, http_client=http_client
+        )
+        response, sorted_response = await afind_graphql_neighbour_repos(
+            owner="octo", repo="repo", token=None, http_client=http_client
+        )
+
+    assert [r["repo"] for r in sorted_response] == ["repo2", "repo1", "repo3", "repo4"]
+    assert [dict(r, stargazers=sorted(r["stargazers"])) for r in sorted_response] == [
+        dict(r, stargazers=sorted(r["stargazers"])) for r in expected_response
+    ]
+
+
+# 500 stargazers (5 pages of 100): everyone stars "popular", one in two "half"
+MOCK_SAMPLED_ROUTES = {
+    "/repos/octo/large": [{"stargazers_count": 500}],
+    "/repos/octo/large/stargazers": [
+        [{"login": f"user{i}"} for i in range(page * 100, (page + 1) * 100)]
+        for page in range(5)
+    ],
+    **{
+        f"/users/user{i}/starred": [
+            [{"full_name": "popular"}] + ([{"full_name": "half"}] if i % 2 else [])
+        ]
+        for i in range(500)
+    },
+}
+
+
+@pytest.mark.asyncio
+async def test_afind_approximate_neighbour_repos_offline():
+    async with build_github_mock_client(MOCK_SAMPLED_ROUTES) as http_client:
+        _, sorted_response, sampling = await afind_approximate_neighbour_repos(
+            owner="octo",
+            repo="large",
+            token=None,
+            sample_pages=2,
+            threshold=100,
+            seed=42,
+            http_client=http_client,
+        )
+
+    assert sampling["population"] == 500
+    assert sampling["sample_size"] == 200
+    assert len(sampling["pages"]) == 2
+
+    popular, half = sorted_response
+    assert popular["repo"] == "popular"
+    assert popular["stargazers_count"] == 200
+    assert popular["stargazers_estimate"] == 500
+    assert half["repo"] == "half"
+    assert half["stargazers_estimate"] == 250
+    low, high = half["stargazers_interval"]
+    assert low < 250 < high
+
+
+@pytest.mark.asyncio
+async def test_afind_approximate_neighbour_repos_offline_listable_pages():
+    # More stargazers than GitHub lists: only the first 5 pages are listable
+    routes = dict(
+        MOCK_SAMPLED_ROUTES, **{"/repos/octo/large": [{"stargazers_count": 900}]}
+    )
+    async with build_github_mock_client(routes) as http_client:
+        _, sorted_response, sampling = await afind_approximate_neighbour_repos(
+            owner="octo",
+            repo="large",
+            token=None,
+            sample_pages=5,
+            threshold=100,
+            http_client=http_client,
+        )
+
+    assert sampling["pages"] == [1, 2, 3, 4, 5]
+    assert sampling["population"] == sampling["sample_size"] == 500
+    assert sampling["stargazers_count"] == 900
+    assert sorted_response[0]["stargazers_estimate"] == 500
+
+
+def test__iter_starred_repos_duplicated_stargazers(mocker):
+    mocker.patch.object(
+        clients.requests, "post", build_graphql_mock_post(MOCK_GITHUB_ROUTES)
+    )
+    graphql_client = clients.GitHubGraphQLClient()
+
+    # e.g. a star shifting between two stargazers' pages during the crawl
+    results = list(
+        _iter_starred_repos(None, graphql_client, ["user2", "user4", "user2"], 1, None)
+    )
+
+    assert results == [
+        ("user2", ["repo2", "repo3"]),
+        ("user4", ["repo1", "repo4"]),
+    ]
+
+
 def test__transform_user_starred_repositories():
     user_repo_dict = {
         "user1": ["repo1", "repo2", "repo5"],
@@ -0,0 +1,39 @@
+import pytest
+import random
+
+from mergify_algos.github import sampling
+
+
+def test_sample_pages():
+    pages = sampling.sample_pages(1234, 5, rng=random.Random(1))
+
+    assert len(pages) == 5
+    assert pages == sorted(set(pages))
+    assert all(1 <= page <= 13 for page in pages)
+    assert sampling.sample_pages(150, 5) == [1, 2]
+
+
+@pytest.mark.parametrize("count", [0, 10, 50, 100])
+def test_wilson_interval(count):
+    low, high = sampling.wilson_interval(count, 100, 10_000)
+
+    assert count <= low <= count * 100 <= high <= 10_000 or count == 0
+    assert sampling.wilson_interval(count, 100, 100) == (count, count)
+
+
+def test_wilson_interval_narrows_with_sample_size():
+    small = sampling.wilson_interval(10, 100, 100_000)
+    large = sampling.wilson_interval(100, 1000, 100_000)
+
+    assert large[1] - large[0] < small[1] - small[0]
+
+
+def test_add_estimates():
+    results = [{"repo": "repo1", "stargazers_count": 10}]
+
+    sampling.add_estimates(results, sample_size=100, population=1000)
+
+    assert results[0]["stargazers_estimate"] == 100
+    low, high = results[0]["stargazers_interval"]
+    assert low < 100 < high
+    assert sampling.sample_threshold(100, 100, 1000) == 10
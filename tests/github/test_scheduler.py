@@ -0,0 +1,292 @@
+import httpx
+import pytest
+import time
+
+from mergify_algos.github import clients
+from mergify_algos.github.neighbours import afind_neighbour_repos
+from mergify_algos.github.scheduler import (
+    AIMDLimiter,
+    BudgetExhausted,
+    ComputationBudget,
+    RateLimitBudget,
+    RateLimitExceeded,
+    RequestScheduler,
+    TokenPool,
+    computation_budget,
+)
+from tests.github.conftest import build_github_mock_handler
+
+
+def build_flaky_client(responses, routes, calls):
+    """Answer the queued `responses` first, then serve `routes`"""
+    handler = build_github_mock_handler(routes, calls=calls)
+
+    def flaky_handler(request):
+        if responses:
+            calls.append(str(request.url))
+            return responses.pop(0)
+        return handler(request)
+
+    return httpx.AsyncClient(transport=httpx.MockTransport(flaky_handler))
+
+
+@pytest.mark.parametrize(
+    "remaining,reset_in,expected_delay",
+    [
+        (None, None, 0),
+        (4000, 100, 0),
+        # Less than 10% left: spread the remaining requests until reset
+        (110, 100, 1),
+        # Reserve reached: wait until reset
+        (10, 100, 100),
+    ],
+)
+def test_rate_limit_budget_delay(remaining, reset_in, expected_delay):
+    now = time.time()
+    budget = RateLimitBudget()
+    if remaining is not None:
+        budget.update(
+            {
+                "x-ratelimit-limit": "5000",
+                "x-ratelimit-remaining": str(remaining),
+                "x-ratelimit-reset": str(int(now + reset_in)),
+            }
+        )
+
+    delay = budget.delay(reserve=10, pacing_ratio=0.1, now=int(now))
+    assert delay == pytest.approx(expected_delay, abs=0.1)
+
+
+def test_aimd_limiter():
+    limiter = AIMDLimiter(initial_limit=4, max_limit=5)
+
+    limiter.on_success(0.1)
+    assert limiter.limit == pytest.approx(4.25)
+
+    # Latency too far from the best observed one is a congestion signal
+    limiter.on_success(1.0)
+    assert limiter.limit == pytest.approx(2.125)
+
+    for _ in range(100):
+        limiter.on_success(0.1)
+    assert limiter.limit == 5
+
+
+def _budget(remaining=None, reset_in=3600):
+    budget = RateLimitBudget()
+    if remaining is not None:
+        budget.update(
+            {
+                "x-ratelimit-limit": "5000",
+                "x-ratelimit-remaining": str(remaining),
+                "x-ratelimit-reset": str(int(time.time() + reset_in)),
+            }
+        )
+    return budget
+
+
+def test_token_pool_select():
+    pool = TokenPool(["a", "b", "c"])
+
+    # Unknown budgets: spread over the least used tokens
+    budgets = {"a": _budget(), "b": _budget(), "c": _budget()}
+    assert [pool.select(budgets) for _ in range(3)] == ["a", "b", "c"]
+
+    # Most remaining budget first
+    budgets = {"a": _budget(100), "b": _budget(4000), "c": _budget(2000)}
+    assert pool.select(budgets) == "b"
+
+    # Exhausted tokens are out of rotation until their reset
+    budgets = {"a": _budget(5), "b": _budget(0), "c": _budget(0, reset_in=-1)}
+    assert pool.select(budgets, reserve=10) == "c"
+
+    # All exhausted: the one reset first
+    budgets = {"a": _budget(0, 60), "b": _budget(0, 30), "c": _budget(0, 90)}
+    assert not pool.has_available(budgets)
+    assert pool.select(budgets) == "b"
+    assert pool.requests == {"a": 1, "b": 3, "c": 2}
+
+
+@pytest.mark.asyncio
+async def test_scheduler_token_pool():
+    """Requests are spread over the pool, a rate limited token is replaced"""
+    reset = str(int(time.time() + 3600))
+    routes = {"/users/octocat/starred": [[{"full_name": "a/repo1"}]]}
+    handler = build_github_mock_handler(routes)
+    authorizations = []
+
+    def token_handler(request):
+        authorization = request.headers.get("authorization")
+        authorizations.append(authorization)
+        remaining = "0" if authorization == "Bearer token-a" else "4000"
+        response = handler(request)
+        if remaining == "0":
+            response = httpx.Response(403, json={"message": "API rate limit"})
+        response.headers.update(
+            {"x-ratelimit-remaining": remaining, "x-ratelimit-reset": reset}
+        )
+        return response
+
+    scheduler = RequestScheduler(token_pool=TokenPool(["token-a", "token-b"]))
+    transport = httpx.MockTransport(token_handler)
+    async with httpx.AsyncClient(transport=transport) as http_client:
+        client = clients.GitHubRestClient(http_client=http_client, scheduler=scheduler)
+        for _ in range(2):
+            assert await client.afetch_user_starred_repos(user="octocat") == ["a/repo1"]
+
+        # A pinned token isn't replaced
+        client = clients.GitHubRestClient(
+            token="token-a", http_client=http_client, scheduler=scheduler
+        )
+        with pytest.raises(RateLimitExceeded):
+            await client.afetch_user_starred_repos(user="octocat")
+
+    assert authorizations == ["Bearer token-a", "Bearer token-b", "Bearer token-b"]
+    assert [stats["requests"] for stats in scheduler.tokens_stats()] == [1, 2]
+    assert scheduler.tokens_stats()[1]["budgets"]["core"]["remaining"] == 4000
+
+
+@pytest.mark.parametrize(
+    "response",
+    [
+        httpx.Response(502),
+        httpx.Response(429),
+        httpx.Response(
+            403,
+            headers={"retry-after": "0"},
+            json={"message": "You have exceeded a secondary rate limit"},
+        ),
+    ],
+)
+@pytest.mark.asyncio
+async def test_scheduler_retries(response):
+    routes = {"/users/octocat/starred": [[{"full_name": "a/repo1"}]]}
+    calls = []
+    scheduler = RequestScheduler(backoff_base=0.001)
+
+    async with build_flaky_client([response], routes, calls) as http_client:
+        client = clients.GitHubRestClient(http_client=http_client, scheduler=scheduler)
+        data = await client.afetch_user_starred_repos(user="octocat")
+
+    assert data == ["a/repo1"]
+    assert len(calls) == 2
+
+
+@pytest.mark.asyncio
+async def test_scheduler_retry_after_too_long():
+    response = httpx.Response(
+        403,
+        headers={"retry-after": "3600"},
+        json={"message": "You have exceeded a secondary rate limit"},
+    )
+    calls = []
+    scheduler = RequestScheduler(rate_limit_max_wait=60)
+
+    async with build_flaky_client([response], {}, calls) as http_client:
+        client = clients.GitHubRestClient(http_client=http_client, scheduler=scheduler)
+        with pytest.raises(RateLimitExceeded):
+            await client.afetch_user_starred_repos(user="octocat")
+
+    assert len(calls) == 1
+
+
+@pytest.mark.asyncio
+async def test_scheduler_computation_budget():
+    calls = []
+    routes = {"/users/octocat/starred": [[{"full_name": "repo1"}]]}
+    budget = ComputationBudget(max_requests=2)
+
+    async with build_flaky_client([], routes, calls) as http_client:
+        client = clients.GitHubRestClient(http_client=http_client)
+        with computation_budget(budget):
+            for _ in range(2):
+                await client.afetch_user_starred_repos(user="octocat")
+            with pytest.raises(BudgetExhausted):
+                await client.afetch_user_starred_repos(user="octocat")
+
+        # Out of the budget's context, requests are unbounded
+        await client.afetch_user_starred_repos(user="octocat")
+
+    assert len(calls) == 3
+    assert budget.to_dict() == {
+        "deadline_ms": None,
+        "max_requests": 2,
+        "requests": 2,
+        "exhausted": True,
+    }
+    assert ComputationBudget(deadline_ms=0).exhausted
+
+
+@pytest.mark.asyncio
+async def test_scheduler_retries_exhausted():
+    responses = [httpx.Response(502, json={"message": "Bad Gateway"})] * 3
+    scheduler = RequestScheduler(max_retries=2, backoff_base=0.001)
+
+    async with build_flaky_client(responses, {}, []) as http_client:
+        client = clients.GitHubRestClient(http_client=http_client, scheduler=scheduler)
+        with pytest.raises(clients.HTTPException) as exc_info:
+            await client.afetch_user_starred_repos(user="octocat")
+
+    assert exc_info.value.status_code == 502
+
+
+@pytest.mark.asyncio
+async def test_scheduler_rate_limit_exceeded():
+    reset = str(int(time.time() + 3600))
+    response = httpx.Response(
+        403,
+        headers={"x-ratelimit-remaining": "0", "x-ratelimit-reset": reset},
+        json={"message": "API rate limit exceeded"},
+    )
+    calls = []
+
+    async with build_flaky_client([response], {}, calls) as http_client:
+        client = clients.GitHubRestClient(http_client=http_client)
+        with pytest.raises(RateLimitExceeded):
+            await client.afetch_user_starred_repos(user="octocat")
+
+        # Budget is known as exhausted, nothing is sent anymore
+        with pytest.raises(RateLimitExceeded):
+            await client.afetch_user_starred_repos(user="octocat")
+
+    assert len(calls) == 1
+
+
+@pytest.mark.asyncio
+async def test_afind_neighbour_repos_rate_limited():
+    """Partial results are returned once the rate limit budget is exhausted"""
+    reset = str(int(time.time() + 3600))
+    routes = {
+        "/repos/octo/repo/stargazers": [[{"login": "user1"}, {"login": "user2"}]],
+        "/users/user1/starred": [[{"full_name": "repo1"}]],
+        "/users/user2/starred": [[{"full_name": "repo1"}]],
+    }
+    handler = build_github_mock_handler(routes)
+
+    def rate_limited_handler(request):
+        response = handler(request)
+        remaining = "4000" if "stargazers" in request.url.path else "0"
+        response.headers.update(
+            {
+                "x-ratelimit-limit": "5000",
+                "x-ratelimit-remaining": remaining,
+                "x-ratelimit-reset": reset,
+            }
+        )
+        return response
+
+    transport = httpx.MockTransport(rate_limited_handler)
+    async with httpx.AsyncClient(transport=transport) as http_client:
+        response, sorted_response = await afind_neighbour_repos(
+            owner="octo",
+            repo="repo",
+            token=None,
+            threshold=1,
+            http_client=http_client,
+            max_concurrency=1,
+            scheduler=RequestScheduler(rate_limit_reserve=10),
+        )
+
+    assert sorted_response == [
+        {"repo": "repo1", "stargazers_count": 1, "stargazers": ["user1"]}
+    ]
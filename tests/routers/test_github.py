@@ -0,0 +1,346 @@
+import asyncio
+import json
+import pytest
+import time
+
+from fastapi.testclient import TestClient
+
+from mergify_algos.app import app
+from mergify_algos.config import settings
+from mergify_algos.dependencies import get_github_options
+from mergify_algos.github.cache import StaleWhileRevalidateCache
+from mergify_algos.github.graph import StarGraphStore
+from mergify_algos.routers import github as github_router
+from tests.github.conftest import build_github_mock_client
+from tests.github.test_neighbours import MOCK_GITHUB_ROUTES
+
+EXPECTED_RESULTS = [
+    ("repo2", 3),
+    ("repo1", 2),
+    ("repo3", 2),
+    ("repo4", 2),
+    ("repo5", 1),
+]
+
+
+@pytest.fixture
+def client():
+    """App test client, answering GitHub requests from MOCK_GITHUB_ROUTES"""
+    with TestClient(app) as test_client:
+        http_client = build_github_mock_client(MOCK_GITHUB_ROUTES)
+        app.dependency_overrides[get_github_options] = lambda: {
+            "http_client": http_client,
+            "scheduler": None,
+            "cache": None,
+            "starred_cache": None,
+            "graph_store": None,
+            "base_url": "https://api.github.com",
+            "max_concurrency": 4,
+        }
+        yield test_client
+
+    app.dependency_overrides.clear()
+
+
+def _ranking(results):
+    return [(r["repo"], r["stargazers_count"]) for r in results]
+
+
+def test_compute_starneighbours(client):
+    response = client.get("/github/repos/octo/repo")
+
+    assert response.status_code == 200
+    assert _ranking(response.json()["results"]) == EXPECTED_RESULTS
+
+
+def test_compute_starneighbours_server_timing(client):
+    response = client.get("/github/repos/octo/repo")
+
+    assert response.status_code == 200
+    phases = [
+        metric.split(";")[0] for metric in response.headers["Server-Timing"].split(", ")
+    ]
+    assert phases == ["stargazers", "starred", "transform", "sort", "github", "total"]
+
+    metrics = client.get("/metrics")
+    assert metrics.status_code == 200
+    assert metrics.headers["content-type"].startswith("text/plain; version=0.0.4")
+    assert 'neighbours_phase_duration_seconds_count{phase="starred"}' in metrics.text
+    assert (
+        'github_request_duration_seconds_count{endpoint="starred",status="200"}'
+        in metrics.text
+    )
+    assert 'github_pages_total{endpoint="stargazers"}' in metrics.text
+
+
+def test_compute_starneighbours_profile(client, monkeypatch):
+    response = client.get("/github/repos/octo/repo", params={"profile": True})
+    assert response.status_code == 403
+
+    monkeypatch.setattr(settings, "admin_tokens", ["admin"])
+    response = client.get(
+        "/github/repos/octo/repo",
+        params={"profile": True},
+        headers={"X-Admin-Token": "admin"},
+    )
+
+    assert response.status_code == 200
+    body = response.json()
+    assert _ranking(body["results"]) == EXPECTED_RESULTS
+    assert set(body["profile"]) == {
+        "wall_seconds",
+        "cpu_seconds",
+        "event_loop",
+        "memory",
+        "functions",
+        "profile_path",
+    }
+    assert "profile" not in client.get("/github/repos/octo/repo").json()
+
+
+def test_compute_starneighbours_graphql_backend(client):
+    response = client.get("/github/repos/octo/repo", params={"backend": "graphql"})
+
+    assert response.status_code == 200
+    assert _ranking(response.json()["results"]) == EXPECTED_RESULTS
+
+
+def test_compute_starneighbours_approximate(client):
+    response = client.get(
+        "/github/repos/octo/repo", params={"approximate": True, "seed": 1}
+    )
+
+    assert response.status_code == 200
+    body = response.json()
+    assert body["algo-info"]["sampling"]["population"] == 4
+    assert body["algo-info"]["sampling"]["pages"] == [1]
+    assert all("stargazers_interval" in result for result in body["results"])
+
+
+def test_compute_starneighbours_ranking(client):
+    response = client.get(
+        "/github/repos/octo/repo",
+        params={"top_k": 4, "offset": 1, "limit": 2, "include_stargazers": "none"},
+    )
+
+    assert response.status_code == 200
+    body = response.json()
+    assert body["results"] == [
+        {"repo": "repo1", "stargazers_count": 2},
+        {"repo": "repo3", "stargazers_count": 2},
+    ]
+    assert body["algo-info"]["ranking"]["top_k"] == 4
+
+    response = client.get("/github/repos/octo/repo", params={"limit": 0})
+    assert response.status_code == 422
+
+
+def test_compute_starneighbours_budget(client):
+    response = client.get("/github/repos/octo/repo", params={"max_requests": 3})
+
+    assert response.status_code == 200
+    algo_info = response.json()["algo-info"]
+    assert algo_info["budget"] == {"deadline_ms": None, "max_requests": 3}
+    assert algo_info["coverage"]["requests"] == 3
+    assert algo_info["coverage"]["budget_exhausted"]
+
+    response = client.get("/github/repos/octo/repo", params={"deadline_ms": 0})
+    assert response.status_code == 422
+
+
+def test_compute_starneighbours_cache(client):
+    response = client.get("/github/repos/octo/repo")
+    assert response.json()["algo-info"]["cache"] == "miss"
+
+    response = client.get("/github/repos/Octo/Repo", params={"use_async": False})
+    assert response.json()["algo-info"]["cache"] == "hit"
+    assert _ranking(response.json()["results"]) == EXPECTED_RESULTS
+
+    # Pinned tokens' results aren't shared
+    response = client.get("/github/repos/octo/repo", params={"gh_token": "token"})
+    assert response.json()["algo-info"]["cache"] is None
+
+    stats = client.get("/github/cache/stats").json()["neighbours"]
+    assert (stats["hits"], stats["misses"]) == (1, 1)
+
+
+def test_compute_starneighbours_cache_partial_results(client):
+    # Budget exhausted: partial results aren't cached
+    for _ in range(2):
+        response = client.get("/github/repos/octo/repo", params={"max_requests": 3})
+        algo_info = response.json()["algo-info"]
+        assert algo_info["coverage"]["budget_exhausted"]
+        assert algo_info["cache"] == "miss"
+
+    response = client.get("/github/repos/octo/repo", params={"max_requests": 100})
+    assert response.json()["algo-info"]["cache"] == "miss"
+    response = client.get("/github/repos/octo/repo", params={"max_requests": 100})
+    assert response.json()["algo-info"]["cache"] == "hit"
+
+    rate_limited = {"stargazers_complete": True, "rate_limited": True}
+    assert not github_router._is_complete_result(([], rate_limited))
+
+
+@pytest.mark.asyncio
+async def test_warm_up_neighbours_cache():
+    neighbours_cache = StaleWhileRevalidateCache()
+    async with build_github_mock_client(MOCK_GITHUB_ROUTES) as http_client:
+        await github_router.warm_up_neighbours_cache(
+            neighbours_cache,
+            ["octo/repo", "octo/missing"],
+            {"http_client": http_client},
+            {},
+        )
+
+    assert len(neighbours_cache) == 1
+    key = github_router._neighbours_cache_key(
+        "octo", "repo", 2, 1, "rest", None, None, github_router.Ranking()
+    )
+    (sorted_results, _), status = await neighbours_cache.aget_or_compute(key, None)
+    assert status == "hit"
+    assert _ranking(sorted_results) == EXPECTED_RESULTS
+
+
+def test_batch_starneighbours(client):
+    response = client.post(
+        "/github/repos/neighbours:batch",
+        json={"repos": ["octo/repo", "octo/missing"], "top_k": 2},
+    )
+
+    assert response.status_code == 200
+    body = response.json()
+    assert _ranking(body["results"]["octo/repo"]["results"]) == EXPECTED_RESULTS[:2]
+    assert body["results"]["octo/missing"]["status_code"] == 404
+    assert body["algo-info"]["batch"]["unique_stargazers"] == 4
+
+    response = client.post("/github/repos/neighbours:batch", json={"repos": ["octo"]})
+    assert response.status_code == 422
+
+    response = client.post(
+        "/github/repos/neighbours:batch", json={"repos": ["octo/repo"], "threshold": 0}
+    )
+    assert response.status_code == 422
+    response = client.get("/github/repos/octo/repo", params={"threshold": 0})
+    assert response.status_code == 422
+
+
+def test_graphql_starneighbours(client):
+    response = client.get("/github/repos/octo/repo/graphql", params={"limit": 2})
+
+    assert response.status_code == 200
+    assert _ranking(response.json()["results"]) == EXPECTED_RESULTS[:2]
+
+
+def test_refresh_starneighbours(client):
+    response = client.post("/github/repos/octo/repo/refresh")
+    assert response.status_code == 400
+
+    github_options = app.dependency_overrides[get_github_options]()
+    github_options["graph_store"] = StarGraphStore()
+    app.dependency_overrides[get_github_options] = lambda: github_options
+
+    for new_stargazers in (4, 0):
+        response = client.post("/github/repos/octo/repo/refresh")
+        assert response.status_code == 200
+        body = response.json()
+        assert _ranking(body["results"]) == EXPECTED_RESULTS
+        assert body["algo-info"]["refresh"] == {
+            "new_stargazers": new_stargazers,
+            "stargazers": 4,
+            "complete": True,
+        }
+
+
+def test_starneighbours_pinned_token_skips_graph_store(client):
+    graph_store = StarGraphStore()
+    github_options = app.dependency_overrides[get_github_options]()
+    github_options["graph_store"] = graph_store
+    app.dependency_overrides[get_github_options] = lambda: github_options
+
+    response = client.get("/github/repos/octo/repo", params={"gh_token": "secret"})
+    assert response.status_code == 200
+    assert _ranking(response.json()["results"]) == EXPECTED_RESULTS
+    assert graph_store.stats()["users"] == 0
+    assert graph_store.stats()["misses"] == 0
+
+    response = client.post(
+        "/github/repos/octo/repo/refresh", params={"gh_token": "secret"}
+    )
+    assert response.status_code == 400
+
+    response = client.get("/github/repos/octo/repo")
+    assert response.status_code == 200
+    assert graph_store.stats()["users"] == 4
+
+
+def test_tokens_stats(client):
+    response = client.get("/github/tokens/stats")
+
+    assert response.status_code == 200
+    assert response.json() == {"tokens": []}
+
+
+def test_starneighbours_job(client):
+    response = client.post("/github/jobs", json={"owner": "octo", "repo": "repo"})
+    assert response.status_code == 202
+    job_id = response.json()["job_id"]
+
+    for _ in range(100):
+        job = client.get(f"/github/jobs/{job_id}").json()
+        if job["status"] == "done":
+            break
+        time.sleep(0.01)
+
+    assert job["status"] == "done"
+    assert job["progress"] == {
+        "stargazers_done": 4,
+        "stargazers_total": 4,
+        "stargazers_complete": True,
+        "rate_limited": False,
+    }
+    assert _ranking(job["result"]["results"]) == EXPECTED_RESULTS
+
+    assert client.get("/github/jobs/unknown").status_code == 404
+
+
+def test_starneighbours_job_dedup_per_token(client, monkeypatch):
+    async def slow_afind(**kwargs):
+        await asyncio.sleep(1)
+        return {}, []
+
+    monkeypatch.setattr(github_router.github, "afind_neighbour_repos", slow_afind)
+    job_ids = [
+        client.post("/github/jobs", json=json_request).json()["job_id"]
+        for json_request in (
+            {"owner": "octo", "repo": "repo"},
+            {"owner": "octo", "repo": "repo"},
+            {"owner": "octo", "repo": "repo", "gh_token": "private-token"},
+        )
+    ]
+
+    # A job computed with a caller's token isn't shared with other callers
+    assert job_ids[0] == job_ids[1] != job_ids[2]
+
+
+@pytest.mark.parametrize("stream_format", ["ndjson", "sse"])
+def test_stream_starneighbours(stream_format, client):
+    response = client.get(
+        "/github/repos/octo/repo/stream",
+        params={"snapshot_interval": 0, "top_n": 2, "stream_format": stream_format},
+    )
+    assert response.status_code == 200
+
+    if stream_format == "sse":
+        lines = [line[6:] for line in response.text.splitlines() if line[:5] == "data:"]
+    else:
+        lines = response.text.splitlines()
+    events = [json.loads(line) for line in lines]
+
+    assert {event["event"] for event in events} == {"progress", "snapshot", "result"}
+    assert all(len(e["results"]) <= 2 for e in events if e["event"] == "snapshot")
+    assert events[-2]["stargazers_done"] == 4
+    assert events[-1]["event"] == "result"
+    assert _ranking(events[-1]["results"]) == EXPECTED_RESULTS
+
+    response = client.get("/github/repos/octo/repo/stream", params={"top_n": 0})
+    assert response.status_code == 422
@@ -0,0 +1,55 @@
+import asyncio
+import pytest
+
+from mergify_algos.jobs import JOB_DONE, JOB_FAILED, JobManager, JobStore
+
+
+@pytest.mark.asyncio
+async def test_job_manager():
+    job_manager = JobManager()
+    calls = []
+
+    async def run(job):
+        calls.append(job.id)
+        job.update_progress(done=1, total=2)
+        await asyncio.sleep(0.01)
+        return {"results": [1, 2]}
+
+    job = job_manager.submit("key", {"a": 1}, run)
+    # Identical in-flight jobs are deduplicated
+    assert job_manager.submit("key", {"a": 1}, run) is job
+
+    await job.task
+    job_dict = job_manager.get(job.id)
+    assert job_dict["status"] == JOB_DONE
+    assert job_dict["progress"] == {"done": 1, "total": 2}
+    assert job_dict["result"] == {"results": [1, 2]}
+    assert len(calls) == 1
+
+    # Finished, a new job is submitted
+    job_bis = job_manager.submit("key", {"a": 1}, run)
+    assert job_bis.id != job.id
+    await job_manager.close()
+
+
+@pytest.mark.asyncio
+async def test_job_manager_failure_and_expiry(tmp_path):
+    path = str(tmp_path / "jobs.db")
+    job_manager = JobManager(store=JobStore(path=path))
+
+    async def run(job):
+        raise ValueError("boom")
+
+    job = job_manager.submit("key", {}, run)
+    await job.task
+    assert job_manager.get(job.id)["status"] == JOB_FAILED
+    assert job_manager.get("unknown") is None
+    await job_manager.close()
+
+    # Persisted on disk
+    assert JobStore(path=path).get(job.id)["error"] == "ValueError('boom')"
+
+    # Expired
+    store = JobStore(path=path, ttl=-1)
+    store.save(job)
+    assert store.get(job.id) is None
@@ -0,0 +1,62 @@
+import pytest
+
+from mergify_algos import metrics
+
+
+def test_metrics_registry_render():
+    registry = metrics.MetricsRegistry()
+    counter = registry.counter("pages_total", "Pages fetched", ("endpoint",))
+    histogram = registry.histogram(
+        "latency_seconds", "Requests latency", ("status",), buckets=(0.1, 1.0)
+    )
+
+    counter.inc(endpoint="starred")
+    counter.inc(2, endpoint="starred")
+    histogram.observe(0.05, status=200)
+    histogram.observe(0.5, status=200)
+    histogram.observe(5.0, status=200)
+
+    assert counter.get(endpoint="starred") == 3
+    assert histogram.get(status=200) == (3, 5.55)
+    assert registry.render().splitlines() == [
+        "# HELP pages_total Pages fetched",
+        "# TYPE pages_total counter",
+        'pages_total{endpoint="starred"} 3.0',
+        "# HELP latency_seconds Requests latency",
+        "# TYPE latency_seconds histogram",
+        'latency_seconds_bucket{status="200",le="0.1"} 1.0',
+        'latency_seconds_bucket{status="200",le="1.0"} 2.0',
+        'latency_seconds_bucket{status="200",le="+Inf"} 3.0',
+        'latency_seconds_count{status="200"} 3.0',
+        'latency_seconds_sum{status="200"} 5.55',
+    ]
+
+    with pytest.raises(ValueError):
+        counter.inc(status=200)
+    with pytest.raises(ValueError):
+        registry.counter("pages_total", "Duplicated")
+
+
+def test_request_timings():
+    assert metrics.current_request_timings() is None
+
+    with metrics.request_timings() as timings:
+        transform = metrics.PhaseTimer("transform")
+        for _ in range(3):
+            with transform:
+                pass
+        transform.record()
+        with metrics.phase_timer("sort"):
+            pass
+        metrics.observe_github_request("starred", 200, 0.25)
+        metrics.observe_github_request("starred", 200, 0.25)
+
+    assert metrics.current_request_timings() is None
+    assert list(timings.phases) == ["transform", "sort"]
+    assert timings.phases["transform"] == transform.seconds
+
+    header = timings.server_timing().split(", ")
+    assert header[0].startswith("transform;dur=")
+    assert header[1].startswith("sort;dur=")
+    assert header[2] == 'github;dur=500.0;desc="2 requests"'
+    assert header[3].startswith("total;dur=")
@@ -0,0 +1,54 @@
+import asyncio
+import pytest
+import time
+
+from fastapi import HTTPException
+
+from mergify_algos.profiling import RequestProfiler
+
+
+def _busy_function():
+    return sum(i * i for i in range(10_000))
+
+
+@pytest.mark.asyncio
+async def test_request_profiler():
+    profiler = RequestProfiler(top=50)
+
+    async with profiler:
+        await asyncio.sleep(0.02)
+        # Blocks the event loop
+        time.sleep(0.05)
+        await asyncio.to_thread(profiler.wrap(_busy_function))
+        data = [bytearray(1024) for _ in range(1000)]
+
+    report = profiler.report()
+    assert report["wall_seconds"] >= 0.07
+    assert report["event_loop"]["blocks"] >= 1
+    assert report["event_loop"]["max_lag_ms"] >= 40
+    assert report["memory"]["peak_mib"] >= 1
+    assert report["memory"]["top_allocations"]
+    # The wrapped function is profiled in its thread
+    assert any("_busy_function" in row["function"] for row in report["functions"])
+    assert report["profile_path"] is None
+    del data
+
+
+@pytest.mark.asyncio
+async def test_request_profiler_exclusive(tmp_path):
+    profiler = RequestProfiler(output_dir=str(tmp_path))
+
+    async with profiler:
+        with pytest.raises(HTTPException) as exc_info:
+            async with RequestProfiler():
+                pass
+        assert exc_info.value.status_code == 409
+
+    assert profiler.report()["profile_path"].startswith(str(tmp_path))
+
+    # Disabled: nothing is profiled
+    disabled = RequestProfiler(enabled=False)
+    async with disabled:
+        pass
+    assert disabled.report() is None
+    assert disabled.wrap(_busy_function) is _busy_function